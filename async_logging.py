@@ -0,0 +1,169 @@
+import sys
+import json
+import atexit
+import queue
+import logging
+import datetime
+import threading
+from logging.handlers import QueueHandler, QueueListener
+
+# 日志队列容量，队列满时丢弃新日志而不阻塞调用线程
+QUEUE_SIZE = 1000
+# 相同的警告/错误日志在该时间（秒）内只输出一次
+RATE_LIMIT_INTERVAL = 10.0
+# 限流只作用于该级别及以上的日志
+RATE_LIMIT_LEVEL = logging.WARNING
+# 限流记录的最大条数，超过后清理已过期的记录
+RATE_LIMIT_MAX_KEYS = 256
+# 文本格式
+TEXT_FORMAT = '%(asctime)s %(levelname)s [%(threadName)s] %(name)s: %(message)s'
+
+# 当前线程正在处理的帧编号，由检测流水线各阶段设置
+_context = threading.local()
+
+
+def set_frame(frame_id):
+    _context.frame = frame_id
+
+
+# 在产生日志的线程中给记录加上帧编号
+class FrameContextFilter(logging.Filter):
+    def filter(self, record):
+        record.frame = getattr(_context, 'frame', None)
+        return True
+
+
+# 重复日志限流：同一logger、级别和内容的日志在 interval 秒内只放行第一条，
+# 之后放行的那条带上期间省略的次数（record.repeated）
+class RateLimitFilter(logging.Filter):
+    def __init__(self, interval=RATE_LIMIT_INTERVAL, level=RATE_LIMIT_LEVEL, max_keys=RATE_LIMIT_MAX_KEYS):
+        super().__init__()
+        self.interval = interval
+        self.level = level
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._seen = {}
+        self.suppressed = 0
+
+    def filter(self, record):
+        if record.levelno < self.level:
+            return True
+        key = (record.name, record.levelno, record.getMessage())
+        now = record.created
+        with self._lock:
+            entry = self._seen.get(key)
+            if entry is not None and now - entry[0] < self.interval:
+                entry[1] += 1
+                self.suppressed += 1
+                return False
+            self._seen[key] = [now, 0]
+            if len(self._seen) > self.max_keys:
+                self._seen = {k: v for k, v in self._seen.items() if now - v[0] < self.interval}
+        if entry is not None and entry[1]:
+            record.repeated = entry[1]
+        return True
+
+
+# 每条日志输出为一行JSON：时间、级别、logger、线程、帧编号、内容和异常堆栈
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": datetime.datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            "ts": round(record.created, 6),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "msg": record.getMessage(),
+        }
+        frame = getattr(record, 'frame', None)
+        if frame is not None:
+            entry["frame"] = frame
+        repeated = getattr(record, 'repeated', None)
+        if repeated:
+            entry["repeated"] = repeated
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+
+# 文本格式，带帧编号和省略次数
+class TextFormatter(logging.Formatter):
+    def __init__(self, fmt=TEXT_FORMAT):
+        super().__init__(fmt)
+
+    def format(self, record):
+        text = super().format(record)
+        frame = getattr(record, 'frame', None)
+        if frame is not None:
+            text = f"{text} [帧 {frame}]"
+        repeated = getattr(record, 'repeated', None)
+        if repeated:
+            text = f"{text}（此前 {repeated} 条相同日志已省略）"
+        return text
+
+
+# 放入队列的日志处理器：在调用线程中只生成消息文本和异常堆栈，格式化和输出由后台线程完成；
+# 队列满时丢弃并计数，不阻塞检测循环
+class AsyncQueueHandler(QueueHandler):
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        message = record.getMessage()
+        exc_text = record.exc_text
+        if record.exc_info and not exc_text:
+            exc_text = logging.Formatter().formatException(record.exc_info)
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = message
+        record.args = None
+        record.exc_info = None
+        record.exc_text = exc_text
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+# 把根logger改为异步输出，返回 QueueListener（退出时交给 stop_logging）。
+# json_format 为 False 时输出文本；rate_limit_interval 为 None 时不限流
+def setup_logging(level=logging.INFO, json_format=True, rate_limit_interval=RATE_LIMIT_INTERVAL,
+                  stream=None, queue_size=QUEUE_SIZE):
+    output = logging.StreamHandler(stream if stream is not None else sys.stderr)
+    output.setFormatter(JsonFormatter() if json_format else TextFormatter())
+
+    handler = AsyncQueueHandler(queue.Queue(queue_size))
+    handler.addFilter(FrameContextFilter())
+    if rate_limit_interval:
+        handler.addFilter(RateLimitFilter(rate_limit_interval))
+
+    root = logging.getLogger()
+    for old in list(root.handlers):
+        root.removeHandler(old)
+        old.close()
+    root.addHandler(handler)
+    root.setLevel(level)
+
+    listener = QueueListener(handler.queue, output)
+    listener.handler = handler
+    listener.start()
+    atexit.register(stop_logging, listener)
+    return listener
+
+
+# 输出队列中剩余的日志并停止后台线程，之后的日志直接同步输出；可重复调用
+def stop_logging(listener):
+    root = logging.getLogger()
+    if listener.handler not in root.handlers:
+        return
+    root.removeHandler(listener.handler)
+    listener.stop()
+    for output in listener.handlers:
+        root.addHandler(output)
+    if listener.handler.dropped:
+        logging.getLogger(__name__).warning(f"日志队列已满，共丢弃 {listener.handler.dropped} 条日志")
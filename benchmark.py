@@ -0,0 +1,265 @@
+import os
+import sys
+import json
+import time
+import socket
+import logging
+import platform
+import argparse
+import subprocess
+import cv2
+import numpy as np
+from escpos.printer import Dummy
+
+import yolo_nebulizer as yn
+from camera import REDUCED_DECODE_FLAGS
+from inference_backend import BACKENDS, load_backend
+
+logger = logging.getLogger(__name__)
+
+# 各测试项默认的迭代次数
+DEFAULT_ITERATIONS = 50
+# 正式计时前的预热次数
+WARMUP_ITERATIONS = 3
+# 合成帧尺寸（与常见USB摄像头默认分辨率一致）
+FRAME_SHAPE = (480, 640, 3)
+# 绘制测试中每帧的检测框数量
+OVERLAY_BOX_COUNTS = (1, 10, 50)
+# 触发判断测试中每帧的检测框数量
+TRIGGER_BOX_COUNTS = (0, 5, 50)
+# MJPEG解码测试使用的采集分辨率和JPEG质量
+DECODE_FRAME_SIZE = (1280, 720)
+DECODE_JPEG_QUALITY = 80
+# 仓库自带的Logo图片，现场路径不存在时使用
+LOCAL_LOGO_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'logo2.png')
+
+
+# 耗时分布摘要（毫秒）
+def summarize(timings):
+    values = np.asarray(timings) * 1000
+    return {
+        "iterations": int(values.size),
+        "mean_ms": float(values.mean()),
+        "min_ms": float(values.min()),
+        "p50_ms": float(np.percentile(values, 50)),
+        "p95_ms": float(np.percentile(values, 95)),
+        "p99_ms": float(np.percentile(values, 99)),
+        "max_ms": float(values.max()),
+    }
+
+
+# 重复执行 fn 并统计耗时，setup 在每次计时前执行且不计入耗时
+def measure(fn, iterations=DEFAULT_ITERATIONS, warmup=WARMUP_ITERATIONS, setup=None):
+    timings = []
+    for i in range(warmup + iterations):
+        args = (setup(),) if setup else ()
+        start = time.perf_counter()
+        fn(*args)
+        elapsed = time.perf_counter() - start
+        if i >= warmup:
+            timings.append(elapsed)
+    return summarize(timings)
+
+
+# 生成合成检测结果
+def synthetic_detections(rng, count, width=FRAME_SHAPE[1], height=FRAME_SHAPE[0]):
+    x1 = rng.uniform(0, width - 60, count)
+    y1 = rng.uniform(0, height - 60, count)
+    boxes = np.stack([x1, y1, x1 + rng.uniform(20, 60, count), y1 + rng.uniform(20, 60, count)], axis=1)
+    confidences = rng.uniform(0.2, 1.0, count).astype(np.float32)
+    class_ids = rng.integers(0, yn.NUM_CLASSES, count)
+    return boxes.astype(np.float32), confidences, class_ids
+
+
+def load_frame(path):
+    if path:
+        frame = cv2.imread(path)
+        if frame is None:
+            raise FileNotFoundError(f"无法读取图片: {path}")
+        return frame
+    return np.random.default_rng(0).integers(0, 255, FRAME_SHAPE, dtype=np.uint8)
+
+
+# 模型加载与单帧推理耗时（按后端和输入尺寸）
+def bench_inference(backends, sizes, frame, iterations):
+    results = {}
+    for name in backends:
+        start = time.perf_counter()
+        try:
+            backend = load_backend(name, yn.MODEL_PATH, max(sizes))
+        except Exception as e:
+            results[name] = {"error": str(e)}
+            continue
+        load_ms = (time.perf_counter() - start) * 1000
+        if backend.name != name:
+            results[name] = {"error": f"后端不可用，已回退到 {backend.name}"}
+            continue
+
+        entry = {"load_ms": load_ms, "imgsz": {}}
+        for imgsz in sizes:
+            sized = backend
+            if imgsz != max(sizes) and not backend.dynamic_imgsz:
+                # 导出的静态形状模型需要按尺寸单独导出和加载
+                sized = load_backend(name, yn.MODEL_PATH, imgsz)
+            entry["imgsz"][str(imgsz)] = measure(lambda: sized.predict(frame, imgsz), iterations)
+        results[name] = entry
+    return results
+
+
+# 检测框/标签/状态信息的绘制耗时
+def bench_overlay(frame, iterations):
+    rng = np.random.default_rng(1)
+    results = {}
+    for count in OVERLAY_BOX_COUNTS:
+        boxes, confidences, class_ids = synthetic_detections(rng, count)
+
+        def setup():
+            packet = yn.FramePacket(0, frame.copy(), 0.0)
+            packet.boxes, packet.confidences, packet.class_ids = boxes, confidences, class_ids
+            packet.avg_confidence = np.full(yn.NUM_CLASSES, 0.9)
+            packet.durations = np.full(yn.NUM_CLASSES, 1.5)
+            return packet
+
+        results[f"{count}_boxes"] = measure(lambda packet: yn.draw_overlay(packet, 10.0, frame.shape[0]),
+                                            iterations, setup=setup)
+    return results
+
+
+# MJPEG帧解码耗时：全分辨率解码后缩小 与 DCT缩放直接解码 的比较
+def bench_decode(frame, iterations):
+    source = cv2.resize(frame, DECODE_FRAME_SIZE, interpolation=cv2.INTER_LINEAR)
+    data = cv2.imencode('.jpg', source, [cv2.IMWRITE_JPEG_QUALITY, DECODE_JPEG_QUALITY])[1]
+    half = (DECODE_FRAME_SIZE[0] // 2, DECODE_FRAME_SIZE[1] // 2)
+
+    results = {"jpeg_bytes": int(data.size)}
+    results["full"] = measure(lambda: cv2.imdecode(data, cv2.IMREAD_COLOR), iterations)
+    results["full_then_resize_2"] = measure(
+        lambda: cv2.resize(cv2.imdecode(data, cv2.IMREAD_COLOR), half, interpolation=cv2.INTER_AREA), iterations)
+    for scale, flag in REDUCED_DECODE_FLAGS.items():
+        if scale > 1:
+            results[f"reduced_{scale}"] = measure(lambda: cv2.imdecode(data, flag), iterations)
+    return results
+
+
+# 触发判断在合成检测流上的单帧耗时
+def bench_trigger(iterations):
+    rng = np.random.default_rng(2)
+    results = {}
+    for count in TRIGGER_BOX_COUNTS:
+        frames = [synthetic_detections(rng, count) for _ in range(256)]
+        engine = yn.create_trigger_engine(clock=lambda: 0.0)
+        state = {"index": 0}
+
+        def step():
+            boxes, confidences, class_ids = frames[state["index"] % len(frames)]
+            state["index"] += 1
+            # 每帧推进1/30秒；触发事件只标记不进入暂停，以便持续测量判断路径
+            events = engine.update(state["index"] / 30, class_ids, confidences)
+            for event in events:
+                engine.mark_triggered(event.class_id)
+
+        results[f"{count}_boxes"] = measure(step, iterations * 20)
+    return results
+
+
+# 生成ESC/POS打印数据的耗时（Logo、五种检测信息小票及其预编译版本）
+def bench_printing(iterations):
+    printer = Dummy()
+    results = {}
+
+    def render(fn):
+        def run():
+            fn()
+            printer.clear()
+        return run
+
+    results["print_logo"] = measure(render(lambda: yn.print_logo(printer)), iterations)
+    yn.print_logo(printer)
+    results["print_logo"]["bytes"] = len(printer.output)
+    printer.clear()
+
+    for class_id, label in yn.CLASS_NAMES.items():
+        key = f"print_detection_info_{label}"
+        results[key] = measure(render(lambda: yn.print_detection_info(printer, class_id, 0.9)), iterations)
+        yn.print_detection_info(printer, class_id, 0.9)
+        results[key]["bytes"] = len(printer.output)
+        printer.clear()
+
+    # 预编译小票：编译一次后每次只填入时间并整体发送
+    for class_id, label in yn.CLASS_NAMES.items():
+        key = f"print_receipt_{label}"
+        start = time.perf_counter()
+        yn.receipt_compiler.get(class_id)
+        compile_ms = (time.perf_counter() - start) * 1000
+        results[key] = measure(render(lambda: yn.print_receipt(printer, class_id, 0.9)), iterations)
+        yn.print_receipt(printer, class_id, 0.9)
+        results[key]["bytes"] = len(printer.output)
+        results[key]["compile_ms"] = compile_ms
+        printer.clear()
+    return results
+
+
+# 运行环境信息，便于跨提交和硬件比较结果
+def environment():
+    commit = None
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5).stdout.strip() or None
+    except Exception:
+        pass
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": commit,
+        "host": socket.gethostname(),
+        "platform": platform.platform(),
+        "processor": platform.processor() or platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "opencv": cv2.__version__,
+    }
+
+
+SECTIONS = ('inference', 'decode', 'overlay', 'trigger', 'printing')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="性能基准测试：模型加载与推理、MJPEG解码、绘制、触发判断和ESC/POS打印数据生成")
+    parser.add_argument('--sections', nargs='+', default=list(SECTIONS), choices=SECTIONS, help="要运行的测试项")
+    parser.add_argument('--backends', nargs='+', default=['pytorch'], choices=list(BACKENDS), help="推理后端")
+    parser.add_argument('--imgsz', nargs='+', type=int, default=[320, yn.INFERENCE_IMGSZ], help="推理输入尺寸")
+    parser.add_argument('--frame', help="用于推理和绘制测试的图片，默认使用随机合成帧")
+    parser.add_argument('--iterations', type=int, default=DEFAULT_ITERATIONS, help="每个测试项的迭代次数")
+    parser.add_argument('--logo', help="Logo图片路径")
+    parser.add_argument('--output', help="将结果写入JSON文件")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    if args.logo:
+        yn.LOGO_PATH = args.logo
+    elif not os.path.exists(yn.LOGO_PATH):
+        yn.LOGO_PATH = LOCAL_LOGO_PATH
+
+    frame = load_frame(args.frame)
+    results = {"environment": environment(), "results": {}}
+    if 'inference' in args.sections:
+        results["results"]["inference"] = bench_inference(args.backends, args.imgsz, frame, args.iterations)
+    if 'decode' in args.sections:
+        results["results"]["decode"] = bench_decode(frame, args.iterations)
+    if 'overlay' in args.sections:
+        results["results"]["overlay"] = bench_overlay(frame, args.iterations)
+    if 'trigger' in args.sections:
+        results["results"]["trigger"] = bench_trigger(args.iterations)
+    if 'printing' in args.sections:
+        results["results"]["printing"] = bench_printing(args.iterations)
+
+    text = json.dumps(results, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text)
+    print(text)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
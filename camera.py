@@ -0,0 +1,323 @@
+import cv2
+import time
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# 等待新帧的默认超时时间（秒）
+FRAME_READ_TIMEOUT = 2.0
+# libjpeg DCT缩放解码支持的缩小倍数及对应的 imdecode 标志
+REDUCED_DECODE_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
+
+# 后台采集线程：持续读取摄像头，只保留最新一帧（单槽缓冲，旧帧直接丢弃）
+# 检测循环通过 read() 取帧，永远拿到的是最新画面，而不是V4L2队列中积压的旧帧
+# decode 不为 None 时，在采集线程中把读到的原始数据（如MJPEG）解码为图像，解码失败的帧直接丢弃
+class LatestFrameGrabber:
+    def __init__(self, cap, decode=None):
+        self.cap = cap
+        self.decode = decode
+        self._cond = threading.Condition()
+        self._thread = None
+        self._running = False
+        self._failed = False
+        self._frame = None
+        self._frame_id = 0
+        self._consumed_id = 0
+
+        self._suspended = False
+        self._waiting_since = None
+        self._waiting_for = None
+
+        # 统计计数：采集帧数 / 未被消费即被覆盖的帧数 / 被检测循环取走的帧数 / 挂起期间丢弃的帧数
+        self.frames_captured = 0
+        self.frames_dropped = 0
+        self.frames_consumed = 0
+        self.frames_discarded = 0
+        self.frames_corrupt = 0
+        # 启动/最近一次恢复后得到第一帧所用的时间（秒）
+        self.first_frame_latency = {"start": None, "resume": None}
+
+    # 启动采集线程
+    def start(self):
+        if self._thread is not None:
+            return self
+        self._running = True
+        self._failed = False
+        self._waiting_since = time.perf_counter()
+        self._waiting_for = "start"
+        self._thread = threading.Thread(target=self._capture_loop, name="frame-grabber", daemon=True)
+        self._thread.start()
+        return self
+
+    def _capture_loop(self):
+        while self._running:
+            # 挂起期间只取出并丢弃帧（不解码），保持设备持续输出、自动曝光稳定
+            suspended = self._suspended
+            if suspended:
+                ret, frame = self.cap.grab(), None
+            else:
+                ret, frame = self.cap.read()
+            if not ret:
+                logger.error("采集线程无法读取帧")
+                with self._cond:
+                    self._failed = True
+                    self._cond.notify_all()
+                return
+            if frame is not None and self.decode is not None:
+                frame = self.decode(frame)
+                if frame is None:
+                    self.frames_corrupt += 1
+                    continue
+
+            with self._cond:
+                if suspended or self._suspended:
+                    self.frames_discarded += 1
+                    continue
+                if self._waiting_since is not None:
+                    self.first_frame_latency[self._waiting_for] = time.perf_counter() - self._waiting_since
+                    self._waiting_since = None
+                # 上一帧还没被取走就被新帧覆盖，计为丢弃
+                if self._frame_id > self._consumed_id:
+                    self.frames_dropped += 1
+                self._frame = frame
+                self._frame_id += 1
+                self.frames_captured += 1
+                self._cond.notify_all()
+
+    # 获取最新一帧，接口与 cv2.VideoCapture.read() 一致，返回 (ret, frame)
+    # 若当前帧已被取走，则阻塞等待下一帧，超时或采集失败时返回 (False, None)
+    def read(self, timeout=FRAME_READ_TIMEOUT):
+        with self._cond:
+            self._cond.wait_for(
+                lambda: self._frame_id > self._consumed_id or self._failed or not self._running,
+                timeout)
+            if self._frame_id <= self._consumed_id:
+                return False, None
+            self._consumed_id = self._frame_id
+            self.frames_consumed += 1
+            return True, self._frame
+
+    # 挂起：设备保持打开，采集线程丢弃所有帧，read() 不再返回新帧
+    def suspend(self):
+        with self._cond:
+            self._suspended = True
+            self._cond.notify_all()
+
+    # 恢复：挂起前的旧帧作废，read() 等待恢复后的第一帧
+    def resume(self):
+        with self._cond:
+            self._suspended = False
+            self._consumed_id = self._frame_id
+            self._waiting_since = time.perf_counter()
+            self._waiting_for = "resume"
+
+    def is_suspended(self):
+        return self._suspended
+
+    # 采集线程是否仍在正常运行
+    def is_alive(self):
+        return self._running and not self._failed
+
+    # 停止采集线程（不释放摄像头）
+    def stop(self):
+        self._running = False
+        with self._cond:
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout=FRAME_READ_TIMEOUT)
+            self._thread = None
+
+    # 停止采集线程并释放摄像头
+    def release(self):
+        self.stop()
+        self.cap.release()
+
+    # 返回采集统计信息
+    def stats(self):
+        with self._cond:
+            return {
+                "captured": self.frames_captured,
+                "dropped": self.frames_dropped,
+                "consumed": self.frames_consumed,
+                "discarded": self.frames_discarded,
+                "corrupt": self.frames_corrupt,
+            }
+
+
+# 把 CAP_PROP_FOURCC 返回的整数还原为四字符编码
+def fourcc_to_str(value):
+    value = int(value)
+    return ''.join(chr((value >> (8 * i)) & 0xFF) for i in range(4)).strip('\x00')
+
+
+# 选择最大的DCT缩放倍数，使解码后的长边仍不小于 target
+def reduced_decode_scale(width, height, target):
+    scale = 1
+    for candidate in sorted(REDUCED_DECODE_FLAGS):
+        if max(width, height) / candidate >= target:
+            scale = candidate
+    return scale
+
+
+# 以DCT缩放方式解码MJPEG帧，跳过全分辨率解码和之后的缩小
+def make_mjpeg_decoder(scale):
+    flag = REDUCED_DECODE_FLAGS[scale]
+
+    def decode(data):
+        return cv2.imdecode(data, flag)
+    return decode
+
+
+# 是否为V4L2在关闭RGB转换后返回的原始JPEG数据（单行uint8，以SOI标记 FFD8 开头）
+def is_raw_jpeg(frame):
+    return (frame is not None and frame.dtype == 'uint8' and frame.size > 2 and
+            (frame.ndim == 1 or frame.shape[0] == 1) and
+            frame.flat[0] == 0xFF and frame.flat[1] == 0xD8)
+
+
+# 摄像头管理：打开时一次性设置分辨率/帧率/FOURCC/缓冲区数量，暂停期间挂起采集而不释放设备，
+# 并记录打开/重新打开耗时和得到第一帧的延迟。参数为 None 时使用驱动默认值。
+# decode_target 不为 None 且摄像头输出MJPEG时，直接以DCT缩放解码到长边不小于 decode_target 的尺寸
+class CameraManager:
+    def __init__(self, index=0, width=None, height=None, fps=None, fourcc=None, buffer_size=None,
+                 decode_target=None):
+        self.index = index
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.fourcc = fourcc
+        self.buffer_size = buffer_size
+        self.decode_target = decode_target
+        self.grabber = None
+        self.frame_size = (0, 0)
+        self.decode_scale = None
+
+        self.open_count = 0
+        self.open_time = None
+        # 已释放的采集线程的帧数统计，重新打开摄像头后继续累加，计数不会倒退
+        self._released_counts = {"captured": 0, "dropped": 0, "consumed": 0, "discarded": 0, "corrupt": 0}
+        self._lock = threading.Lock()
+
+    # 按配置设置摄像头参数（FOURCC需在分辨率之前设置，部分驱动切换格式时会重置分辨率）
+    def _configure(self, cap):
+        if self.fourcc:
+            cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*self.fourcc))
+        if self.width:
+            cap.set(cv2.CAP_PROP_FRAME_WIDTH, self.width)
+        if self.height:
+            cap.set(cv2.CAP_PROP_FRAME_HEIGHT, self.height)
+        if self.fps:
+            cap.set(cv2.CAP_PROP_FPS, self.fps)
+        if self.buffer_size:
+            cap.set(cv2.CAP_PROP_BUFFERSIZE, self.buffer_size)
+
+    # 关闭RGB转换以取得原始MJPEG数据，返回缩小解码函数；摄像头不是MJPEG格式或后端不支持时返回 None
+    def _setup_reduced_decode(self, cap, width, height):
+        if fourcc_to_str(cap.get(cv2.CAP_PROP_FOURCC)) != 'MJPG':
+            logger.warning("摄像头未输出MJPEG，不使用缩小解码")
+            return None
+        if not cap.set(cv2.CAP_PROP_CONVERT_RGB, 0):
+            logger.warning("采集后端不支持输出原始MJPEG数据，不使用缩小解码")
+            return None
+        ret, frame = cap.read()
+        if not ret or not is_raw_jpeg(frame):
+            logger.warning("采集后端不支持输出原始MJPEG数据，不使用缩小解码")
+            cap.set(cv2.CAP_PROP_CONVERT_RGB, 1)
+            return None
+        self.decode_scale = reduced_decode_scale(width, height, self.decode_target)
+        return make_mjpeg_decoder(self.decode_scale)
+
+    # 打开摄像头并启动后台采集线程，失败时返回 False
+    def open(self):
+        start = time.perf_counter()
+        cap = cv2.VideoCapture(self.index)
+        if not cap.isOpened():
+            logger.error(f"无法打开摄像头 {self.index}")
+            return False
+        self._configure(cap)
+        width, height = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+
+        self.decode_scale = None
+        decode = self._setup_reduced_decode(cap, width, height) if self.decode_target else None
+        scale = self.decode_scale or 1
+        # libjpeg缩放解码的输出尺寸向上取整
+        self.frame_size = (-(-width // scale), -(-height // scale))
+
+        self.open_time = time.perf_counter() - start
+        self.open_count += 1
+        self.grabber = LatestFrameGrabber(cap, decode).start()
+
+        logger.info(f"摄像头已打开: {width}x{height}，"
+                    f"{cap.get(cv2.CAP_PROP_FPS):.0f}fps，格式 {fourcc_to_str(cap.get(cv2.CAP_PROP_FOURCC)) or '未知'}，"
+                    f"解码尺寸 {self.frame_size[0]}x{self.frame_size[1]}，用时 {self.open_time * 1000:.0f} 毫秒")
+        return True
+
+    # 采集失败后释放并重新打开设备
+    def reopen(self):
+        self.release()
+        logger.info("重新打开摄像头")
+        return self.open()
+
+    # 读取最新一帧，返回 (ret, frame)
+    # 设备可能在其他线程中被释放，先取出 grabber 再使用
+    def read(self, timeout=FRAME_READ_TIMEOUT):
+        grabber = self.grabber
+        if grabber is None or grabber.is_suspended():
+            return False, None
+        return grabber.read(timeout)
+
+    def suspend(self):
+        grabber = self.grabber
+        if grabber is not None:
+            grabber.suspend()
+
+    def resume(self):
+        grabber = self.grabber
+        if grabber is not None:
+            grabber.resume()
+
+    def is_suspended(self):
+        grabber = self.grabber
+        return grabber is not None and grabber.is_suspended()
+
+    # 设备已打开且采集线程正常运行
+    def is_alive(self):
+        grabber = self.grabber
+        return grabber is not None and grabber.is_alive()
+
+    def release(self):
+        with self._lock:
+            grabber, self.grabber = self.grabber, None
+            if grabber is not None:
+                grabber.release()
+                for key, value in grabber.stats().items():
+                    self._released_counts[key] += value
+
+    # 累计采集统计（包括此前打开的设备）及打开耗时、第一帧延迟（毫秒）
+    def stats(self):
+        with self._lock:
+            grabber = self.grabber
+            counts = dict(self._released_counts)
+            if grabber is not None:
+                for key, value in grabber.stats().items():
+                    counts[key] += value
+        if grabber is None:
+            return {**counts, "opens": self.open_count, "open_ms": None, "first_frame_ms": None,
+                    "resume_first_frame_ms": None}
+        latency = grabber.first_frame_latency
+        return {
+            **counts,
+            "opens": self.open_count,
+            "open_ms": self.open_time * 1000,
+            # 从开始打开设备到得到第一帧的时间
+            "first_frame_ms": None if latency["start"] is None else (self.open_time + latency["start"]) * 1000,
+            # 最近一次从挂起恢复到得到第一帧的时间
+            "resume_first_frame_ms": None if latency["resume"] is None else latency["resume"] * 1000,
+        }
@@ -0,0 +1,69 @@
+import numpy as np
+
+
+# 每个类别在本帧中的最高置信度，未出现的类别为0；超出范围的类别ID被忽略
+def per_class_max(class_ids, confidences, num_classes):
+    class_ids = np.asarray(class_ids, dtype=np.intp)
+    confidences = np.asarray(confidences, dtype=np.float64)
+    valid = (class_ids >= 0) & (class_ids < num_classes)
+    class_ids = class_ids[valid]
+
+    max_conf = np.zeros(num_classes, dtype=np.float64)
+    np.maximum.at(max_conf, class_ids, confidences[valid])
+    present = np.zeros(num_classes, dtype=bool)
+    present[class_ids] = True
+    return present, max_conf
+
+
+# 按类别ID索引的检测状态：
+# - 置信度历史为 (类别数 × 历史长度) 的环形缓冲区，配合累加和在O(1)内得到平滑后的平均置信度
+# - 持续时间以每个类别的开始时间表示，本帧未出现的类别清零
+class DetectionTracker:
+    def __init__(self, num_classes, history_length):
+        self.num_classes = num_classes
+        self.history_length = history_length
+        self.history = np.zeros((num_classes, history_length), dtype=np.float64)
+        self.sums = np.zeros(num_classes, dtype=np.float64)
+        self.counts = np.zeros(num_classes, dtype=np.intp)
+        self.heads = np.zeros(num_classes, dtype=np.intp)
+        self.start_times = np.full(num_classes, np.nan)
+
+    # 用一帧的检测结果更新状态，返回 (present, avg_confidence, durations) 三个按类别ID索引的数组
+    def update(self, timestamp, class_ids, confidences):
+        present, max_conf = per_class_max(class_ids, confidences, self.num_classes)
+        seen = np.flatnonzero(present)
+
+        if seen.size:
+            # 环形缓冲区写入：缓冲区已满时先从累加和中减去被覆盖的旧值
+            pos = self.heads[seen]
+            evicted = np.where(self.counts[seen] >= self.history_length, self.history[seen, pos], 0.0)
+            self.history[seen, pos] = max_conf[seen]
+            self.sums[seen] += max_conf[seen] - evicted
+            self.heads[seen] = (pos + 1) % self.history_length
+            self.counts[seen] = np.minimum(self.counts[seen] + 1, self.history_length)
+
+            # 每绕一圈重新求和一次，避免浮点累加误差
+            wrapped = seen[self.heads[seen] == 0]
+            if wrapped.size:
+                self.sums[wrapped] = self.history[wrapped].sum(axis=1)
+
+        avg_confidence = np.divide(self.sums, self.counts, out=np.zeros(self.num_classes),
+                                   where=self.counts > 0)
+
+        # 更新检测持续时间：新出现的类别开始计时，消失的类别清除记录
+        self.start_times[present & np.isnan(self.start_times)] = timestamp
+        self.start_times[~present] = np.nan
+        durations = np.where(present, timestamp - np.nan_to_num(self.start_times, nan=timestamp), 0.0)
+        return present, avg_confidence, durations
+
+    # 清除所有检测持续时间记录
+    def clear_durations(self):
+        self.start_times[:] = np.nan
+
+    # 清除所有检测持续时间记录和置信度历史
+    def clear(self):
+        self.history[:] = 0.0
+        self.sums[:] = 0.0
+        self.counts[:] = 0
+        self.heads[:] = 0
+        self.clear_durations()
@@ -0,0 +1,170 @@
+import time
+import logging
+import threading
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+# 首次重连前的等待时间和退避上限（秒）
+INITIAL_BACKOFF = 1.0
+MAX_BACKOFF = 30.0
+# 已连接时健康检查的间隔（秒）
+CHECK_INTERVAL = 1.0
+
+
+# 设备监护：后台线程负责连接设备，连接断开（健康检查失败或使用方报告错误）后立即重连一次，
+# 之后按指数退避重试。断开期间 get() 返回 None，使用方据此降级运行。
+# connect() 返回设备对象，失败时返回 None 或抛出异常；close(device) 释放设备；check(device) 返回设备是否正常；
+# 连接成功后调用 on_connect(device)，运行中断开时调用 on_disconnect(error)
+class DeviceSupervisor:
+    def __init__(self, name, connect, close=None, check=None, initial_backoff=INITIAL_BACKOFF,
+                 max_backoff=MAX_BACKOFF, check_interval=CHECK_INTERVAL, on_connect=None, on_disconnect=None):
+        self.name = name
+        self.connect = connect
+        self.close = close
+        self.check = check
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.check_interval = check_interval
+        self.on_connect = on_connect
+        self.on_disconnect = on_disconnect
+
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._device = None
+        self._backoff = initial_backoff
+        self._next_attempt = 0.0
+        self._down_since = time.monotonic()
+
+        self.counts = Counter()
+        self.downtime = 0.0
+        self.last_error = None
+
+    # 当前连接的设备，断开时返回 None
+    def get(self):
+        return self._device
+
+    def is_connected(self):
+        return self._device is not None
+
+    # 尝试连接一次，失败时按退避时间安排下一次尝试
+    def _try_connect(self):
+        self.counts['attempts'] += 1
+        attempt_start = time.monotonic()
+        error = None
+        try:
+            device = self.connect()
+        except Exception as e:
+            device, error = None, e
+
+        now = time.monotonic()
+        if device is None:
+            self.last_error = str(error) if error is not None else "连接失败"
+            self._next_attempt = now + self._backoff
+            logger.warning(f"{self.name}连接失败: {self.last_error}，{self._backoff:g} 秒后重试")
+            self._backoff = min(self._backoff * 2, self.max_backoff)
+            return False
+
+        with self._lock:
+            self._device = device
+            self._backoff = self.initial_backoff
+            # 离线时间算到成功的这次尝试开始为止，不含连接本身的耗时
+            self.downtime += max(attempt_start - self._down_since, 0.0)
+            self._down_since = None
+            self.counts['connects'] += 1
+        if self.counts['connects'] > 1:
+            logger.info(f"{self.name}已重新连接")
+        if self.on_connect is not None:
+            try:
+                self.on_connect(device)
+            except Exception as e:
+                logger.error(f"{self.name}连接回调出错: {e}")
+        return True
+
+    def _close(self, device):
+        if self.close is None:
+            return
+        try:
+            self.close(device)
+        except Exception as e:
+            logger.debug(f"释放{self.name}时出错: {e}")
+
+    # 使用方发现设备出错时调用；device 不是当前设备（已经重连过）时忽略
+    def report_failure(self, error=None, device=None):
+        with self._lock:
+            current = self._device
+            if current is None or (device is not None and device is not current):
+                return
+            self._device = None
+            self._down_since = time.monotonic()
+            self._next_attempt = 0.0
+            self.counts['disconnects'] += 1
+            self.last_error = str(error) if error is not None else "设备异常"
+        logger.error(f"{self.name}已断开: {self.last_error}，开始重连")
+        self._close(current)
+        if self.on_disconnect is not None:
+            try:
+                self.on_disconnect(self.last_error)
+            except Exception as e:
+                logger.error(f"{self.name}断开回调出错: {e}")
+        self._wake.set()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            device = self._device
+            if device is None:
+                if time.monotonic() >= self._next_attempt:
+                    self._try_connect()
+            elif self.check is not None:
+                try:
+                    ok = self.check(device)
+                except Exception as e:
+                    ok = False
+                    logger.debug(f"{self.name}健康检查出错: {e}")
+                if not ok:
+                    self.report_failure("健康检查失败", device)
+                    continue
+
+            if self._device is None:
+                wait = min(max(self._next_attempt - time.monotonic(), 0.0), self.check_interval)
+            else:
+                wait = self.check_interval
+            self._wake.wait(wait)
+            self._wake.clear()
+
+    # 在当前线程中先连接一次，再启动后台监护线程
+    def start(self):
+        self._stopped.clear()
+        self._down_since = time.monotonic()
+        self._try_connect()
+        self._thread = threading.Thread(target=self._run, name=f"supervisor-{self.name}", daemon=True)
+        self._thread.start()
+        return self
+
+    # 停止监护线程并释放设备
+    def stop(self):
+        self._stopped.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.check_interval + 1)
+            self._thread = None
+        with self._lock:
+            device, self._device = self._device, None
+        if device is not None:
+            self._close(device)
+
+    def stats(self):
+        with self._lock:
+            downtime = self.downtime
+            if self._down_since is not None:
+                downtime += time.monotonic() - self._down_since
+            return {
+                "connected": self._device is not None,
+                "connects": self.counts['connects'],
+                "disconnects": self.counts['disconnects'],
+                "attempts": self.counts['attempts'],
+                "downtime": downtime,
+                "last_error": self.last_error,
+            }
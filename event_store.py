@@ -0,0 +1,274 @@
+import os
+import sys
+import json
+import math
+import time
+import queue
+import sqlite3
+import logging
+import argparse
+import threading
+from collections import Counter, defaultdict
+
+logger = logging.getLogger(__name__)
+
+# 事件数据库默认路径
+DEFAULT_DB_PATH = 'events.db'
+# 每批写入的最大事件数，以及事件最多在内存中停留多久（秒）
+BATCH_SIZE = 200
+FLUSH_INTERVAL = 1.0
+# 待写入队列容量，队列满时丢弃新事件而不阻塞调用线程
+QUEUE_SIZE = 2000
+# 停止时等待剩余事件写入的最长时间（秒）
+STOP_TIMEOUT = 5.0
+# 报告默认统计最近多少小时
+REPORT_HOURS = 24
+
+# 事件类型
+TRIGGER = 'trigger'  # 触发雾化器，value 为触发帧采集到固件确认雾化器启动的时间（秒，未确认时为空），data.duration 为持续检测时间
+SERIAL = 'serial'    # 串口命令结果，value 为确认延迟（秒）
+PRINT = 'print'      # 打印任务完成，value 为从提交到打印完成的时间（秒）
+PAUSE = 'pause'      # 暂停窗口结束，value 为暂停时长（秒）
+DEVICE = 'device'    # 设备断开，label 为设备名
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY,
+    ts REAL NOT NULL,
+    kind TEXT NOT NULL,
+    label TEXT,
+    value REAL,
+    data TEXT
+);
+CREATE INDEX IF NOT EXISTS events_kind_ts ON events (kind, ts);
+"""
+
+# 通知写入线程退出
+_STOP = object()
+
+
+# 打开事件数据库（WAL模式，写入时报表查询不被阻塞）并建表
+def connect(path):
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.executescript(SCHEMA)
+    return conn
+
+
+# 只追加的事件日志：调用线程只把事件放入队列，后台线程按批写入SQLite，检测循环不等待磁盘。
+# 启动前 record() 直接忽略事件
+class EventStore:
+    def __init__(self, path=DEFAULT_DB_PATH, batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL,
+                 queue_size=QUEUE_SIZE, clock=time.time):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.clock = clock
+        self._queue = queue.Queue(queue_size)
+        self._conn = None
+        self._thread = None
+        self._running = False
+        self.counts = Counter()
+
+    # 打开数据库并启动写入线程
+    def start(self):
+        self._conn = connect(self.path)
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='event-store', daemon=True)
+        self._thread.start()
+        logger.info(f"事件记录已启用: {self.path}")
+        return self
+
+    # 记录一个事件，附加字段以JSON保存
+    def record(self, kind, label=None, value=None, **data):
+        if not self._running:
+            return
+        try:
+            self._queue.put_nowait((self.clock(), kind, label, value, data or None))
+        except queue.Full:
+            self.counts['dropped'] += 1
+
+    def _write(self, batch):
+        rows = [(ts, kind, label, value, json.dumps(data, ensure_ascii=False) if data else None)
+                for ts, kind, label, value, data in batch]
+        try:
+            with self._conn:
+                self._conn.executemany('INSERT INTO events (ts, kind, label, value, data) VALUES (?, ?, ?, ?, ?)', rows)
+            self.counts['written'] += len(rows)
+        except sqlite3.Error as e:
+            self.counts['write_errors'] += 1
+            logger.error(f"写入事件失败（丢弃 {len(rows)} 条）: {e}")
+
+    # 攒够一批或第一条事件等待超过 flush_interval 后写入一次事务
+    def _run(self):
+        batch = []
+        deadline = None
+        while True:
+            try:
+                item = self._queue.get(timeout=None if deadline is None else max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                item = None
+            if item is _STOP:
+                if batch:
+                    self._write(batch)
+                return
+            if item is not None:
+                batch.append(item)
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+            if batch and (len(batch) >= self.batch_size or time.monotonic() >= deadline):
+                self._write(batch)
+                batch = []
+                deadline = None
+
+    # 写入剩余事件后关闭数据库
+    def stop(self, timeout=STOP_TIMEOUT):
+        if not self._running:
+            return
+        self._running = False
+        try:
+            self._queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            pass
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            logger.warning(f"事件写入未在 {timeout} 秒内完成，剩余 {self._queue.qsize()} 条未写入")
+            return
+        self._thread = None
+        self._conn.close()
+        self._conn = None
+
+    def stats(self):
+        return {"queued": self._queue.qsize(), "written": self.counts['written'],
+                "dropped": self.counts['dropped'], "write_errors": self.counts['write_errors']}
+
+
+# 按最近邻秩取分位数（values 已排序）
+def percentile(values, q):
+    if not values:
+        return None
+    return values[min(len(values), max(1, math.ceil(q / 100 * len(values)))) - 1]
+
+
+def summarize(values):
+    values = sorted(values)
+    if not values:
+        return {"count": 0}
+    return {"count": len(values), "avg": sum(values) / len(values), "p50": percentile(values, 50),
+            "p90": percentile(values, 90), "p99": percentile(values, 99), "max": values[-1]}
+
+
+# 汇总 since 之后的事件：每小时吞吐量、各类别触发延迟和持续检测时间分布、暂停时长、打印结果、串口确认和设备断开
+def build_report(conn, since):
+    rows = conn.execute('SELECT ts, kind, label, value, data FROM events WHERE ts >= ? ORDER BY ts', (since,)).fetchall()
+
+    hourly = defaultdict(Counter)
+    trigger_latency = defaultdict(list)
+    detection_seconds = defaultdict(list)
+    pauses = []
+    print_times = []
+    print_results = Counter()
+    serial_latency = []
+    serial_results = Counter()
+    device_faults = Counter()
+    last_errors = {}
+
+    for ts, kind, label, value, data in rows:
+        data = json.loads(data) if data else {}
+        hour = time.strftime('%Y-%m-%d %H:00', time.localtime(ts))
+        if kind == TRIGGER:
+            hourly[hour]['triggers'] += 1
+            hourly[hour][f"trigger:{label}"] += 1
+            if value is not None:
+                trigger_latency[label].append(value)
+            if data.get('duration') is not None:
+                detection_seconds[label].append(data['duration'])
+        elif kind == PRINT:
+            ok = data.get('ok', True)
+            hourly[hour]['prints' if ok else 'print_failures'] += 1
+            print_results['completed' if ok else 'failed'] += 1
+            if ok and value is not None:
+                print_times.append(value)
+        elif kind == PAUSE:
+            if value is not None:
+                pauses.append(value)
+        elif kind == SERIAL:
+            serial_results[data.get('result', 'unknown')] += 1
+            if value is not None:
+                serial_latency.append(value)
+        elif kind == DEVICE:
+            hourly[hour]['device_faults'] += 1
+            device_faults[label] += 1
+            if data.get('error'):
+                last_errors[label] = data['error']
+
+    return {
+        "since": time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(since)),
+        "events": len(rows),
+        "hourly": {hour: dict(counts) for hour, counts in sorted(hourly.items())},
+        "trigger_latency": {label: summarize(values) for label, values in sorted(trigger_latency.items())},
+        "detection_seconds": {label: summarize(values) for label, values in sorted(detection_seconds.items())},
+        "pause_seconds": summarize(pauses),
+        "prints": {"results": dict(print_results), "seconds": summarize(print_times)},
+        "serial": {"results": dict(serial_results), "ack_seconds": summarize(serial_latency)},
+        "device_faults": {label: {"count": count, "last_error": last_errors.get(label)}
+                          for label, count in device_faults.items()},
+    }
+
+
+def _format_summary(summary, unit=1.0, suffix='秒'):
+    if not summary.get("count"):
+        return "无"
+    return (f"{summary['count']} 次，平均 {summary['avg'] * unit:.2f}{suffix}，p50 {summary['p50'] * unit:.2f}{suffix}，"
+            f"p90 {summary['p90'] * unit:.2f}{suffix}，最大 {summary['max'] * unit:.2f}{suffix}")
+
+
+def print_report(report):
+    print(f"自 {report['since']} 起共 {report['events']} 个事件")
+    print("\n每小时吞吐量:")
+    for hour, counts in report["hourly"].items():
+        classes = '，'.join(f"{key.split(':', 1)[1]} {value}" for key, value in sorted(counts.items())
+                           if key.startswith('trigger:'))
+        print(f"  {hour}  触发 {counts.get('triggers', 0)}（{classes or '-'}），打印 {counts.get('prints', 0)}，"
+              f"打印失败 {counts.get('print_failures', 0)}，设备断开 {counts.get('device_faults', 0)}")
+    print("\n各类别触发延迟（触发帧采集到雾化器确认启动）:")
+    for label, summary in report["trigger_latency"].items():
+        print(f"  {label}: {_format_summary(summary, 1000, '毫秒')}")
+    print("\n各类别持续检测时间（开始检测到触发）:")
+    for label, summary in report["detection_seconds"].items():
+        print(f"  {label}: {_format_summary(summary)}")
+    print(f"\n暂停时长: {_format_summary(report['pause_seconds'])}")
+    results = report["prints"]["results"]
+    print(f"打印: 完成 {results.get('completed', 0)}，失败 {results.get('failed', 0)}，"
+          f"从提交到完成 {_format_summary(report['prints']['seconds'])}")
+    serial_results = '，'.join(f"{result} {count}" for result, count in report['serial']['results'].items())
+    print(f"串口命令: {serial_results or '无'}，确认延迟 {_format_summary(report['serial']['ack_seconds'], 1000, '毫秒')}")
+    for label, fault in report["device_faults"].items():
+        print(f"设备 {label}: 断开 {fault['count']} 次，最后错误: {fault['last_error']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="汇总事件数据库：每小时吞吐量、各类别触发延迟和持续检测时间分布、暂停时长、打印和设备故障")
+    parser.add_argument('db', nargs='?', default=DEFAULT_DB_PATH, help="事件数据库路径")
+    parser.add_argument('--hours', type=float, default=REPORT_HOURS, help="统计最近多少小时")
+    parser.add_argument('--json', action='store_true', help="以JSON输出")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db):
+        print(f"事件数据库不存在: {args.db}", file=sys.stderr)
+        return 1
+    conn = connect(args.db)
+    try:
+        report = build_report(conn, time.time() - args.hours * 3600)
+    finally:
+        conn.close()
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print_report(report)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,332 @@
+import os
+import cv2
+import sys
+import json
+import shutil
+import time
+import hashlib
+import logging
+import argparse
+import importlib.util
+import numpy as np
+from ultralytics import YOLO
+
+logger = logging.getLogger(__name__)
+
+# 导出模型的缓存目录
+MODEL_CACHE_DIR = 'model_cache'
+# 默认推理输入尺寸
+DEFAULT_IMGSZ = 640
+
+# 一致性检查的容差：匹配框的最小IoU和最大置信度差
+PARITY_IOU_THRESHOLD = 0.9
+PARITY_CONF_TOLERANCE = 0.05
+
+
+# 推理后端基类：predict() 返回 (boxes[N,4] xyxy, confidences[N], class_ids[N]) 三个numpy数组
+class InferenceBackend:
+    name = 'base'
+    # 是否支持每帧使用不同的输入尺寸（导出的静态形状模型不支持）
+    dynamic_imgsz = False
+
+    def __init__(self, model_path, imgsz=DEFAULT_IMGSZ):
+        self.model_path = model_path
+        self.imgsz = imgsz
+        # 最近一次推理的分阶段耗时（毫秒）: {'preprocess', 'inference', 'postprocess'}，后端不提供时为空
+        self.last_speed = {}
+
+    def predict(self, frame, imgsz=None):
+        raise NotImplementedError
+
+
+# 基于ultralytics的后端，不同格式的模型文件由ultralytics选择对应的运行时
+class UltralyticsBackend(InferenceBackend):
+    name = 'pytorch'
+
+    def __init__(self, model_path, imgsz=DEFAULT_IMGSZ):
+        super().__init__(model_path, imgsz)
+        self.model = YOLO(model_path, task='detect')
+
+    def predict(self, frame, imgsz=None):
+        results = self.model(frame, device='cpu', imgsz=imgsz or self.imgsz, verbose=False)
+        self.last_speed = (getattr(results[0], 'speed', None) or {}) if results else {}
+        boxes, confidences, class_ids = [], [], []
+        for result in results:
+            boxes.append(result.boxes.xyxy.cpu().numpy())
+            confidences.append(result.boxes.conf.cpu().numpy())
+            class_ids.append(result.boxes.cls.cpu().numpy().astype(int))
+        if not boxes:
+            return empty_detections()
+        return np.concatenate(boxes), np.concatenate(confidences), np.concatenate(class_ids)
+
+
+# PyTorch eager 后端
+class PyTorchBackend(UltralyticsBackend):
+    name = 'pytorch'
+    dynamic_imgsz = True
+
+
+# ONNX Runtime 后端，使用导出并缓存的 .onnx 模型
+class OnnxRuntimeBackend(UltralyticsBackend):
+    name = 'onnx'
+    export_format = 'onnx'
+    requires = 'onnxruntime'
+
+    def __init__(self, model_path, imgsz=DEFAULT_IMGSZ):
+        require_module(self.requires)
+        super().__init__(export_model(model_path, self.export_format, imgsz), imgsz)
+
+
+# OpenVINO 后端（可选，需安装openvino），使用导出并缓存的 IR 模型
+class OpenVINOBackend(OnnxRuntimeBackend):
+    name = 'openvino'
+    export_format = 'openvino'
+    requires = 'openvino'
+
+
+# ONNX Runtime INT8 后端，使用 quantize.py 离线量化生成的模型
+class OnnxInt8Backend(UltralyticsBackend):
+    name = 'onnx-int8'
+    requires = 'onnxruntime'
+
+    def __init__(self, model_path, imgsz=DEFAULT_IMGSZ):
+        require_module(self.requires)
+        artifact = find_cached(cache_key(model_path, 'onnx', imgsz, 'int8'), file_sha256(model_path))
+        if artifact is None:
+            raise FileNotFoundError(f"未找到 {model_path} 的INT8量化模型，请先运行 quantize.py")
+        super().__init__(artifact, imgsz)
+
+
+BACKENDS = {
+    'pytorch': PyTorchBackend,
+    'onnx': OnnxRuntimeBackend,
+    'openvino': OpenVINOBackend,
+    'onnx-int8': OnnxInt8Backend,
+}
+
+
+def empty_detections():
+    return (np.zeros((0, 4), dtype=np.float32),
+            np.zeros(0, dtype=np.float32),
+            np.zeros(0, dtype=int))
+
+
+def require_module(name):
+    if importlib.util.find_spec(name) is None:
+        raise ImportError(f"未安装 {name}")
+
+
+# 计算文件的sha256，用于判断缓存是否过期
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# 缓存文件名：<模型名>_<格式>_<输入尺寸>[_<变体>]
+def cache_key(model_path, export_format, imgsz, variant=''):
+    key = f"{os.path.splitext(os.path.basename(model_path))[0]}_{export_format}_{imgsz}"
+    if variant:
+        key += f"_{variant}"
+    return key
+
+
+# 查找与源模型匹配的缓存文件，源模型已变化或缓存不存在时返回 None
+def find_cached(key, source_hash, cache_dir=MODEL_CACHE_DIR):
+    meta_path = os.path.join(cache_dir, key + '.json')
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path, encoding='utf-8') as f:
+        meta = json.load(f)
+    if meta.get('source_sha256') != source_hash or not os.path.exists(meta.get('artifact', '')):
+        return None
+    return meta['artifact']
+
+
+# 写入缓存元数据，记录源模型哈希和生成参数
+def write_cache_meta(key, model_path, source_hash, artifact, cache_dir=MODEL_CACHE_DIR, **info):
+    with open(os.path.join(cache_dir, key + '.json'), 'w', encoding='utf-8') as f:
+        json.dump({
+            'source': os.path.abspath(model_path),
+            'source_sha256': source_hash,
+            'artifact': artifact,
+            'created': time.strftime("%Y-%m-%d %H:%M:%S"),
+            **info,
+        }, f, ensure_ascii=False, indent=2)
+
+
+# 将 .pt 模型导出为指定格式并缓存，源文件和导出参数未变化时直接复用已有文件
+def export_model(model_path, export_format, imgsz=DEFAULT_IMGSZ, cache_dir=MODEL_CACHE_DIR, **export_args):
+    source_hash = file_sha256(model_path)
+    key = cache_key(model_path, export_format, imgsz,
+                    '_'.join(f"{k}-{v}" for k, v in sorted(export_args.items())))
+    cached = find_cached(key, source_hash, cache_dir)
+    if cached is not None:
+        logger.info(f"使用已缓存的 {export_format} 模型: {cached}")
+        return cached
+
+    logger.info(f"正在将 {model_path} 导出为 {export_format} 格式...")
+    start = time.perf_counter()
+    exported = YOLO(model_path).export(format=export_format, imgsz=imgsz, **export_args)
+    logger.info(f"导出完成，用时 {time.perf_counter() - start:.1f} 秒: {exported}")
+
+    # 将导出结果移入缓存目录，避免与源模型混在一起
+    # OpenVINO等导出结果是目录，保留 _<格式>_model 后缀以便ultralytics识别格式
+    os.makedirs(cache_dir, exist_ok=True)
+    exported = str(exported)
+    suffix = f'_{export_format}_model' if os.path.isdir(exported) else os.path.splitext(exported)[1]
+    artifact = os.path.join(cache_dir, key + suffix)
+    if os.path.isdir(artifact):
+        shutil.rmtree(artifact)
+    os.replace(exported, artifact)
+
+    write_cache_meta(key, model_path, source_hash, artifact, cache_dir,
+                     format=export_format, imgsz=imgsz, export_args=export_args)
+    return artifact
+
+
+# 按名称加载推理后端，依赖缺失或导出失败时回退到PyTorch
+def load_backend(name, model_path, imgsz=DEFAULT_IMGSZ):
+    if name not in BACKENDS:
+        raise ValueError(f"未知的推理后端: {name}，可选: {', '.join(BACKENDS)}")
+    try:
+        backend = BACKENDS[name](model_path, imgsz)
+    except Exception as e:
+        if name == 'pytorch':
+            raise
+        logger.warning(f"加载 {name} 推理后端失败: {e}，回退到 pytorch")
+        backend = PyTorchBackend(model_path, imgsz)
+    logger.info(f"推理后端: {backend.name} ({backend.model_path})")
+    return backend
+
+
+def box_iou(a, b):
+    x1 = max(a[0], b[0])
+    y1 = max(a[1], b[1])
+    x2 = min(a[2], b[2])
+    y2 = min(a[3], b[3])
+    inter = max(0.0, x2 - x1) * max(0.0, y2 - y1)
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+# 比较两组检测结果：按类别贪心匹配IoU最大的框，返回匹配数、未匹配数和最大置信度差
+def compare_detections(reference, candidate, iou_threshold=PARITY_IOU_THRESHOLD):
+    ref_boxes, ref_conf, ref_cls = reference
+    cand_boxes, cand_conf, cand_cls = candidate
+    used = set()
+    matched = 0
+    max_conf_diff = 0.0
+    for i in np.argsort(-ref_conf):
+        best, best_iou = None, iou_threshold
+        for j in range(len(cand_boxes)):
+            if j in used or cand_cls[j] != ref_cls[i]:
+                continue
+            iou = box_iou(ref_boxes[i], cand_boxes[j])
+            if iou >= best_iou:
+                best, best_iou = j, iou
+        if best is not None:
+            used.add(best)
+            matched += 1
+            max_conf_diff = max(max_conf_diff, abs(float(ref_conf[i]) - float(cand_conf[best])))
+    return {
+        'matched': matched,
+        'missing': len(ref_boxes) - matched,
+        'extra': len(cand_boxes) - matched,
+        'max_conf_diff': max_conf_diff,
+    }
+
+
+# 依次读取视频文件或图片目录中的帧
+def iter_frames(source, max_frames=None):
+    count = 0
+    if os.path.isdir(source):
+        for name in sorted(os.listdir(source)):
+            if max_frames is not None and count >= max_frames:
+                return
+            frame = cv2.imread(os.path.join(source, name))
+            if frame is not None:
+                count += 1
+                yield frame
+        return
+
+    cap = cv2.VideoCapture(source)
+    try:
+        while max_frames is None or count < max_frames:
+            ret, frame = cap.read()
+            if not ret:
+                return
+            count += 1
+            yield frame
+    finally:
+        cap.release()
+
+
+# 在样例视频上对比两个后端的检测框，并统计各自的单帧耗时
+def parity_check(model_path, source, candidate='onnx', reference='pytorch', imgsz=DEFAULT_IMGSZ,
+                 max_frames=200, iou_threshold=PARITY_IOU_THRESHOLD, conf_tolerance=PARITY_CONF_TOLERANCE):
+    ref_backend = load_backend(reference, model_path, imgsz)
+    cand_backend = load_backend(candidate, model_path, imgsz)
+    if cand_backend.name != candidate:
+        raise RuntimeError(f"无法加载 {candidate} 后端，一致性检查中止")
+
+    frames = 0
+    failed_frames = 0
+    totals = {'matched': 0, 'missing': 0, 'extra': 0, 'max_conf_diff': 0.0}
+    timings = {reference: [], candidate: []}
+    for frame in iter_frames(source, max_frames):
+        start = time.perf_counter()
+        ref = ref_backend.predict(frame)
+        timings[reference].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        cand = cand_backend.predict(frame)
+        timings[candidate].append(time.perf_counter() - start)
+
+        result = compare_detections(ref, cand, iou_threshold)
+        frames += 1
+        for key in ('matched', 'missing', 'extra'):
+            totals[key] += result[key]
+        totals['max_conf_diff'] = max(totals['max_conf_diff'], result['max_conf_diff'])
+        if result['missing'] or result['extra'] or result['max_conf_diff'] > conf_tolerance:
+            failed_frames += 1
+
+    return {
+        'frames': frames,
+        'failed_frames': failed_frames,
+        'passed': frames > 0 and failed_frames == 0,
+        **totals,
+        'latency_ms': {name: float(np.mean(values) * 1000) if values else 0.0
+                       for name, values in timings.items()},
+    }
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="导出并缓存推理模型，或检查不同推理后端的结果一致性")
+    parser.add_argument('--model', default='test_model.pt', help="源模型路径")
+    parser.add_argument('--backend', default='onnx', choices=list(BACKENDS), help="待检查/导出的后端")
+    parser.add_argument('--imgsz', type=int, default=DEFAULT_IMGSZ, help="推理输入尺寸")
+    parser.add_argument('--parity', metavar='SOURCE', help="样例视频文件或图片目录，与pytorch后端对比检测结果")
+    parser.add_argument('--max-frames', type=int, default=200, help="一致性检查最多使用的帧数")
+    args = parser.parse_args()
+
+    if args.parity is None:
+        if args.backend == 'pytorch':
+            print("pytorch 后端无需导出")
+            return 0
+        if args.backend == 'onnx-int8':
+            print("INT8 模型需要校准数据，请使用 quantize.py 生成")
+            return 1
+        print(export_model(args.model, BACKENDS[args.backend].export_format, args.imgsz))
+        return 0
+
+    report = parity_check(args.model, args.parity, args.backend, imgsz=args.imgsz, max_frames=args.max_frames)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    return 0 if report['passed'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,83 @@
+import time
+import threading
+
+# 调度模式
+IDLE = 'idle'      # 画面中没有候选目标：低分辨率、限速推理
+ACTIVE = 'active'  # 已出现候选目标：全分辨率、逐帧推理
+
+
+# 推理调度器：空场景时以低分辨率、低频率推理以节省CPU，
+# 一旦看到候选类别立即切换到全分辨率逐帧推理，目标消失 cooldown 秒后再降回空闲模式。
+# 空闲模式下最多延迟 1/idle_fps 秒发现目标，之后的持续检测计时与原来完全一致
+class InferenceGovernor:
+    def __init__(self, full_imgsz, idle_imgsz, idle_fps, cooldown, candidate_confidence,
+                 candidate_classes=None, dynamic_imgsz=True, clock=time.time):
+        self.full_imgsz = full_imgsz
+        # 后端不支持动态输入尺寸时只做跳帧，不改变分辨率
+        self.idle_imgsz = idle_imgsz if dynamic_imgsz else full_imgsz
+        self.idle_interval = 1.0 / idle_fps if idle_fps > 0 else 0.0
+        self.cooldown = cooldown
+        self.candidate_confidence = candidate_confidence
+        self.candidate_classes = set(candidate_classes) if candidate_classes is not None else None
+        self.clock = clock
+
+        self._lock = threading.Lock()
+        self.mode = IDLE
+        self._last_inference = None
+        self._last_candidate = None
+
+        self.frames_inferred = 0
+        self.frames_skipped = 0
+        self.escalations = 0
+
+    # 决定当前帧是否推理：返回推理尺寸，返回 None 表示跳过该帧
+    def plan(self, now=None):
+        now = self.clock() if now is None else now
+        with self._lock:
+            if self.mode == ACTIVE and now - self._last_candidate > self.cooldown:
+                self.mode = IDLE
+
+            if self.mode == ACTIVE:
+                imgsz = self.full_imgsz
+            elif self._last_inference is not None and now - self._last_inference < self.idle_interval:
+                self.frames_skipped += 1
+                return None
+            else:
+                imgsz = self.idle_imgsz
+
+            self._last_inference = now
+            self.frames_inferred += 1
+            return imgsz
+
+    # 根据本帧推理结果更新模式
+    def observe(self, class_ids, confidences, now=None):
+        now = self.clock() if now is None else now
+        for class_id, confidence in zip(class_ids, confidences):
+            if confidence < self.candidate_confidence:
+                continue
+            if self.candidate_classes is not None and int(class_id) not in self.candidate_classes:
+                continue
+            with self._lock:
+                self._last_candidate = now
+                if self.mode == IDLE:
+                    self.mode = ACTIVE
+                    self.escalations += 1
+            return
+
+    # 暂停结束等场景下重置为空闲模式
+    def reset(self):
+        with self._lock:
+            self.mode = IDLE
+            self._last_inference = None
+            self._last_candidate = None
+
+    def stats(self):
+        with self._lock:
+            total = self.frames_inferred + self.frames_skipped
+            return {
+                "mode": self.mode,
+                "inferred": self.frames_inferred,
+                "skipped": self.frames_skipped,
+                "skip_ratio": self.frames_skipped / total if total else 0.0,
+                "escalations": self.escalations,
+            }
@@ -0,0 +1,75 @@
+import os
+import time
+import escpos
+import hashlib
+import logging
+import threading
+from PIL import Image, ImageOps
+from escpos.printer import Dummy
+
+logger = logging.getLogger(__name__)
+
+
+# 解码、灰度化、按打印宽度等比缩放Logo，并由python-escpos抖动和编码为ESC/POS光栅数据
+def render_logo_raster(path, width):
+    img = Image.open(path)
+
+    # 转换为灰度图像
+    img = ImageOps.grayscale(img)
+
+    # 调整图片大小以适应打印机宽度，保持宽高比
+    width_percent = (width / float(img.size[0]))
+    new_height = int((float(img.size[1]) * float(width_percent)))
+    img = img.resize((width, new_height), Image.LANCZOS)
+
+    # 在虚拟打印机上生成与 printer.image() 完全相同的字节序列
+    dummy = Dummy()
+    dummy.image(img)
+    return dummy.output
+
+
+# Logo光栅数据缓存：每个源文件(按修改时间判断)只处理一次，
+# 可选地按源文件哈希、打印宽度和python-escpos版本保存到磁盘，下次启动直接读取
+class LogoCache:
+    def __init__(self, width, disk_dir=None):
+        self.width = width
+        self.disk_dir = disk_dir
+        self._lock = threading.Lock()
+        self._key = None
+        self._data = None
+
+    def _disk_path(self, digest):
+        return os.path.join(self.disk_dir, f"logo_{digest[:16]}_{self.width}_escpos{escpos.__version__}.bin")
+
+    # 返回可直接发送给打印机的Logo光栅数据
+    def get(self, path):
+        stat = os.stat(path)
+        key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            if self._key == key:
+                return self._data
+
+            start = time.perf_counter()
+            with open(path, 'rb') as f:
+                digest = hashlib.sha256(f.read()).hexdigest()
+
+            data = None
+            disk_path = self._disk_path(digest) if self.disk_dir else None
+            if disk_path and os.path.exists(disk_path):
+                with open(disk_path, 'rb') as f:
+                    data = f.read()
+                source = "磁盘缓存"
+            else:
+                data = render_logo_raster(path, self.width)
+                source = "重新生成"
+                if disk_path:
+                    os.makedirs(self.disk_dir, exist_ok=True)
+                    tmp_path = disk_path + '.tmp'
+                    with open(tmp_path, 'wb') as f:
+                        f.write(data)
+                    os.replace(tmp_path, disk_path)
+
+            logger.info(f"Logo光栅数据已缓存({source}): {len(data)} 字节，用时 {(time.perf_counter() - start) * 1000:.1f} 毫秒")
+            self._key = key
+            self._data = data
+            return data
@@ -0,0 +1,82 @@
+import cv2
+import time
+import threading
+import numpy as np
+
+# 帧差比较使用的缩略图尺寸
+GATE_FRAME_SIZE = (64, 48)
+# 单个像素灰度差超过该值视为变化
+PIXEL_DIFF_THRESHOLD = 25
+# 变化像素比例低于该值视为静止画面
+CHANGE_RATIO_THRESHOLD = 0.01
+# 复用检测结果的最长时间（秒），超过后即使画面静止也重新推理
+MAX_REUSE_AGE = 1.0
+
+
+# 运动/场景变化门控：与上一次推理时的画面相比几乎没有变化时，直接复用上一次的检测结果，跳过YOLO推理
+class MotionGate:
+    def __init__(self, pixel_threshold=PIXEL_DIFF_THRESHOLD, change_ratio=CHANGE_RATIO_THRESHOLD,
+                 max_reuse_age=MAX_REUSE_AGE, frame_size=GATE_FRAME_SIZE, clock=time.time):
+        self.pixel_threshold = pixel_threshold
+        self.change_ratio = change_ratio
+        self.max_reuse_age = max_reuse_age
+        self.frame_size = frame_size
+        self.clock = clock
+
+        self._lock = threading.Lock()
+        self._reference = None
+        self._reference_time = None
+        self._results = None
+        self._current = None
+
+        self.frames_checked = 0
+        self.frames_reused = 0
+        self.last_change_ratio = 0.0
+
+    # 缩小并转为灰度，模糊去除传感器噪声
+    def _thumbnail(self, frame):
+        small = cv2.resize(frame, self.frame_size, interpolation=cv2.INTER_AREA)
+        if small.ndim == 3:
+            small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        return cv2.GaussianBlur(small, (3, 3), 0)
+
+    # 检查当前帧：画面静止且缓存未过期时返回缓存的检测结果，否则返回 None（需要推理）
+    def check(self, frame, now=None):
+        now = self.clock() if now is None else now
+        self._current = self._thumbnail(frame)
+        with self._lock:
+            self.frames_checked += 1
+            if self._reference is None or now - self._reference_time > self.max_reuse_age:
+                return None
+
+            diff = cv2.absdiff(self._current, self._reference)
+            self.last_change_ratio = np.count_nonzero(diff > self.pixel_threshold) / diff.size
+            if self.last_change_ratio >= self.change_ratio:
+                return None
+
+            self.frames_reused += 1
+            return self._results
+
+    # 推理完成后记录本帧作为新的参考画面及其检测结果
+    def update(self, results, now=None):
+        now = self.clock() if now is None else now
+        with self._lock:
+            self._reference = self._current
+            self._reference_time = now
+            self._results = results
+
+    # 丢弃参考画面，下一帧必须重新推理
+    def reset(self):
+        with self._lock:
+            self._reference = None
+            self._reference_time = None
+            self._results = None
+
+    def stats(self):
+        with self._lock:
+            return {
+                "checked": self.frames_checked,
+                "reused": self.frames_reused,
+                "skip_ratio": self.frames_reused / self.frames_checked if self.frames_checked else 0.0,
+                "change_ratio": self.last_change_ratio,
+            }
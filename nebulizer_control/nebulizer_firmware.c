@@ -1,10 +1,15 @@
 /**
  * 雾化器控制程序 - RP2040固件
  * 通过串口接收命令控制5个雾化器
+ * 支持两种协议：
+ *   文本协议：每行一条命令 "[雾化器ID] [1=开启/0=关闭]"，回复中文状态文本
+ *   二进制协议：帧格式 [0xA5][类型][长度][数据...][CRC8]，一帧可设置多个雾化器及各自的开启时长，回复状态码
+ * 主机启动时发送协商帧(FRAME_HELLO)，收到应答后改用二进制协议，否则继续使用文本协议
  */
 #include <stdio.h>
 #include "pico/stdlib.h"
 #include "hardware/gpio.h"
+#include "hardware/sync.h"
 #include "pico/time.h"
 
 // 定义雾化器连接的GPIO引脚
@@ -14,15 +19,50 @@
 #define NEBULIZER_4_PIN 19  // yd
 #define NEBULIZER_5_PIN 20  // td
 
-// 雾化器开启时间（毫秒）
+// 雾化器数量
+#define NUM_NEBULIZERS 5
+
+// 雾化器开启时间（毫秒），二进制命令中时长为0时也使用该值
 #define NEBULIZER_ON_TIME_MS 3000
 
+// 等待串口数据的超时时间（微秒），有数据时立即返回
+#define READ_TIMEOUT_US 1000
+// 二进制帧中两个字节的最大间隔（微秒），超时则丢弃未接收完的帧
+#define FRAME_TIMEOUT_US 100000
+
+// 二进制协议，与 nebulizer_protocol.py 中的定义保持一致
+// CRC8（多项式0x07，初值0）覆盖类型、长度和数据
+#define FRAME_SYNC 0xA5
+#define PROTOCOL_VERSION 1
+#define FRAME_MAX_PAYLOAD 32
+// 主机发送的帧类型
+#define FRAME_HELLO 0x01        // 协商协议: [主机协议版本]
+#define FRAME_SET 0x02          // 设置雾化器: [序号] + N x [ID][状态][时长(毫秒, 小端16位)]
+// 固件发送的帧类型
+#define FRAME_HELLO_REPLY 0x81  // [固件协议版本][雾化器数量]
+#define FRAME_STATUS 0x82       // [序号][状态码]
+#define FRAME_AUTO_STOP 0x83    // [雾化器ID]
+// 设置帧中每个条目的字节数
+#define SET_ENTRY_SIZE 4
+
+// 状态码
+#define STATUS_OK 0
+#define STATUS_BAD_ID 1
+#define STATUS_BAD_LENGTH 2
+#define STATUS_BAD_TYPE 3
+
 // 雾化器状态数组
 bool nebulizer_status[5] = {false, false, false, false, false};
 
 // 雾化器定时器数组，用于自动关闭
 alarm_id_t nebulizer_timers[5] = {-1, -1, -1, -1, -1};
 
+// 已自动关闭、尚未上报的雾化器（按位），由定时器回调设置，在主循环中上报
+volatile uint32_t auto_stopped_mask = 0;
+
+// 最近收到的是二进制命令时，自动关闭也以二进制帧上报
+bool binary_mode = false;
+
 // 初始化GPIO引脚
 void init_gpio() {
     // 初始化雾化器控制引脚
@@ -47,7 +87,20 @@ void init_gpio() {
     gpio_put(NEBULIZER_5_PIN, 0);
 }
 
+// 根据ID选择对应的引脚，ID无效时返回-1
+int nebulizer_pin(int id) {
+    switch(id) {
+        case 1: return NEBULIZER_1_PIN;
+        case 2: return NEBULIZER_2_PIN;
+        case 3: return NEBULIZER_3_PIN;
+        case 4: return NEBULIZER_4_PIN;
+        case 5: return NEBULIZER_5_PIN;
+        default: return -1;
+    }
+}
+
 // 定时器回调函数，用于自动关闭雾化器
+// 在中断上下文中执行，不直接输出，由主循环上报
 int64_t nebulizer_timer_callback(alarm_id_t id, void *user_data) {
     int nebulizer_id = *((int*)user_data);
     
@@ -66,8 +119,8 @@ int64_t nebulizer_timer_callback(alarm_id_t id, void *user_data) {
     gpio_put(pin, 0);
     nebulizer_status[nebulizer_id-1] = false;
     
-    // 发送确认信息
-    printf("雾化器 %d 已自动停止\n", nebulizer_id);
+    // 记录待上报的自动关闭
+    auto_stopped_mask |= 1u << (nebulizer_id - 1);
     
     // 清除定时器ID
     nebulizer_timers[nebulizer_id-1] = -1;
@@ -75,49 +128,144 @@ int64_t nebulizer_timer_callback(alarm_id_t id, void *user_data) {
     return 0;
 }
 
-// 控制雾化器开关
-void control_nebulizer(int id, bool state) {
-    if (id < 1 || id > 5) {
-        printf("错误：雾化器ID必须在1-5之间\n");
+// 设置雾化器开关，开启时在 duration_ms 毫秒后自动关闭
+void set_nebulizer(int id, bool state, uint32_t duration_ms) {
+    int pin = nebulizer_pin(id);
+    if (pin < 0) {
         return;
     }
     
-    // 根据ID选择对应的引脚
-    int pin;
-    switch(id) {
-        case 1: pin = NEBULIZER_1_PIN; break;
-        case 2: pin = NEBULIZER_2_PIN; break;
-        case 3: pin = NEBULIZER_3_PIN; break;
-        case 4: pin = NEBULIZER_4_PIN; break;
-        case 5: pin = NEBULIZER_5_PIN; break;
-        default: return;
-    }
-    
     // 设置引脚状态
     gpio_put(pin, state ? 1 : 0);
     nebulizer_status[id-1] = state;
     
-    // 发送确认信息
-    printf("雾化器 %d %s\n", id, state ? "已启动" : "已停止");
+    // 无论开启还是关闭，先取消已有的定时器
+    if (nebulizer_timers[id-1] != -1) {
+        cancel_alarm(nebulizer_timers[id-1]);
+        nebulizer_timers[id-1] = -1;
+    }
     
     // 如果是开启雾化器，设置定时器自动关闭
     if (state) {
-        // 如果已经有定时器，先取消
-        if (nebulizer_timers[id-1] != -1) {
-            cancel_alarm(nebulizer_timers[id-1]);
-        }
-        
-        // 创建新的定时器
         static int timer_ids[5] = {1, 2, 3, 4, 5};
-        nebulizer_timers[id-1] = add_alarm_in_ms(NEBULIZER_ON_TIME_MS, 
+        nebulizer_timers[id-1] = add_alarm_in_ms(duration_ms, 
                                                 nebulizer_timer_callback, 
                                                 &timer_ids[id-1], 
                                                 false);
-    } else {
-        // 如果是手动关闭，取消定时器
-        if (nebulizer_timers[id-1] != -1) {
-            cancel_alarm(nebulizer_timers[id-1]);
-            nebulizer_timers[id-1] = -1;
+    }
+}
+
+// 控制雾化器开关（文本协议）
+void control_nebulizer(int id, bool state) {
+    if (id < 1 || id > 5) {
+        printf("错误：雾化器ID必须在1-5之间\n");
+        return;
+    }
+    
+    set_nebulizer(id, state, NEBULIZER_ON_TIME_MS);
+    
+    // 发送确认信息
+    printf("雾化器 %d %s\n", id, state ? "已启动" : "已停止");
+}
+
+// 计算CRC8（多项式0x07）
+uint8_t crc8(uint8_t crc, const uint8_t *data, int len) {
+    for (int i = 0; i < len; i++) {
+        crc ^= data[i];
+        for (int bit = 0; bit < 8; bit++) {
+            crc = (crc & 0x80) ? (uint8_t)((crc << 1) ^ 0x07) : (uint8_t)(crc << 1);
+        }
+    }
+    return crc;
+}
+
+// 发送一个二进制帧，不经过换行转换
+void send_frame(uint8_t type, const uint8_t *payload, uint8_t len) {
+    uint8_t header[2] = {type, len};
+    uint8_t crc = crc8(crc8(0, header, 2), payload, len);
+    
+    putchar_raw(FRAME_SYNC);
+    putchar_raw(type);
+    putchar_raw(len);
+    for (int i = 0; i < len; i++) {
+        putchar_raw(payload[i]);
+    }
+    putchar_raw(crc);
+    stdio_flush();
+}
+
+// 发送状态码应答
+void send_status(uint8_t seq, uint8_t status) {
+    uint8_t payload[2] = {seq, status};
+    send_frame(FRAME_STATUS, payload, 2);
+}
+
+// 处理设置帧：先校验所有条目，全部有效才一起执行
+void handle_set_frame(const uint8_t *payload, uint8_t len) {
+    if (len < 1 + SET_ENTRY_SIZE || (len - 1) % SET_ENTRY_SIZE != 0) {
+        send_status(len > 0 ? payload[0] : 0, STATUS_BAD_LENGTH);
+        return;
+    }
+    
+    uint8_t seq = payload[0];
+    const uint8_t *entries = payload + 1;
+    int count = (len - 1) / SET_ENTRY_SIZE;
+    
+    for (int i = 0; i < count; i++) {
+        int id = entries[i * SET_ENTRY_SIZE];
+        if (id < 1 || id > NUM_NEBULIZERS) {
+            send_status(seq, STATUS_BAD_ID);
+            return;
+        }
+    }
+    
+    for (int i = 0; i < count; i++) {
+        const uint8_t *entry = entries + i * SET_ENTRY_SIZE;
+        uint32_t duration_ms = entry[2] | (entry[3] << 8);
+        set_nebulizer(entry[0], entry[1] != 0, duration_ms ? duration_ms : NEBULIZER_ON_TIME_MS);
+    }
+    
+    send_status(seq, STATUS_OK);
+}
+
+// 处理一个校验通过的二进制帧
+void handle_frame(uint8_t type, const uint8_t *payload, uint8_t len) {
+    binary_mode = true;
+    
+    switch (type) {
+        case FRAME_HELLO: {
+            uint8_t reply[2] = {PROTOCOL_VERSION, NUM_NEBULIZERS};
+            send_frame(FRAME_HELLO_REPLY, reply, 2);
+            break;
+        }
+        case FRAME_SET:
+            handle_set_frame(payload, len);
+            break;
+        default:
+            send_status(0, STATUS_BAD_TYPE);
+            break;
+    }
+}
+
+// 上报定时器自动关闭的雾化器
+void report_auto_stops() {
+    if (auto_stopped_mask == 0) {
+        return;
+    }
+    
+    uint32_t saved = save_and_disable_interrupts();
+    uint32_t mask = auto_stopped_mask;
+    auto_stopped_mask = 0;
+    restore_interrupts(saved);
+    
+    for (int i = 0; i < NUM_NEBULIZERS; i++) {
+        if (mask & (1u << i)) {
+            if (binary_mode) {
+                uint8_t id = i + 1;
+                send_frame(FRAME_AUTO_STOP, &id, 1);
+            } else {
+                printf("雾化器 %d 已自动停止\n", i + 1);
+            }
         }
     }
 }
@@ -132,17 +280,51 @@ int main() {
     printf("雾化器控制系统已启动\n");
     printf("命令格式: [雾化器ID] [1=开启/0=关闭]\n");
     
+    // 文本命令缓冲区
     char buffer[10];
     int pos = 0;
     
+    // 二进制帧缓冲区: [类型][长度][数据...][CRC8]，frame_pos 为 -1 时不在接收二进制帧
+    uint8_t frame[FRAME_MAX_PAYLOAD + 3];
+    int frame_pos = -1;
+    absolute_time_t frame_last_byte = get_absolute_time();
+    
     while (true) {
-        // 检查是否有串口数据
-        int c = getchar_timeout_us(0);
+        // 等待串口数据，收到字符立即返回，不再每个字符固定延时
+        int c = getchar_timeout_us(READ_TIMEOUT_US);
+        
+        report_auto_stops();
+        
         if (c != PICO_ERROR_TIMEOUT) {
             // 收到字符
-            if (c == '\n' || c == '\r') {
+            if (frame_pos >= 0) {
+                // 接收二进制帧
+                frame[frame_pos++] = (uint8_t)c;
+                frame_last_byte = get_absolute_time();
+                
+                if (frame_pos == 2 && frame[1] > FRAME_MAX_PAYLOAD) {
+                    // 长度无效，丢弃
+                    frame_pos = -1;
+                } else if (frame_pos >= 2 && frame_pos == frame[1] + 3) {
+                    // 帧接收完整，CRC错误的帧直接丢弃，由主机超时重发
+                    if (crc8(0, frame, frame_pos - 1) == frame[frame_pos - 1]) {
+                        handle_frame(frame[0], frame + 2, frame[1]);
+                    }
+                    frame_pos = -1;
+                }
+            } else if (c == FRAME_SYNC && pos == 0) {
+                // 二进制帧开始
+                frame_pos = 0;
+                frame_last_byte = get_absolute_time();
+            } else if (c == '\n' || c == '\r') {
+                // 跳过空行（如协商帧后附带的换行）
+                if (pos == 0) {
+                    continue;
+                }
+                
                 // 命令结束，处理命令
                 buffer[pos] = '\0';
+                binary_mode = false;
                 
                 // 解析命令
                 int id, state;
@@ -162,10 +344,10 @@ int main() {
                 // 存储字符
                 buffer[pos++] = (char)c;
             }
+        } else if (frame_pos >= 0 && absolute_time_diff_us(frame_last_byte, get_absolute_time()) > FRAME_TIMEOUT_US) {
+            // 二进制帧接收中断时丢弃，避免吞掉之后的命令
+            frame_pos = -1;
         }
-        
-        // 短暂延时，避免CPU占用过高
-        sleep_ms(10);
     }
     
     return 0;
@@ -0,0 +1,101 @@
+import struct
+
+# 与 nebulizer_firmware.c 中的定义保持一致
+# 帧格式: [0xA5][类型][长度][数据...][CRC8]，CRC8（多项式0x07，初值0）覆盖类型、长度和数据
+FRAME_SYNC = 0xA5
+PROTOCOL_VERSION = 1
+FRAME_MAX_PAYLOAD = 32
+# 主机发送的帧类型
+FRAME_HELLO = 0x01  # 协商协议: [主机协议版本]
+FRAME_SET = 0x02    # 设置雾化器: [序号] + N x [ID][状态][时长(毫秒, 小端16位)]
+# 固件发送的帧类型
+FRAME_HELLO_REPLY = 0x81  # [固件协议版本][雾化器数量]
+FRAME_STATUS = 0x82       # [序号][状态码]
+FRAME_AUTO_STOP = 0x83    # [雾化器ID]
+
+# 状态码
+STATUS_OK = 0
+STATUS_BAD_ID = 1
+STATUS_BAD_LENGTH = 2
+STATUS_BAD_TYPE = 3
+STATUS_NAMES = {
+    STATUS_OK: "成功",
+    STATUS_BAD_ID: "雾化器ID无效",
+    STATUS_BAD_LENGTH: "帧长度不正确",
+    STATUS_BAD_TYPE: "未知的帧类型",
+}
+
+# 单个设置条目: ID、状态、时长
+SET_ENTRY = struct.Struct('<BBH')
+# 一帧最多包含的设置条目数
+MAX_SET_ENTRIES = (FRAME_MAX_PAYLOAD - 1) // SET_ENTRY.size
+# 时长上限（毫秒），0 表示使用固件默认时长
+MAX_DURATION_MS = 0xFFFF
+
+
+def crc8(data, crc=0):
+    for byte in data:
+        crc ^= byte
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x07) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+    return crc
+
+
+# 编码一帧
+def encode_frame(frame_type, payload=b''):
+    if len(payload) > FRAME_MAX_PAYLOAD:
+        raise ValueError(f"帧数据长度 {len(payload)} 超过上限 {FRAME_MAX_PAYLOAD}")
+    body = bytes([frame_type, len(payload)]) + bytes(payload)
+    return bytes([FRAME_SYNC]) + body + bytes([crc8(body)])
+
+
+def encode_hello(version=PROTOCOL_VERSION):
+    return encode_frame(FRAME_HELLO, bytes([version]))
+
+
+# 编码设置帧，entries 为 (雾化器ID, 开/关, 时长毫秒或None) 列表，时长为 None 或 0 时使用固件默认时长
+def encode_set(seq, entries):
+    if not entries or len(entries) > MAX_SET_ENTRIES:
+        raise ValueError(f"一帧只能包含1-{MAX_SET_ENTRIES}个设置条目")
+    payload = bytearray([seq & 0xFF])
+    for nebulizer_id, state, duration_ms in entries:
+        duration_ms = int(duration_ms or 0)
+        if not 0 <= duration_ms <= MAX_DURATION_MS:
+            raise ValueError(f"雾化器时长必须在0-{MAX_DURATION_MS}毫秒之间")
+        payload += SET_ENTRY.pack(nebulizer_id, 1 if state else 0, duration_ms)
+    return encode_frame(FRAME_SET, payload)
+
+
+# 从字节流中切分出完整且校验正确的帧，跳过帧之外的字节（如固件的文本输出）
+class FrameParser:
+    def __init__(self):
+        self._buffer = bytearray()
+        self.crc_errors = 0
+
+    # 输入新读到的字节，返回解析出的 (帧类型, 数据) 列表
+    def feed(self, data):
+        self._buffer += data
+        frames = []
+        while True:
+            start = self._buffer.find(FRAME_SYNC)
+            if start < 0:
+                self._buffer.clear()
+                break
+            del self._buffer[:start]
+            if len(self._buffer) < 3:
+                break
+            length = self._buffer[2]
+            if length > FRAME_MAX_PAYLOAD:
+                del self._buffer[:1]
+                continue
+            end = 3 + length + 1
+            if len(self._buffer) < end:
+                break
+            frame = bytes(self._buffer[:end])
+            if crc8(frame[1:-1]) != frame[-1]:
+                self.crc_errors += 1
+                del self._buffer[:1]
+                continue
+            frames.append((frame[1], frame[3:-1]))
+            del self._buffer[:end]
+        return frames
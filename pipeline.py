@@ -0,0 +1,247 @@
+import time
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# 队列已满时的处理策略
+DROP_OLDEST = 'drop_oldest'  # 丢弃队列中最旧的元素，放入新元素
+DROP_NEWEST = 'drop_newest'  # 丢弃新元素，保留队列原有内容
+BLOCK = 'block'              # 阻塞生产者，直到消费者腾出空间
+DROP_POLICIES = (DROP_OLDEST, DROP_NEWEST, BLOCK)
+
+# 阶段线程等待输入的轮询间隔（秒），用于及时响应停止信号
+STAGE_POLL_INTERVAL = 0.1
+# 阶段连续出错达到该次数时停止流水线；偶发的错误只丢弃出错的那一项
+MAX_CONSECUTIVE_ERRORS = 10
+
+
+# 有界队列，满时按 drop_policy 处理，并记录丢弃数和最大深度
+class BoundedQueue:
+    def __init__(self, name, maxsize=1, drop_policy=DROP_OLDEST):
+        if maxsize < 1:
+            raise ValueError(f"队列 {name} 的容量必须大于0")
+        if drop_policy not in DROP_POLICIES:
+            raise ValueError(f"未知的丢弃策略: {drop_policy}")
+        self.name = name
+        self.maxsize = maxsize
+        self.drop_policy = drop_policy
+        self._items = deque()
+        self._cond = threading.Condition()
+        self._closed = False
+
+        self.put_count = 0
+        self.dropped = 0
+        self.max_depth = 0
+
+    # 放入元素，成功返回 True，被丢弃返回 False
+    def put(self, item, timeout=None):
+        with self._cond:
+            if len(self._items) >= self.maxsize:
+                if self.drop_policy == DROP_NEWEST:
+                    self.dropped += 1
+                    return False
+                if self.drop_policy == DROP_OLDEST:
+                    self._items.popleft()
+                    self.dropped += 1
+                else:
+                    # 阻塞策略下超时不计为丢弃，由调用方决定是否重试
+                    self._cond.wait_for(
+                        lambda: len(self._items) < self.maxsize or self._closed, timeout)
+                    if self._closed:
+                        self.dropped += 1
+                        return False
+                    if len(self._items) >= self.maxsize:
+                        return False
+
+            self._items.append(item)
+            self.put_count += 1
+            self.max_depth = max(self.max_depth, len(self._items))
+            self._cond.notify_all()
+            return True
+
+    # 取出元素，超时或队列已关闭且为空时返回 None
+    def get(self, timeout=None):
+        with self._cond:
+            self._cond.wait_for(lambda: self._items or self._closed, timeout)
+            if not self._items:
+                return None
+            item = self._items.popleft()
+            self._cond.notify_all()
+            return item
+
+    # 关闭队列，唤醒所有等待中的生产者和消费者
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def depth(self):
+        return len(self._items)
+
+    def stats(self):
+        with self._cond:
+            return {
+                "depth": len(self._items),
+                "max_depth": self.max_depth,
+                "put": self.put_count,
+                "dropped": self.dropped,
+            }
+
+
+# 单个阶段的耗时和出错统计
+class StageStats:
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self.count = 0
+        self.total = 0.0
+        self.last = 0.0
+        self.max = 0.0
+        self.errors = 0
+        # 观察者（需提供 observe(seconds)，如指标直方图、trace记录），每次记录时依次调用
+        self.observers = []
+
+    def record(self, seconds):
+        with self._lock:
+            self.count += 1
+            self.total += seconds
+            self.last = seconds
+            if seconds > self.max:
+                self.max = seconds
+        for observer in self.observers:
+            observer.observe(seconds)
+
+    def record_error(self):
+        with self._lock:
+            self.errors += 1
+
+    # 以 with 语句统计一段代码的耗时
+    @contextmanager
+    def measure(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(time.perf_counter() - start)
+
+    def snapshot(self):
+        with self._lock:
+            avg = self.total / self.count if self.count else 0.0
+            return {
+                "count": self.count,
+                "avg_ms": avg * 1000,
+                "last_ms": self.last * 1000,
+                "max_ms": self.max * 1000,
+                "errors": self.errors,
+            }
+
+
+# 流水线阶段：在独立线程中从输入队列取数据，处理后放入输出队列
+# 没有输入队列的阶段作为数据源，func 以 None 为参数被反复调用
+# func 返回 None 表示本次没有输出；func 出错时记录并丢弃该项，连续出错 max_errors 次才停止流水线
+class PipelineStage:
+    def __init__(self, name, func, input_queue, output_queue, stop_event, max_errors=MAX_CONSECUTIVE_ERRORS):
+        self.name = name
+        self.func = func
+        self.input_queue = input_queue
+        self.output_queue = output_queue
+        self.stop_event = stop_event
+        self.max_errors = max_errors
+        self.stats = StageStats(name)
+        self.consecutive_errors = 0
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name=f"stage-{self.name}", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self.stop_event.is_set():
+            item = None
+            if self.input_queue is not None:
+                item = self.input_queue.get(timeout=STAGE_POLL_INTERVAL)
+                if item is None:
+                    continue
+
+            try:
+                with self.stats.measure():
+                    output = self.func(item)
+            except Exception as e:
+                self.stats.record_error()
+                self.consecutive_errors += 1
+                if self.consecutive_errors >= self.max_errors:
+                    logger.error(f"流水线阶段 {self.name} 连续出错 {self.consecutive_errors} 次，停止流水线: {e}")
+                    self.stop_event.set()
+                    return
+                logger.error(f"流水线阶段 {self.name} 出错，丢弃本项: {e}")
+                continue
+            self.consecutive_errors = 0
+
+            if output is not None and self.output_queue is not None:
+                # 阻塞策略的下游队列已满时持续重试，直到放入成功或流水线停止
+                while not self.output_queue.put(output, timeout=STAGE_POLL_INTERVAL):
+                    if self.output_queue.drop_policy != BLOCK or self.stop_event.is_set():
+                        break
+
+    def join(self, timeout=None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+
+# 流水线：管理各阶段线程、阶段间队列和统一的停止信号
+class Pipeline:
+    def __init__(self):
+        self.stop_event = threading.Event()
+        self.stages = []
+        self.queues = []
+        # 在调用方线程中运行的阶段（如必须在主线程的显示阶段）只登记耗时统计
+        self.extra_stats = {}
+
+    def add_queue(self, name, maxsize=1, drop_policy=DROP_OLDEST):
+        queue = BoundedQueue(name, maxsize, drop_policy)
+        self.queues.append(queue)
+        return queue
+
+    def add_stage(self, name, func, input_queue=None, output_queue=None):
+        stage = PipelineStage(name, func, input_queue, output_queue, self.stop_event)
+        self.stages.append(stage)
+        return stage
+
+    def add_stats(self, name):
+        stats = StageStats(name)
+        self.extra_stats[name] = stats
+        return stats
+
+    def start(self):
+        for stage in self.stages:
+            stage.start()
+
+    def stop(self, timeout=2.0):
+        self.stop_event.set()
+        for queue in self.queues:
+            queue.close()
+        for stage in self.stages:
+            stage.join(timeout)
+
+    def is_running(self):
+        return not self.stop_event.is_set()
+
+    def stats(self):
+        stages = {stage.name: stage.stats.snapshot() for stage in self.stages}
+        for name, stats in self.extra_stats.items():
+            stages[name] = stats.snapshot()
+        return {
+            "stages": stages,
+            "queues": {queue.name: queue.stats() for queue in self.queues},
+        }
+
+    # 单行文本形式的统计摘要，用于日志输出
+    def report(self):
+        stats = self.stats()
+        parts = [f"{name} {s['avg_ms']:.1f}ms(max {s['max_ms']:.1f})" + (f" 出错 {s['errors']}" if s['errors'] else "")
+                 for name, s in stats["stages"].items()]
+        parts += [f"{name}队列 {q['depth']}/{q['max_depth']} 丢弃 {q['dropped']}" for name, q in stats["queues"].items()]
+        return " | ".join(parts)
@@ -0,0 +1,133 @@
+import cv2
+import time
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+# MJPEG流中分隔各帧的边界字符串
+BOUNDARY = b'frame'
+# 客户端等待新帧的超时时间（秒），用于及时响应停止
+CLIENT_WAIT_TIMEOUT = 1.0
+
+INDEX_HTML = b"""<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>YOLO preview</title></head>
+<body style="margin:0;background:#000"><img src="/stream" style="max-width:100%"></body></html>
+"""
+
+
+# 本地HTTP预览：以 multipart/x-mixed-replace 输出MJPEG流。
+# 只有在有客户端连接时才编码，且编码频率不超过 fps，没人观看时不占用CPU
+class PreviewServer:
+    def __init__(self, host='127.0.0.1', port=8080, fps=5, quality=70):
+        self.host = host
+        self.port = port
+        self.fps = fps
+        self.quality = quality
+
+        self._cond = threading.Condition()
+        self._jpeg = None
+        self._frame_id = 0
+        self._last_encode = 0.0
+        self._stopped = False
+        self._server = None
+        self._thread = None
+
+        self.clients = 0
+        self.frames_encoded = 0
+
+    # 当前是否需要新的预览帧（有客户端连接且距上次编码已超过帧间隔）
+    def wants_frame(self, now=None):
+        now = time.monotonic() if now is None else now
+        return self.clients > 0 and now - self._last_encode >= 1.0 / self.fps
+
+    # 提交一帧，需要时编码为JPEG并推送给所有客户端，返回是否已编码
+    def publish(self, frame):
+        now = time.monotonic()
+        if not self.wants_frame(now):
+            return False
+        self._last_encode = now
+        ok, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+        if not ok:
+            return False
+        with self._cond:
+            self._jpeg = buffer.tobytes()
+            self._frame_id += 1
+            self.frames_encoded += 1
+            self._cond.notify_all()
+        return True
+
+    # 向一个客户端持续输出MJPEG流，直到断开或服务停止
+    def _stream(self, handler):
+        handler.send_response(200)
+        handler.send_header('Content-Type', 'multipart/x-mixed-replace; boundary=' + BOUNDARY.decode())
+        handler.send_header('Cache-Control', 'no-cache')
+        handler.end_headers()
+
+        with self._cond:
+            self.clients += 1
+            last_id = self._frame_id
+        logger.info(f"预览客户端已连接: {handler.client_address[0]}，当前 {self.clients} 个")
+        try:
+            while True:
+                with self._cond:
+                    self._cond.wait_for(lambda: self._frame_id > last_id or self._stopped, CLIENT_WAIT_TIMEOUT)
+                    if self._stopped:
+                        return
+                    if self._frame_id == last_id:
+                        continue
+                    last_id = self._frame_id
+                    jpeg = self._jpeg
+                handler.wfile.write(b'--' + BOUNDARY + b'\r\nContent-Type: image/jpeg\r\n' +
+                                    f'Content-Length: {len(jpeg)}\r\n\r\n'.encode() + jpeg + b'\r\n')
+                handler.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            with self._cond:
+                self.clients -= 1
+            logger.info(f"预览客户端已断开: {handler.client_address[0]}，当前 {self.clients} 个")
+
+    def _make_handler(self):
+        preview = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == '/':
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'text/html; charset=utf-8')
+                    self.send_header('Content-Length', str(len(INDEX_HTML)))
+                    self.end_headers()
+                    self.wfile.write(INDEX_HTML)
+                elif self.path == '/stream':
+                    preview._stream(self)
+                else:
+                    self.send_error(404)
+
+            def log_message(self, format, *args):
+                logger.debug(f"预览请求: {self.address_string()} {format % args}")
+
+        return Handler
+
+    # 在后台线程中启动HTTP服务
+    def start(self):
+        self._stopped = False
+        self._server = ThreadingHTTPServer((self.host, self.port), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name='preview-server', daemon=True)
+        self._thread.start()
+        logger.info(f"预览服务已启动: http://{self.host}:{self.port}/")
+        return self
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def stats(self):
+        return {"clients": self.clients, "encoded": self.frames_encoded}
@@ -0,0 +1,279 @@
+import os
+import json
+import time
+import queue
+import heapq
+import logging
+import threading
+import itertools
+
+from pipeline import StageStats
+
+logger = logging.getLogger(__name__)
+
+# 停止时等待当前打印任务完成的最长时间（秒）
+STOP_TIMEOUT = 30
+# 打印机未就绪时检查的间隔（秒）
+READY_POLL_INTERVAL = 0.5
+# 打印过程中打印机断开时，同一任务最多尝试打印的次数
+MAX_PRINT_ATTEMPTS = 3
+
+# 通知日志写入线程退出
+_STOP = object()
+
+
+# 打印任务
+class PrintJob:
+    def __init__(self, job_id, class_id, confidence, priority=0, created=None):
+        self.job_id = job_id
+        self.class_id = class_id
+        self.confidence = confidence
+        self.priority = priority
+        self.created = time.time() if created is None else created
+        self.attempts = 0
+        # 打印完成时间和结果，打印完成前为 None
+        self.finished_at = None
+        self.ok = None
+
+    def to_dict(self):
+        return {"id": self.job_id, "class_id": self.class_id, "confidence": self.confidence,
+                "priority": self.priority, "created": self.created}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["id"], data["class_id"], data["confidence"], data.get("priority", 0), data.get("created"))
+
+
+# 打印队列：唯一的工作线程持有打印机并依次执行任务，检测线程只负责提交。
+# 按优先级(高优先)和提交顺序出队；同一类别在 dedup_window 秒内只保留一个任务；
+# 队列满时新任务优先级更高则挤掉最低优先级的任务，否则拒绝；
+# 可选的日志文件(JSONL)记录未完成的任务，重启后重新打印，日志由后台线程写入，提交任务不等待磁盘；
+# 每个任务完成后在工作线程中调用 on_complete(job)；
+# ready() 返回 False（如打印机已断开）时任务留在队列中，等打印机恢复后再打印
+class PrintSpooler:
+    def __init__(self, print_fn, maxsize=8, dedup_window=0, journal_path=None, clock=time.time,
+                 on_complete=None, ready=None):
+        if maxsize < 1:
+            raise ValueError("打印队列容量必须大于0")
+        self.print_fn = print_fn
+        self.maxsize = maxsize
+        self.dedup_window = dedup_window
+        self.journal_path = journal_path
+        self.clock = clock
+        self.on_complete = on_complete
+        self.ready = ready
+
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopping = False
+        self._active = None
+        self._next_id = 1
+        self._last_submit = {}
+        self._journal = None
+        self._journal_queue = queue.Queue()
+        self._journal_thread = None
+
+        self.counts = {"submitted": 0, "deduplicated": 0, "rejected": 0, "evicted": 0,
+                       "restored": 0, "completed": 0, "failed": 0, "requeued": 0}
+        self.max_depth = 0
+        self.wait_stats = StageStats('print_wait')
+        self.print_stats = StageStats('print')
+
+        if journal_path:
+            self._restore()
+
+    # 读取日志中未完成的任务重新入队，并压缩日志文件只保留这些任务
+    def _restore(self):
+        pending = {}
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # 进程中断时可能留下写了一半的最后一行
+                        logger.warning(f"忽略打印日志中无法解析的记录: {line.strip()}")
+                        continue
+                    if record["op"] == "add":
+                        job = PrintJob.from_dict(record["job"])
+                        pending[job.job_id] = job
+                        job_id = job.job_id
+                    else:
+                        job_id = record["id"]
+                        pending.pop(job_id, None)
+                    self._next_id = max(self._next_id, job_id + 1)
+
+        tmp_path = self.journal_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for job in sorted(pending.values(), key=lambda j: j.job_id):
+                f.write(json.dumps({"op": "add", "job": job.to_dict()}) + "\n")
+        os.replace(tmp_path, self.journal_path)
+        self._journal = open(self.journal_path, 'a', encoding='utf-8')
+        self._journal_thread = threading.Thread(target=self._journal_loop, name='print-journal', daemon=True)
+        self._journal_thread.start()
+
+        for job in sorted(pending.values(), key=lambda j: j.job_id):
+            self._push(job)
+        self.counts["restored"] = len(pending)
+        if pending:
+            logger.info(f"从打印日志恢复了 {len(pending)} 个未完成的打印任务")
+
+    def _write_journal(self, record):
+        if self._journal is not None:
+            self._journal_queue.put(record)
+
+    # 日志写入线程：按提交顺序把已排队的记录一次写入并同步到磁盘
+    def _journal_loop(self):
+        while True:
+            records = [self._journal_queue.get()]
+            while True:
+                try:
+                    records.append(self._journal_queue.get_nowait())
+                except queue.Empty:
+                    break
+            lines = [json.dumps(record) + "\n" for record in records if record is not _STOP]
+            if lines:
+                try:
+                    self._journal.write(''.join(lines))
+                    self._journal.flush()
+                    os.fsync(self._journal.fileno())
+                except (OSError, ValueError) as e:
+                    logger.error(f"写入打印日志失败: {e}")
+            if len(lines) < len(records):
+                return
+
+    def _push(self, job):
+        heapq.heappush(self._heap, (-job.priority, next(self._seq), job))
+        self.max_depth = max(self.max_depth, len(self._heap))
+
+    # 提交打印任务，返回入队的任务；被去重或拒绝时返回 None
+    def submit(self, class_id, confidence, priority=0):
+        now = self.clock()
+        with self._cond:
+            last = self._last_submit.get(class_id)
+            if last is not None and now - last < self.dedup_window:
+                self.counts["deduplicated"] += 1
+                logger.info(f"类别 {class_id} 在 {self.dedup_window} 秒内已有打印任务，忽略")
+                return None
+
+            if len(self._heap) >= self.maxsize:
+                worst = max(self._heap)
+                if -worst[0] >= priority:
+                    self.counts["rejected"] += 1
+                    logger.warning(f"打印队列已满({self.maxsize})，拒绝类别 {class_id} 的打印任务")
+                    return None
+                self._heap.remove(worst)
+                heapq.heapify(self._heap)
+                self.counts["evicted"] += 1
+                self._write_journal({"op": "drop", "id": worst[2].job_id})
+                logger.warning(f"打印队列已满，丢弃低优先级任务 {worst[2].job_id}")
+
+            job = PrintJob(self._next_id, class_id, confidence, priority, now)
+            self._next_id += 1
+            self._last_submit[class_id] = now
+            self._write_journal({"op": "add", "job": job.to_dict()})
+            self._push(job)
+            self.counts["submitted"] += 1
+            self._cond.notify_all()
+            return job
+
+    def start(self):
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name='print-spooler', daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if self.ready is None:
+                    self._cond.wait_for(lambda: self._heap or self._stopping)
+                else:
+                    self._cond.wait_for(lambda: (self._heap and self.ready()) or self._stopping, READY_POLL_INTERVAL)
+                if self._stopping:
+                    return
+                if not self._heap or (self.ready is not None and not self.ready()):
+                    continue
+                job = heapq.heappop(self._heap)[2]
+                self._active = job
+            self._execute(job)
+
+    # 在当前线程中取出并打印下一个任务（不启动工作线程时使用，如离线回放），队列为空时返回 None
+    def run_next(self):
+        with self._cond:
+            if not self._heap:
+                return None
+            job = heapq.heappop(self._heap)[2]
+            self._active = job
+        self._execute(job)
+        return job
+
+    def _execute(self, job):
+        job.attempts += 1
+        if job.attempts == 1:
+            self.wait_stats.record(self.clock() - job.created)
+        try:
+            with self.print_stats.measure():
+                ok = self.print_fn(job.class_id, job.confidence)
+        except Exception as e:
+            logger.error(f"打印任务 {job.job_id} 出错: {e}")
+            ok = False
+            # 打印过程中打印机断开，任务重新排队，等重连后再打印
+            if self.ready is not None and not self.ready() and job.attempts < MAX_PRINT_ATTEMPTS:
+                with self._cond:
+                    self._push(job)
+                    self._active = None
+                    self.counts["requeued"] += 1
+                logger.warning(f"打印机已断开，任务 {job.job_id} 重新排队")
+                return
+
+        with self._cond:
+            job.ok = bool(ok)
+            job.finished_at = self.clock()
+            self.counts["completed" if ok else "failed"] += 1
+            self._write_journal({"op": "done", "id": job.job_id, "ok": job.ok})
+            self._active = None
+            self._cond.notify_all()
+
+        if self.on_complete is not None:
+            try:
+                self.on_complete(job)
+            except Exception as e:
+                logger.error(f"打印完成回调出错: {e}")
+
+    # 停止工作线程：等待正在打印的任务完成，队列中剩余的任务保留在日志中
+    def stop(self, timeout=STOP_TIMEOUT):
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        if self._journal_thread is not None:
+            self._journal_queue.put(_STOP)
+            self._journal_thread.join(timeout)
+            self._journal_thread = None
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+
+    # 等待队列为空且没有正在打印的任务
+    def wait_idle(self, timeout=None):
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._heap and self._active is None, timeout)
+
+    def depth(self):
+        return len(self._heap)
+
+    def stats(self):
+        with self._cond:
+            return {
+                **self.counts,
+                "depth": len(self._heap),
+                "max_depth": self.max_depth,
+                "printing": self._active is not None,
+                "wait": self.wait_stats.snapshot(),
+                "print": self.print_stats.snapshot(),
+            }
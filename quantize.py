@@ -0,0 +1,276 @@
+import os
+import cv2
+import sys
+import json
+import time
+import logging
+import argparse
+import numpy as np
+
+from inference_backend import (DEFAULT_IMGSZ, MODEL_CACHE_DIR, box_iou, cache_key, compare_detections,
+                               export_model, file_sha256, iter_frames, load_backend, write_cache_meta)
+
+logger = logging.getLogger(__name__)
+
+# 参与校准的最大帧数
+MAX_CALIBRATION_FRAMES = 300
+# 计算mAP时FP32模型结果作为参考标注的置信度阈值
+REFERENCE_CONF_THRESHOLD = 0.25
+# mAP匹配的IoU阈值
+MAP_IOU_THRESHOLD = 0.5
+# 触发判断使用的置信度阈值，用于统计量化前后在该阈值附近的判定差异
+TRIGGER_CONF_THRESHOLD = 0.85
+
+
+# 与ultralytics一致的letterbox预处理：等比缩放后用灰色(114)填充到 imgsz×imgsz
+def letterbox(frame, imgsz):
+    h, w = frame.shape[:2]
+    scale = min(imgsz / h, imgsz / w)
+    new_w, new_h = int(round(w * scale)), int(round(h * scale))
+    resized = cv2.resize(frame, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+    top = (imgsz - new_h) // 2
+    left = (imgsz - new_w) // 2
+    padded = np.full((imgsz, imgsz, 3), 114, dtype=np.uint8)
+    padded[top:top + new_h, left:left + new_w] = resized
+    return padded
+
+
+# BGR帧 → 模型输入张量 (1, 3, imgsz, imgsz)，RGB、归一化到0-1
+def preprocess(frame, imgsz):
+    img = letterbox(frame, imgsz)[:, :, ::-1].transpose(2, 0, 1)
+    return np.ascontiguousarray(img, dtype=np.float32)[None] / 255.0
+
+
+# 为onnxruntime静态量化提供校准数据
+def make_calibration_reader(frames, input_name, imgsz):
+    from onnxruntime.quantization import CalibrationDataReader
+
+    class FrameCalibrationReader(CalibrationDataReader):
+        def __init__(self):
+            self._iter = iter(frames)
+
+        def get_next(self):
+            frame = next(self._iter, None)
+            if frame is None:
+                return None
+            return {input_name: preprocess(frame, imgsz)}
+
+    return FrameCalibrationReader()
+
+
+# 检测头中的框解码部分(DFL/Sigmoid/Concat等)对量化误差敏感，
+# 框坐标(0-imgsz)和类别分数(0-1)会被拼接到同一个张量中共用量化尺度，导致置信度严重失真，因此保持FP32
+def detect_head_nodes(onnx_model):
+    prefixes = {}
+    for node in onnx_model.graph.node:
+        parts = node.name.split('/')
+        if len(parts) > 2 and parts[1].startswith('model.') and parts[1][6:].isdigit():
+            prefixes.setdefault(int(parts[1][6:]), []).append(node)
+    if not prefixes:
+        return []
+    return [node.name for node in prefixes[max(prefixes)] if node.op_type != 'Conv']
+
+
+# 对导出的FP32 ONNX模型做INT8静态量化
+def quantize_onnx(fp32_path, int8_path, calibration_frames, imgsz, calibrate_method='minmax'):
+    import onnx
+    from onnxruntime.quantization import CalibrationMethod, QuantFormat, QuantType, quantize_static
+
+    methods = {
+        'minmax': CalibrationMethod.MinMax,
+        'entropy': CalibrationMethod.Entropy,
+        'percentile': CalibrationMethod.Percentile,
+    }
+    fp32_model = onnx.load(fp32_path)
+    input_name = fp32_model.graph.input[0].name
+    excluded = detect_head_nodes(fp32_model)
+    logger.info(f"校准帧数: {len(calibration_frames)}，保持FP32的检测头节点: {len(excluded)}")
+
+    # 量化前先做形状推断和图优化，失败时直接使用原模型
+    source = fp32_path
+    try:
+        from onnxruntime.quantization.shape_inference import quant_pre_process
+        source = os.path.splitext(int8_path)[0] + '_prep.onnx'
+        quant_pre_process(fp32_path, source)
+    except Exception as e:
+        logger.warning(f"量化预处理失败，直接量化原模型: {e}")
+        source = fp32_path
+
+    quantize_static(
+        source, int8_path,
+        make_calibration_reader(calibration_frames, input_name, imgsz),
+        quant_format=QuantFormat.QDQ,
+        activation_type=QuantType.QUInt8,
+        weight_type=QuantType.QInt8,
+        per_channel=True,
+        nodes_to_exclude=excluded,
+        calibrate_method=methods[calibrate_method],
+    )
+    if source != fp32_path:
+        os.remove(source)
+
+    # 保留ultralytics写入的模型元数据(类别名、输入尺寸等)，否则加载时无法识别类别
+    int8_model = onnx.load(int8_path)
+    del int8_model.metadata_props[:]
+    int8_model.metadata_props.extend(fp32_model.metadata_props)
+    onnx.save(int8_model, int8_path)
+    return int8_path
+
+
+# 计算单个类别的AP（全点插值）
+def average_precision(candidates, num_references):
+    if num_references == 0:
+        return None
+    if not candidates:
+        return 0.0
+    candidates.sort(key=lambda c: -c[0])
+    tp = np.cumsum([1 if hit else 0 for _, hit in candidates])
+    fp = np.cumsum([0 if hit else 1 for _, hit in candidates])
+    recall = tp / num_references
+    precision = tp / np.maximum(tp + fp, 1)
+    recall = np.concatenate(([0.0], recall, [1.0]))
+    precision = np.concatenate(([1.0], precision, [0.0]))
+    precision = np.maximum.accumulate(precision[::-1])[::-1]
+    steps = np.where(recall[1:] != recall[:-1])[0]
+    return float(np.sum((recall[steps + 1] - recall[steps]) * precision[steps + 1]))
+
+
+# 以FP32模型的检测结果为参考标注，计算候选模型的mAP@0.5
+def pseudo_map(reference_results, candidate_results, iou_threshold=MAP_IOU_THRESHOLD,
+               reference_conf=REFERENCE_CONF_THRESHOLD):
+    candidates = {}
+    references = {}
+    for (ref_boxes, ref_conf, ref_cls), (cand_boxes, cand_conf, cand_cls) in zip(reference_results, candidate_results):
+        keep = ref_conf >= reference_conf
+        ref_boxes, ref_cls = ref_boxes[keep], ref_cls[keep]
+        for class_id in ref_cls:
+            references[int(class_id)] = references.get(int(class_id), 0) + 1
+
+        used = set()
+        for j in np.argsort(-cand_conf):
+            class_id = int(cand_cls[j])
+            best, best_iou = None, iou_threshold
+            for i in range(len(ref_boxes)):
+                if i in used or ref_cls[i] != class_id:
+                    continue
+                iou = box_iou(ref_boxes[i], cand_boxes[j])
+                if iou >= best_iou:
+                    best, best_iou = i, iou
+            if best is not None:
+                used.add(best)
+            candidates.setdefault(class_id, []).append((float(cand_conf[j]), best is not None))
+
+    per_class = {}
+    for class_id, count in references.items():
+        per_class[class_id] = average_precision(candidates.get(class_id, []), count)
+    values = [ap for ap in per_class.values() if ap is not None]
+    return (float(np.mean(values)) if values else 0.0), per_class
+
+
+# 在评估帧上运行后端，返回检测结果和单帧耗时(毫秒)
+def run_backend(backend, frames):
+    results, timings = [], []
+    for frame in frames:
+        start = time.perf_counter()
+        results.append(backend.predict(frame))
+        timings.append((time.perf_counter() - start) * 1000)
+    return results, timings
+
+
+def latency_summary(timings):
+    if not timings:
+        return {}
+    return {
+        'mean': float(np.mean(timings)),
+        'p50': float(np.percentile(timings, 50)),
+        'p95': float(np.percentile(timings, 95)),
+    }
+
+
+# 对比FP32与INT8模型：mAP、置信度漂移、触发阈值附近的判定差异和单帧耗时
+def evaluate(model_path, frames, imgsz):
+    fp32 = load_backend('onnx', model_path, imgsz)
+    int8 = load_backend('onnx-int8', model_path, imgsz)
+    if int8.name != 'onnx-int8':
+        raise RuntimeError("无法加载INT8模型")
+
+    fp32_results, fp32_timings = run_backend(fp32, frames)
+    int8_results, int8_timings = run_backend(int8, frames)
+
+    map_fp32, _ = pseudo_map(fp32_results, fp32_results)
+    map_int8, per_class = pseudo_map(fp32_results, int8_results)
+
+    diffs = []
+    trigger_flips = 0
+    for ref, cand in zip(fp32_results, int8_results):
+        result = compare_detections(ref, cand, MAP_IOU_THRESHOLD)
+        diffs.append(result['max_conf_diff'])
+        # 每类最高置信度是否跨过触发阈值
+        for class_id in set(ref[2].tolist()) | set(cand[2].tolist()):
+            ref_max = ref[1][ref[2] == class_id].max(initial=0.0)
+            cand_max = cand[1][cand[2] == class_id].max(initial=0.0)
+            if (ref_max > TRIGGER_CONF_THRESHOLD) != (cand_max > TRIGGER_CONF_THRESHOLD):
+                trigger_flips += 1
+
+    return {
+        'frames': len(frames),
+        'map50_fp32_reference': map_fp32,
+        'map50_int8': map_int8,
+        'map50_drift': map_int8 - map_fp32,
+        'map50_per_class': {str(k): v for k, v in per_class.items()},
+        'confidence_drift': {
+            'mean_max_abs': float(np.mean(diffs)) if diffs else 0.0,
+            'max_abs': float(np.max(diffs)) if diffs else 0.0,
+        },
+        'trigger_threshold_flips': trigger_flips,
+        'latency_ms': {
+            'fp32': latency_summary(fp32_timings),
+            'int8': latency_summary(int8_timings),
+        },
+    }
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="使用校准帧对YOLO模型做INT8训练后量化，并报告精度漂移和耗时")
+    parser.add_argument('calibration_dir', help="校准帧所在目录（摄像头采集的图片）")
+    parser.add_argument('--model', default='test_model.pt', help="源模型路径")
+    parser.add_argument('--imgsz', type=int, default=DEFAULT_IMGSZ, help="推理输入尺寸")
+    parser.add_argument('--max-frames', type=int, default=MAX_CALIBRATION_FRAMES, help="最多使用的校准帧数")
+    parser.add_argument('--method', default='minmax', choices=['minmax', 'entropy', 'percentile'], help="校准方法")
+    parser.add_argument('--eval-dir', help="评估帧目录，默认与校准目录相同")
+    parser.add_argument('--report', help="将评估报告写入JSON文件")
+    args = parser.parse_args()
+
+    calibration_frames = list(iter_frames(args.calibration_dir, args.max_frames))
+    if not calibration_frames:
+        logger.error(f"校准目录中没有可读取的图片: {args.calibration_dir}")
+        return 1
+
+    fp32_path = export_model(args.model, 'onnx', args.imgsz)
+    key = cache_key(args.model, 'onnx', args.imgsz, 'int8')
+    int8_path = os.path.join(MODEL_CACHE_DIR, key + '.onnx')
+
+    logger.info("正在进行INT8量化...")
+    start = time.perf_counter()
+    quantize_onnx(fp32_path, int8_path, calibration_frames, args.imgsz, args.method)
+    logger.info(f"量化完成，用时 {time.perf_counter() - start:.1f} 秒: {int8_path}")
+    write_cache_meta(key, args.model, file_sha256(args.model), int8_path,
+                     format='onnx', imgsz=args.imgsz, precision='int8',
+                     calibration_dir=os.path.abspath(args.calibration_dir),
+                     calibration_frames=len(calibration_frames), calibrate_method=args.method)
+
+    eval_frames = calibration_frames
+    if args.eval_dir:
+        eval_frames = list(iter_frames(args.eval_dir, args.max_frames))
+    report = evaluate(args.model, eval_frames, args.imgsz)
+    report['int8_model'] = int8_path
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,119 @@
+import time
+import logging
+import threading
+from escpos.printer import Dummy
+
+logger = logging.getLogger(__name__)
+
+# 小票中的时间格式及编译时使用的等长占位符（纯ASCII，在任何代码页下都是单字节，可直接替换）
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+TIMESTAMP_PLACEHOLDER = "0000-00-00 00:00:00"
+# 单次USB批量写入的最大字节数
+WRITE_CHUNK_SIZE = 16384
+# 估算打印时间用的打印机参数：每毫米点数(203dpi)、默认行高（1/6英寸，点）和走纸速度（毫米/秒）
+DOTS_PER_MM = 8
+LINE_FEED_DOTS = 34
+PRINT_SPEED_MM = 50
+
+# 光栅图像(GS v 0)和按行数走纸(ESC d n)命令
+RASTER_IMAGE = b'\x1dv0'
+FEED_LINES = b'\x1bd'
+
+
+# 编译好的小票：时间戳前后的两段字节，打印时拼接当前时间即可发送
+class CompiledReceipt:
+    def __init__(self, prefix, suffix):
+        self.prefix = prefix
+        self.suffix = suffix
+
+    def render(self, timestamp_text):
+        stamp = timestamp_text.encode('ascii')
+        if len(stamp) != len(TIMESTAMP_PLACEHOLDER):
+            raise ValueError(f"时间戳长度必须为 {len(TIMESTAMP_PLACEHOLDER)}: {timestamp_text}")
+        return self.prefix + stamp + self.suffix
+
+    def __len__(self):
+        return len(self.prefix) + len(TIMESTAMP_PLACEHOLDER) + len(self.suffix)
+
+
+# 在虚拟打印机上执行 render(printer, timestamp_text)，把生成的ESC/POS字节按时间戳占位符拆成两段
+def compile_receipt(render):
+    dummy = Dummy()
+    render(dummy, TIMESTAMP_PLACEHOLDER)
+    output = dummy.output
+    placeholder = TIMESTAMP_PLACEHOLDER.encode('ascii')
+    if output.count(placeholder) != 1:
+        raise ValueError("小票中必须恰好包含一个时间戳")
+    prefix, suffix = output.split(placeholder)
+    return CompiledReceipt(prefix, suffix)
+
+
+# 小票编译器：每个类别的小票（Logo、标题、正文、结尾、切纸）只编译一次，
+# version() 返回值变化时（如Logo图片被替换）全部重新编译
+class ReceiptCompiler:
+    def __init__(self, render, version=None):
+        self._render = render
+        self._version_fn = version
+        self._version = None
+        self._receipts = {}
+        self._lock = threading.Lock()
+
+    def _check_version(self):
+        if self._version_fn is None:
+            return
+        version = self._version_fn()
+        if version != self._version:
+            self._receipts.clear()
+            self._version = version
+
+    def get(self, class_id):
+        with self._lock:
+            self._check_version()
+            receipt = self._receipts.get(class_id)
+            if receipt is None:
+                start = time.perf_counter()
+                receipt = compile_receipt(lambda printer, stamp: self._render(printer, class_id, stamp))
+                self._receipts[class_id] = receipt
+                logger.info(f"已编译类别 {class_id} 的小票: {len(receipt)} 字节，用时 {(time.perf_counter() - start) * 1000:.1f} 毫秒")
+            return receipt
+
+    # 预先编译所有类别的小票
+    def compile_all(self, class_ids):
+        for class_id in class_ids:
+            self.get(class_id)
+
+    # 生成带当前时间的完整小票字节
+    def render(self, class_id, timestamp_text=None):
+        if timestamp_text is None:
+            timestamp_text = time.strftime(TIMESTAMP_FORMAT)
+        return self.get(class_id).render(timestamp_text)
+
+
+# 以少量大块写入把字节发送给打印机
+def send_raw(printer, data, chunk_size=WRITE_CHUNK_SIZE):
+    for offset in range(0, len(data), chunk_size):
+        printer._raw(data[offset:offset + chunk_size])
+    # 编译时的代码页切换已直接写入打印机，清除escpos记录的当前编码，后续文本会重新发送代码页命令
+    magic = getattr(printer, 'magic', None)
+    if magic is not None:
+        magic.encoding = None
+
+
+# 按走纸长度估算打印 data 需要的时间（秒）：光栅图像按行数计，文本按换行和 ESC d 走纸行数计
+def estimate_print_seconds(data, speed_mm=PRINT_SPEED_MM):
+    dots = 0
+    i = 0
+    while i < len(data):
+        if data.startswith(RASTER_IMAGE, i) and i + 8 <= len(data):
+            width_bytes = data[i + 4] | data[i + 5] << 8
+            height = data[i + 6] | data[i + 7] << 8
+            dots += height
+            i += 8 + width_bytes * height
+        elif data.startswith(FEED_LINES, i) and i + 3 <= len(data):
+            dots += data[i + 2] * LINE_FEED_DOTS
+            i += 3
+        else:
+            if data[i] == 0x0a:
+                dots += LINE_FEED_DOTS
+            i += 1
+    return dots / DOTS_PER_MM / speed_mm
@@ -0,0 +1,343 @@
+import os
+import sys
+import json
+import logging
+import argparse
+import unicodedata
+from PIL import Image, ImageDraw, ImageFont, ImageOps
+
+logger = logging.getLogger(__name__)
+
+# 默认模板文件
+DEFAULT_TEMPLATE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'receipts.json')
+# 58mm打印纸每行可打印的半角字符数（中文字符占两个）
+LINE_WIDTH = 32
+# 分段可用的对齐方式
+ALIGNMENTS = ('left', 'center', 'right')
+# 固定在最后的气味构成分段标题
+SCENT_HEADING = "气味构成"
+# 预览图宽度（与58mm打印纸的有效打印宽度一致）及字体设置
+PREVIEW_WIDTH = 384
+PREVIEW_FONT_SIZE = 24
+PREVIEW_LINE_HEIGHT = 30
+PREVIEW_MARGIN = 16
+# 预览时依次尝试的中文字体
+PREVIEW_FONT_PATHS = (
+    '/usr/share/fonts/truetype/wqy/wqy-microhei.ttc',
+    '/usr/share/fonts/truetype/wqy/wqy-zenhei.ttc',
+    '/usr/share/fonts/opentype/noto/NotoSansCJK-Regular.ttc',
+    '/usr/share/fonts/truetype/droid/DroidSansFallbackFull.ttf',
+    'C:/Windows/Fonts/msyh.ttc',
+    '/System/Library/Fonts/PingFang.ttc',
+)
+
+RECEIPT_KEYS = {'title', 'sections', 'scent'}
+SECTION_KEYS = {'heading', 'lines', 'align', 'bold'}
+
+
+# 模板文件格式或内容错误
+class TemplateError(ValueError):
+    pass
+
+
+# 按打印宽度计算的显示宽度（全角字符占两列）
+def display_width(text):
+    return sum(2 if unicodedata.east_asian_width(ch) in ('W', 'F') else 1 for ch in text)
+
+
+def _require_text(value, where):
+    if not isinstance(value, str) or not value.strip():
+        raise TemplateError(f"{where} 必须是非空字符串")
+    if '\n' in value:
+        raise TemplateError(f"{where} 不能包含换行符")
+    if display_width(value) > LINE_WIDTH:
+        logger.warning(f"{where} 超过每行 {LINE_WIDTH} 个字符宽度，打印时会自动换行: {value}")
+    return value
+
+
+def _require_lines(value, where):
+    if not isinstance(value, list) or not value:
+        raise TemplateError(f"{where} 必须是非空列表")
+    return [_require_text(line, f"{where}[{i}]") for i, line in enumerate(value)]
+
+
+# 校验单个类别的小票模板，返回统一格式的分段列表（气味构成作为最后一段）
+def _validate_receipt(label, receipt):
+    where = f"receipts.{label}"
+    if not isinstance(receipt, dict):
+        raise TemplateError(f"{where} 必须是对象")
+    unknown = set(receipt) - RECEIPT_KEYS
+    if unknown:
+        raise TemplateError(f"{where} 包含未知字段: {', '.join(sorted(unknown))}")
+
+    title = _require_text(receipt.get('title'), f"{where}.title")
+    sections = receipt.get('sections', [])
+    if not isinstance(sections, list):
+        raise TemplateError(f"{where}.sections 必须是列表")
+
+    result = []
+    for i, section in enumerate(sections):
+        section_where = f"{where}.sections[{i}]"
+        if not isinstance(section, dict):
+            raise TemplateError(f"{section_where} 必须是对象")
+        unknown = set(section) - SECTION_KEYS
+        if unknown:
+            raise TemplateError(f"{section_where} 包含未知字段: {', '.join(sorted(unknown))}")
+        align = section.get('align')
+        if align is not None and align not in ALIGNMENTS:
+            raise TemplateError(f"{section_where}.align 必须是 {'/'.join(ALIGNMENTS)} 之一")
+        bold = section.get('bold')
+        if bold is not None and not isinstance(bold, bool):
+            raise TemplateError(f"{section_where}.bold 必须是 true 或 false")
+        result.append({
+            'heading': _require_text(section.get('heading'), f"{section_where}.heading"),
+            'lines': _require_lines(section.get('lines'), f"{section_where}.lines"),
+            'align': align,
+            'bold': bold,
+        })
+
+    if 'scent' in receipt:
+        result.append({'heading': SCENT_HEADING, 'lines': _require_lines(receipt['scent'], f"{where}.scent"),
+                       'align': None, 'bold': None})
+    if not result:
+        raise TemplateError(f"{where} 至少需要一个分段或气味构成")
+    return title, result
+
+
+# 把连续的文本合并为一次 printer.text() 调用
+def _append_text(ops, text):
+    if ops and ops[-1][0] == 'text':
+        ops[-1] = ('text', ops[-1][1] + text)
+    else:
+        ops.append(('text', text))
+
+
+# 把一张小票编译为打印操作序列: ('set', 参数) / ('text', 文本) / ('time',) / ('cut',)
+def compile_ops(brand, title=None, sections=()):
+    separator = "-" * LINE_WIDTH
+    ops = []
+
+    # 时间和分隔线
+    ops.append(('set', {'align': 'center'}))
+    _append_text(ops, "\n" + separator + "\n")
+    ops.append(('time',))
+    _append_text(ops, separator + "\n\n")
+
+    # 标题和各分段内容
+    if title is not None:
+        ops.append(('set', {'align': 'center', 'bold': True}))
+        _append_text(ops, title + "\n\n")
+        ops.append(('set', {'bold': False}))
+        ops.append(('set', {'align': 'left'}))
+    for i, section in enumerate(sections):
+        styled = section['align'] is not None or section['bold'] is not None
+        if styled:
+            ops.append(('set', {'align': section['align'] or 'left', 'bold': bool(section['bold'])}))
+        _append_text(ops, section['heading'] + "：\n")
+        for line in section['lines']:
+            _append_text(ops, line + "\n")
+        if styled:
+            ops.append(('set', {'align': 'left', 'bold': False}))
+        if i < len(sections) - 1:
+            _append_text(ops, "\n")
+
+    # 结尾和切纸
+    _append_text(ops, "\n\n")
+    ops.append(('set', {'align': 'center'}))
+    _append_text(ops, separator + "\n" + brand + "\n" + separator + "\n\n")
+    ops.append(('cut',))
+    return tuple(ops)
+
+
+# 在打印机（或兼容的虚拟/预览打印机）上执行操作序列
+def run_ops(printer, ops, current_time):
+    for op in ops:
+        kind = op[0]
+        if kind == 'text':
+            printer.text(op[1])
+        elif kind == 'set':
+            printer.set(**op[1])
+        elif kind == 'time':
+            printer.text(f"时间: {current_time}\n")
+        elif kind == 'cut':
+            printer.cut()
+
+
+# 已校验并编译的小票模板集合
+class ReceiptTemplates:
+    def __init__(self, brand, receipts):
+        self.brand = brand
+        self._ops = {label: compile_ops(brand, title, sections) for label, (title, sections) in receipts.items()}
+        self._fallback_ops = compile_ops(brand)
+
+    def __contains__(self, label):
+        return label in self._ops
+
+    def labels(self):
+        return list(self._ops)
+
+    # 返回类别的操作序列，没有模板的类别只打印时间和结尾
+    def ops(self, label):
+        return self._ops.get(label, self._fallback_ops)
+
+
+# 校验模板数据并编译，labels 为必须提供模板的类别标签
+def parse_templates(data, labels=()):
+    if not isinstance(data, dict):
+        raise TemplateError("模板文件顶层必须是对象")
+    unknown = set(data) - {'brand', 'receipts'}
+    if unknown:
+        raise TemplateError(f"模板文件包含未知字段: {', '.join(sorted(unknown))}")
+    brand = _require_text(data.get('brand'), "brand")
+    receipts = data.get('receipts')
+    if not isinstance(receipts, dict) or not receipts:
+        raise TemplateError("receipts 必须是非空对象")
+
+    missing = [label for label in labels if label not in receipts]
+    if missing:
+        raise TemplateError(f"缺少类别的小票模板: {', '.join(missing)}")
+    return ReceiptTemplates(brand, {label: _validate_receipt(label, receipt) for label, receipt in receipts.items()})
+
+
+# 读取、校验并编译模板文件
+def load_templates(path=DEFAULT_TEMPLATE_PATH, labels=()):
+    try:
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+    except json.JSONDecodeError as e:
+        raise TemplateError(f"模板文件不是有效的JSON: {path}: {e}") from e
+    templates = parse_templates(data, labels)
+    logger.info(f"已加载 {len(templates.labels())} 个小票模板: {path}")
+    return templates
+
+
+# 加载预览字体，找不到中文字体时使用PIL默认字体（中文会显示为方框）
+def load_preview_font(path=None, size=PREVIEW_FONT_SIZE):
+    for candidate in ((path,) if path else PREVIEW_FONT_PATHS):
+        if os.path.exists(candidate):
+            return ImageFont.truetype(candidate, size)
+    if path:
+        raise FileNotFoundError(f"字体文件不存在: {path}")
+    logger.warning("未找到中文字体，请用 --font 指定字体文件")
+    try:
+        return ImageFont.load_default(size)
+    except TypeError:
+        # Pillow 10.1 之前的默认字体不支持指定大小
+        return ImageFont.load_default()
+
+
+# 预览打印机：接受与escpos打印机相同的 set/text/image/cut 调用，按行排版后绘制为图片
+class PreviewPrinter:
+    def __init__(self, font, width=PREVIEW_WIDTH):
+        self.font = font
+        self.width = width
+        self.align = 'left'
+        self.bold = False
+        self.rows = []
+        self._line = ""
+
+    def set(self, align=None, bold=None, **kwargs):
+        if align is not None:
+            self.align = align
+        if bold is not None:
+            self.bold = bold
+
+    def _flush(self):
+        # 超出打印宽度的行自动换行
+        text, line = self._line, ""
+        usable = self.width - 2 * PREVIEW_MARGIN
+        for ch in text:
+            if line and self.font.getlength(line + ch) > usable:
+                self.rows.append(('text', line, self.align, self.bold))
+                line = ""
+            line += ch
+        self.rows.append(('text', line, self.align, self.bold))
+        self._line = ""
+
+    def text(self, txt):
+        for ch in txt:
+            if ch == '\n':
+                self._flush()
+            else:
+                self._line += ch
+
+    def image(self, img):
+        self.rows.append(('image', img, self.align, self.bold))
+
+    def cut(self):
+        if self._line:
+            self._flush()
+        self.rows.append(('cut', None, self.align, self.bold))
+
+    def render(self):
+        heights = [row[1].height if row[0] == 'image' else PREVIEW_LINE_HEIGHT for row in self.rows]
+        canvas = Image.new('L', (self.width, sum(heights) + 2 * PREVIEW_MARGIN), 255)
+        draw = ImageDraw.Draw(canvas)
+        y = PREVIEW_MARGIN
+        for (kind, payload, align, bold), height in zip(self.rows, heights):
+            if kind == 'image':
+                canvas.paste(payload, ((self.width - payload.width) // 2, y))
+            elif kind == 'cut':
+                for x in range(0, self.width, 12):
+                    draw.line((x, y + height // 2, x + 6, y + height // 2), fill=0)
+            elif payload:
+                text_width = self.font.getlength(payload)
+                if align == 'center':
+                    x = (self.width - text_width) / 2
+                elif align == 'right':
+                    x = self.width - PREVIEW_MARGIN - text_width
+                else:
+                    x = PREVIEW_MARGIN
+                draw.text((x, y), payload, font=self.font, fill=0, stroke_width=1 if bold else 0, stroke_fill=0)
+            y += height
+        return canvas
+
+
+# 把一个类别的小票渲染为PNG预览图（包括标题和可选的Logo）
+def render_preview(templates, label, current_time, logo_path=None, font=None, width=PREVIEW_WIDTH):
+    printer = PreviewPrinter(font or load_preview_font(), width)
+    printer.set(align='center')
+    printer.text(templates.brand + "\n\n")
+    if logo_path:
+        logo = ImageOps.grayscale(Image.open(logo_path))
+        logo = logo.resize((width, int(logo.height * width / logo.width)), Image.LANCZOS)
+        printer.image(logo.convert('1').convert('L'))
+        printer.text("\n")
+    run_ops(printer, templates.ops(label), current_time)
+    return printer.render()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="校验小票模板并生成PNG预览图")
+    parser.add_argument('labels', nargs='*', help="要预览的类别标签，默认全部")
+    parser.add_argument('--templates', default=DEFAULT_TEMPLATE_PATH, help="模板文件路径")
+    parser.add_argument('--output-dir', default='receipt_preview', help="预览图输出目录")
+    parser.add_argument('--logo', help="Logo图片路径")
+    parser.add_argument('--font', help="中文字体文件路径")
+    parser.add_argument('--time', default="2000-01-01 00:00:00", help="预览中显示的时间")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    try:
+        templates = load_templates(args.templates)
+    except (OSError, TemplateError) as e:
+        logger.error(f"模板校验失败: {e}")
+        return 1
+
+    labels = args.labels or templates.labels()
+    unknown = [label for label in labels if label not in templates]
+    if unknown:
+        logger.error(f"模板中没有这些类别: {', '.join(unknown)}")
+        return 1
+
+    font = load_preview_font(args.font)
+    os.makedirs(args.output_dir, exist_ok=True)
+    for label in labels:
+        path = os.path.join(args.output_dir, f"receipt_{label}.png")
+        render_preview(templates, label, args.time, args.logo, font).save(path)
+        logger.info(f"已生成预览图: {path}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
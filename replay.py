@@ -0,0 +1,244 @@
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import cv2
+import numpy as np
+from escpos.printer import Dummy
+
+import yolo_nebulizer as yn
+from pipeline import StageStats
+from print_spooler import PrintSpooler
+from inference_backend import iter_frames, load_backend
+
+logger = logging.getLogger(__name__)
+
+# 图片目录或未标注帧率的视频使用的默认帧率
+DEFAULT_REPLAY_FPS = 30
+# 模拟的单张小票打印时间（秒），打印完成后恢复检测
+SIMULATED_PRINT_DURATION = 5.0
+# 仓库自带的Logo图片，现场路径不存在时使用
+LOCAL_LOGO_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'logo2.png')
+
+
+# 模拟时钟：时间由回放的帧时间戳决定，与实际运行速度无关
+class SimulatedClock:
+    def __init__(self, start=0.0):
+        self.now = start
+
+    def __call__(self):
+        return self.now
+
+
+# 串口替身：记录发送给RP2040的命令
+class RecordingSerial:
+    def __init__(self, clock):
+        self.clock = clock
+        self.commands = []
+
+    def write(self, data):
+        self.commands.append({"t": self.clock(), "command": data.decode().strip()})
+        return len(data)
+
+    def close(self):
+        pass
+
+
+# 打印机替身：基于escpos的Dummy打印机，记录每个打印任务生成的ESC/POS数据量和渲染耗时。
+# 任务经过与现场相同的 PrintSpooler（去重、队列容量），但不启动打印线程，而是在回放线程中同步打印
+class RecordingPrinter(Dummy):
+    def __init__(self, clock, print_duration=SIMULATED_PRINT_DURATION):
+        super().__init__()
+        self.clock = clock
+        self.print_duration = print_duration
+        self.jobs = []
+        self.spooler = PrintSpooler(self.print_job, yn.PRINT_QUEUE_SIZE, yn.print_dedup_window(), clock=clock)
+
+    def print_job(self, class_id, confidence):
+        start = time.perf_counter()
+        ok = yn.print_receipt(self, class_id, confidence)
+        self.jobs.append({
+            "t": self.clock(),
+            "class_id": class_id,
+            "ok": bool(ok),
+            "bytes": len(self.output),
+            "render_ms": (time.perf_counter() - start) * 1000,
+        })
+        self.clear()
+        return ok
+
+    # 与 PrintSpooler.submit 参数和返回值一致：被去重或拒绝时返回 None；
+    # 接受的任务立即打印，按模拟打印时间标记完成
+    def submit(self, class_id, confidence):
+        job = self.spooler.submit(class_id, confidence)
+        if job is None:
+            return None
+        self.spooler.run_next()
+        job.finished_at = job.created + self.print_duration
+        return job
+
+
+# 从视频文件或图片目录读取帧，按帧率生成模拟时间戳
+def frame_records(source, fps, max_frames=None):
+    for index, frame in enumerate(iter_frames(source, max_frames)):
+        yield index / fps, frame, None
+
+
+# 从检测日志(JSONL，每行 {"t": 时间戳, "cls": [...], "conf": [...]})读取每帧检测结果
+def detection_records(path, max_frames=None):
+    with open(path, encoding='utf-8') as f:
+        for index, line in enumerate(f):
+            if max_frames is not None and index >= max_frames:
+                return
+            record = json.loads(line)
+            detections = (np.zeros((len(record['cls']), 4), dtype=np.float32),
+                          np.asarray(record['conf'], dtype=np.float32),
+                          np.asarray(record['cls'], dtype=int))
+            yield record['t'], None, detections
+
+
+def source_fps(source):
+    if os.path.isdir(source):
+        return DEFAULT_REPLAY_FPS
+    cap = cv2.VideoCapture(source)
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    cap.release()
+    return fps if fps and fps > 0 else DEFAULT_REPLAY_FPS
+
+
+# 无头回放：不使用摄像头、串口和打印机，按模拟时钟依次执行推理和触发判断，返回触发时间线和吞吐量统计
+def run_replay(source, backend=None, fps=None, realtime=False, max_frames=None, save_detections=None,
+               print_duration=SIMULATED_PRINT_DURATION):
+    is_log = source.endswith('.jsonl')
+    if is_log:
+        records = detection_records(source, max_frames)
+    else:
+        fps = fps or source_fps(source)
+        records = frame_records(source, fps, max_frames)
+
+    clock = SimulatedClock()
+    engine = yn.create_trigger_engine(clock)
+    ser = RecordingSerial(clock)
+    printer = RecordingPrinter(clock, print_duration)
+    governor = yn.create_governor(backend) if backend is not None else None
+    motion_gate = yn.create_motion_gate() if backend is not None else None
+
+    infer_stats = StageStats('infer')
+    trigger_stats = StageStats('trigger')
+    counts = {"frames": 0, "paused": 0, "inferred": 0, "reused": 0, "skipped": 0}
+    timeline = []
+    log_file = open(save_detections, 'w', encoding='utf-8') if save_detections else None
+
+    wall_start = time.perf_counter()
+    sim_start = None
+    timestamp = 0.0
+    try:
+        for index, (timestamp, frame, detections) in enumerate(records):
+            if sim_start is None:
+                sim_start = timestamp
+            clock.now = timestamp
+
+            # 按模拟时间节奏回放
+            if realtime:
+                delay = (timestamp - sim_start) - (time.perf_counter() - wall_start)
+                if delay > 0:
+                    time.sleep(delay)
+
+            packet = yn.FramePacket(index, frame, timestamp)
+            packet.paused = engine.is_paused(timestamp)
+
+            if detections is not None:
+                if not packet.paused:
+                    packet.boxes, packet.confidences, packet.class_ids = detections
+            else:
+                with infer_stats.measure():
+                    yn.run_inference(packet, backend, governor, motion_gate)
+
+            with trigger_stats.measure():
+                yn.handle_detections(packet, engine, ser, printer.submit)
+
+            counts["frames"] += 1
+            counts["paused"] += packet.paused
+            counts["inferred"] += packet.inferred
+            counts["reused"] += packet.reused
+            counts["skipped"] += packet.skipped
+
+            if log_file is not None and not packet.paused and not packet.skipped:
+                log_file.write(json.dumps({
+                    "t": timestamp,
+                    "cls": packet.class_ids.tolist(),
+                    "conf": [round(float(c), 4) for c in packet.confidences],
+                }) + "\n")
+
+            for event in packet.events:
+                timeline.append({
+                    "t": event.timestamp,
+                    "class_id": event.class_id,
+                    "label": yn.CLASS_NAMES[event.class_id],
+                    "duration": event.duration,
+                    "avg_confidence": event.avg_confidence,
+                })
+    finally:
+        if log_file is not None:
+            log_file.close()
+
+    wall_time = time.perf_counter() - wall_start
+    sim_duration = timestamp - (sim_start or 0.0)
+    return {
+        "source": source,
+        **counts,
+        "sim_duration_s": sim_duration,
+        "wall_time_s": wall_time,
+        "throughput_fps": counts["frames"] / wall_time if wall_time > 0 else 0.0,
+        "realtime_factor": sim_duration / wall_time if wall_time > 0 else 0.0,
+        "triggers": timeline,
+        "serial_commands": ser.commands,
+        "print_jobs": printer.jobs,
+        "print_spooler": {key: value for key, value in printer.spooler.counts.items() if value},
+        "stages": {
+            "infer": infer_stats.snapshot(),
+            "trigger": trigger_stats.snapshot(),
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="离线回放视频、图片目录或检测日志，输出触发时间线和吞吐量（无需摄像头、串口和打印机）")
+    parser.add_argument('source', help="视频文件、图片目录或检测日志(.jsonl)")
+    parser.add_argument('--fps', type=float, help="模拟时钟帧率，默认使用视频自身帧率")
+    parser.add_argument('--realtime', action='store_true', help="按模拟时钟实时回放，默认以最快速度运行")
+    parser.add_argument('--backend', default=yn.INFERENCE_BACKEND, help="推理后端")
+    parser.add_argument('--max-frames', type=int, help="最多回放的帧数")
+    parser.add_argument('--save-detections', metavar='PATH', help="将每帧检测结果保存为JSONL检测日志，供之后快速回放")
+    parser.add_argument('--print-duration', type=float, default=SIMULATED_PRINT_DURATION, help="模拟的单张小票打印时间（秒）")
+    parser.add_argument('--logo', help="Logo图片路径")
+    parser.add_argument('--output', help="将回放报告写入JSON文件")
+    parser.add_argument('--quiet', action='store_true', help="只输出警告和错误日志")
+    args = parser.parse_args()
+
+    if args.quiet:
+        logging.getLogger().setLevel(logging.WARNING)
+
+    if args.logo:
+        yn.LOGO_PATH = args.logo
+    elif not os.path.exists(yn.LOGO_PATH):
+        yn.LOGO_PATH = LOCAL_LOGO_PATH
+
+    backend = None
+    if not args.source.endswith('.jsonl'):
+        backend = load_backend(args.backend, yn.MODEL_PATH, yn.INFERENCE_IMGSZ)
+
+    report = run_replay(args.source, backend, args.fps, args.realtime, args.max_frames, args.save_detections,
+                        args.print_duration)
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text)
+    print(text)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
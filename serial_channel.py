@@ -0,0 +1,322 @@
+import re
+import time
+import logging
+import threading
+from collections import namedtuple, Counter
+
+from pipeline import BoundedQueue, StageStats, DROP_NEWEST, STAGE_POLL_INTERVAL
+from nebulizer_protocol import (FrameParser, encode_hello, encode_set, PROTOCOL_VERSION, MAX_SET_ENTRIES,
+                                FRAME_HELLO_REPLY, FRAME_STATUS, FRAME_AUTO_STOP, STATUS_OK, STATUS_NAMES)
+
+logger = logging.getLogger(__name__)
+
+# 等待固件确认的超时时间（秒）和未确认时的重试次数
+ACK_TIMEOUT = 0.5
+MAX_RETRIES = 2
+# 待发送命令队列容量
+COMMAND_QUEUE_SIZE = 32
+# 关闭时等待队列中命令发送完毕的最长时间（秒）
+CLOSE_TIMEOUT = 3.0
+# 协商二进制协议时等待固件应答的时间（秒）
+NEGOTIATE_TIMEOUT = 0.5
+
+# 通信协议
+TEXT = 'text'
+BINARY = 'binary'
+
+# 固件回复的事件类型
+STARTED = 'started'            # 雾化器 N 已启动
+STOPPED = 'stopped'            # 雾化器 N 已停止
+AUTO_STOPPED = 'auto_stopped'  # 雾化器 N 已自动停止
+ERROR = 'error'                # 错误：...
+BOOT = 'boot'                  # 雾化器控制系统已启动
+STATUS = 'status'              # 二进制协议的状态码应答
+UNKNOWN = 'unknown'
+
+# 固件回复事件：类型、雾化器ID（没有时为 None）、原始文本、收到时间；二进制协议的应答带有序号和状态码
+SerialEvent = namedtuple('SerialEvent', ['kind', 'nebulizer_id', 'text', 'timestamp', 'seq', 'status'],
+                         defaults=(None, None))
+
+REPLY_PATTERNS = (
+    (re.compile(r'^雾化器 (\d+) 已自动停止$'), AUTO_STOPPED),
+    (re.compile(r'^雾化器 (\d+) 已启动$'), STARTED),
+    (re.compile(r'^雾化器 (\d+) 已停止$'), STOPPED),
+    (re.compile(r'^错误[：:]'), ERROR),
+    (re.compile(r'^雾化器控制系统已启动$'), BOOT),
+)
+
+
+# 把固件输出的一行解析为事件，空行返回 None
+def parse_reply(line, timestamp=None):
+    text = line.strip()
+    if not text:
+        return None
+    timestamp = time.monotonic() if timestamp is None else timestamp
+    for pattern, kind in REPLY_PATTERNS:
+        match = pattern.match(text)
+        if match:
+            nebulizer_id = int(match.group(1)) if match.groups() else None
+            return SerialEvent(kind, nebulizer_id, text, timestamp)
+    return SerialEvent(UNKNOWN, None, text, timestamp)
+
+
+# 把固件发送的二进制帧转换为事件，无法识别的帧返回 None
+def frame_to_event(frame_type, payload, timestamp):
+    if frame_type == FRAME_STATUS and len(payload) >= 2:
+        seq, status = payload[0], payload[1]
+        return SerialEvent(STATUS, None, f"序号 {seq}: {STATUS_NAMES.get(status, status)}", timestamp, seq, status)
+    if frame_type == FRAME_AUTO_STOP and len(payload) >= 1:
+        return SerialEvent(AUTO_STOPPED, payload[0], f"雾化器 {payload[0]} 已自动停止", timestamp)
+    return None
+
+
+# 待发送的命令。文本协议每条命令控制一个雾化器，以对应的启动/停止回复确认；
+# 二进制协议一帧可控制多个雾化器，以序号相同的状态码应答确认。tag 为调用方附带的数据，原样交给 on_result
+class SerialCommand:
+    def __init__(self, payload, description, nebulizer_id=None, state=None, seq=None, tag=None):
+        self.payload = payload
+        self.description = description
+        self.nebulizer_id = nebulizer_id
+        self.tag = tag
+        self.expected = STARTED if state else STOPPED
+        self.seq = seq
+        self.attempts = 0
+        self.sent_at = None
+        self.result = None  # 'ack' / 'error'，未确认为 None
+        self.reply = None
+        self.latency = None  # 从最后一次发送到收到确认的时间（秒）
+
+    # 判断事件是否是对本命令的应答，返回 'ack' / 'error'，无关事件返回 None
+    def match(self, event):
+        if self.seq is not None:
+            if event.kind == STATUS and event.seq == self.seq:
+                return 'ack' if event.status == STATUS_OK else 'error'
+            return None
+        if event.kind == self.expected and event.nebulizer_id == self.nebulizer_id:
+            return 'ack'
+        if event.kind == ERROR:
+            return 'error'
+        return None
+
+
+# 非阻塞串口通道：检测线程只把命令放入队列；写线程依次发送并等待固件确认，超时重发；
+# 读线程持续读取固件输出（避免输入缓冲区堆积），解析为事件并匹配正在等待确认的命令。
+# 启动前可调用 negotiate() 协商二进制协议，固件不支持时继续使用文本协议。
+# 每条命令处理完（确认、被拒绝或重试后仍未确认）后在写线程中调用 on_result(command)
+class SerialChannel:
+    def __init__(self, ser, ack_timeout=ACK_TIMEOUT, max_retries=MAX_RETRIES, on_event=None,
+                 clock=time.monotonic, on_result=None):
+        self.ser = ser
+        self.ack_timeout = ack_timeout
+        self.max_retries = max_retries
+        self.on_event = on_event
+        self.on_result = on_result
+        self.clock = clock
+        self.protocol = TEXT
+
+        self._queue = BoundedQueue('serial', COMMAND_QUEUE_SIZE, DROP_NEWEST)
+        self._cond = threading.Condition()
+        self._pending = None
+        self._running = False
+        self._closing = False
+        self._failed = False
+        self._threads = []
+        self._parser = FrameParser()
+        self._seq = 0
+
+        self.counts = Counter()
+        self.ack_stats = StageStats('serial_ack')
+
+    # 发送协商帧，固件在超时前应答相同的协议版本时切换到二进制协议，返回是否已切换。
+    # 协商帧后附带换行，只支持文本协议的固件会把它当作一行格式错误的命令丢弃
+    def negotiate(self, timeout=NEGOTIATE_TIMEOUT):
+        parser = FrameParser()
+        read_timeout = getattr(self.ser, 'timeout', None)
+        try:
+            self.ser.timeout = STAGE_POLL_INTERVAL / 2
+            self.ser.reset_input_buffer()
+            self.ser.write(encode_hello() + b'\n')
+            deadline = time.monotonic() + timeout
+            while time.monotonic() < deadline:
+                data = self.ser.read(self.ser.in_waiting or 1)
+                for frame_type, payload in parser.feed(data):
+                    if frame_type == FRAME_HELLO_REPLY and len(payload) >= 2:
+                        if payload[0] != PROTOCOL_VERSION:
+                            logger.warning(f"固件协议版本 {payload[0]} 与程序({PROTOCOL_VERSION})不一致，使用文本协议")
+                            return False
+                        self.protocol = BINARY
+                        logger.info(f"已切换到二进制协议 v{payload[0]}，雾化器数量: {payload[1]}")
+                        return True
+        except Exception as e:
+            logger.warning(f"协商二进制协议失败: {e}")
+        finally:
+            self.ser.timeout = read_timeout
+        logger.info("固件不支持二进制协议，使用文本协议")
+        return False
+
+    def start(self):
+        self._running = True
+        self._threads = [
+            threading.Thread(target=self._write_loop, name='serial-writer', daemon=True),
+            threading.Thread(target=self._read_loop, name='serial-reader', daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    # 把命令放入发送队列，不等待发送和确认；队列已满时返回 False
+    def send(self, nebulizer_id, state, duration_ms=None, tag=None):
+        return self.send_many([(nebulizer_id, state, duration_ms)], tag)
+
+    # 同时设置多个雾化器，entries 为 (雾化器ID, 开/关, 时长毫秒或None) 列表。
+    # 二进制协议合并为一帧并按条目设置时长；文本协议逐条发送，时长使用固件默认值
+    def send_many(self, entries, tag=None):
+        if self.protocol == BINARY:
+            commands = []
+            for i in range(0, len(entries), MAX_SET_ENTRIES):
+                chunk = entries[i:i + MAX_SET_ENTRIES]
+                self._seq = (self._seq + 1) & 0xFF
+                description = ", ".join(f"{n} {1 if s else 0}" for n, s, _ in chunk)
+                commands.append(SerialCommand(encode_set(self._seq, chunk), description, seq=self._seq, tag=tag))
+        else:
+            commands = [SerialCommand(f"{n} {1 if s else 0}\n".encode(), f"{n} {1 if s else 0}", n, s, tag=tag)
+                        for n, s, _ in entries]
+
+        for command in commands:
+            if not self._queue.put(command):
+                self.counts['dropped'] += 1
+                logger.error(f"串口命令队列已满，丢弃命令: {command.description}")
+                return False
+        return True
+
+    def _write_loop(self):
+        while self._running:
+            command = self._queue.get(timeout=STAGE_POLL_INTERVAL)
+            if command is not None:
+                self._execute(command)
+
+    # 发送命令并等待确认，未确认时最多重发 max_retries 次
+    def _execute(self, command):
+        text = command.description
+        with self._cond:
+            self._pending = command
+        try:
+            while command.attempts <= self.max_retries:
+                command.attempts += 1
+                try:
+                    self.ser.write(command.payload)
+                except Exception as e:
+                    self.counts['write_errors'] += 1
+                    self._failed = True
+                    logger.error(f"发送命令失败: {text}: {e}")
+                    return
+                command.sent_at = self.clock()
+                self.counts['sent'] += 1
+
+                with self._cond:
+                    self._cond.wait_for(lambda: command.result is not None or not self._running, self.ack_timeout)
+                # 关闭时不再重发，保证队列中剩余的命令都能发出
+                if command.result is not None or not self._running or self._closing:
+                    break
+                if command.attempts <= self.max_retries:
+                    self.counts['retries'] += 1
+                    logger.warning(f"命令 {text} 在 {self.ack_timeout} 秒内未收到确认，重新发送")
+        finally:
+            with self._cond:
+                self._pending = None
+
+        if command.result == 'ack':
+            self.counts['acked'] += 1
+        elif command.result == 'error':
+            self.counts['rejected'] += 1
+            logger.error(f"固件拒绝命令 {text}: {command.reply}")
+        elif self._running:
+            self.counts['unacked'] += 1
+            logger.error(f"命令 {text} 发送 {command.attempts} 次仍未收到确认")
+
+        if self.on_result is not None:
+            try:
+                self.on_result(command)
+            except Exception as e:
+                logger.error(f"串口命令回调出错: {e}")
+
+    def _read_loop(self):
+        while self._running:
+            try:
+                if self.protocol == BINARY:
+                    data = self.ser.read(self.ser.in_waiting or 1)
+                    now = self.clock()
+                    events = [frame_to_event(frame_type, payload, now)
+                              for frame_type, payload in self._parser.feed(data)]
+                else:
+                    line = self.ser.readline()
+                    events = [parse_reply(line.decode('utf-8', errors='replace'), self.clock())]
+            except Exception as e:
+                # 读取出错通常是设备已断开，停止读取，由 is_alive() 通知调用方重连
+                if self._running:
+                    self.counts['read_errors'] += 1
+                    self._failed = True
+                    logger.error(f"读取串口失败: {e}")
+                return
+            for event in events:
+                if event is not None:
+                    self._handle_event(event)
+
+    def _handle_event(self, event):
+        self.counts[event.kind] += 1
+        with self._cond:
+            command = self._pending
+            if command is not None and command.result is None:
+                result = command.match(event)
+                if result is not None:
+                    command.result = result
+                    command.reply = event.text
+                    if result == 'ack':
+                        # 确认延迟从最后一次发送算起
+                        command.latency = event.timestamp - command.sent_at
+                        self.ack_stats.record(command.latency)
+                    self._cond.notify_all()
+
+        if event.kind in (ERROR, UNKNOWN) or (event.kind == STATUS and event.status != STATUS_OK):
+            logger.warning(f"固件: {event.text}")
+        else:
+            logger.debug(f"固件: {event.text}")
+
+        if self.on_event is not None:
+            try:
+                self.on_event(event)
+            except Exception as e:
+                logger.error(f"串口事件回调出错: {e}")
+
+    # 读写线程正在运行且串口没有出错
+    def is_alive(self):
+        return self._running and not self._failed
+
+    # 队列为空且没有等待确认的命令
+    def is_idle(self):
+        with self._cond:
+            return self._queue.depth() == 0 and self._pending is None
+
+    # 等待已排队的命令发送完毕后停止读写线程并关闭串口
+    def close(self, timeout=CLOSE_TIMEOUT):
+        self._closing = True
+        deadline = time.monotonic() + timeout
+        while not self.is_idle() and not self._failed and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self._running = False
+        self._queue.close()
+        with self._cond:
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join(timeout=STAGE_POLL_INTERVAL + (getattr(self.ser, 'timeout', None) or 0))
+        self._threads = []
+        self.ser.close()
+
+    def stats(self):
+        return {
+            **self.counts,
+            "protocol": self.protocol,
+            "queued": self._queue.depth(),
+            "crc_errors": self._parser.crc_errors,
+            "ack": self.ack_stats.snapshot(),
+        }
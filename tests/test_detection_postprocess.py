@@ -0,0 +1,108 @@
+import numpy as np
+import pytest
+
+from detection_postprocess import per_class_max, DetectionTracker
+
+NUM_CLASSES = 5
+
+
+# 同一类别有多个框时取最高置信度，未出现的类别为0
+def test_per_class_max_keeps_highest_confidence():
+    present, max_conf = per_class_max([1, 3, 1, 1], [0.4, 0.7, 0.9, 0.6], NUM_CLASSES)
+    assert present.tolist() == [False, True, False, True, False]
+    assert max_conf.tolist() == pytest.approx([0.0, 0.9, 0.0, 0.7, 0.0])
+
+
+# 超出范围的类别ID被忽略
+def test_per_class_max_ignores_out_of_range_ids():
+    present, max_conf = per_class_max([-1, 5, 2, 100], [0.9, 0.9, 0.5, 0.9], NUM_CLASSES)
+    assert present.tolist() == [False, False, True, False, False]
+    assert max_conf.tolist() == pytest.approx([0.0, 0.0, 0.5, 0.0, 0.0])
+
+
+# 没有检测结果（包括模型输出的空数组）
+@pytest.mark.parametrize('class_ids, confidences', [
+    ([], []),
+    (np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.float32)),
+])
+def test_per_class_max_empty(class_ids, confidences):
+    present, max_conf = per_class_max(class_ids, confidences, NUM_CLASSES)
+    assert present.shape == (NUM_CLASSES,) and not present.any()
+    assert max_conf.shape == (NUM_CLASSES,) and not max_conf.any()
+
+
+# 模型输出的浮点类别ID
+def test_per_class_max_float_class_ids():
+    present, max_conf = per_class_max(np.array([2.0, 2.0], dtype=np.float32), np.array([0.3, 0.8], dtype=np.float32),
+                                      NUM_CLASSES)
+    assert np.flatnonzero(present).tolist() == [2]
+    assert max_conf[2] == pytest.approx(0.8)
+
+
+# 历史未满时按已有的帧数求平均
+def test_tracker_average_before_history_full():
+    tracker = DetectionTracker(NUM_CLASSES, 4)
+    tracker.update(0.0, [1], [0.6])
+    present, avg, durations = tracker.update(0.1, [1], [0.8])
+    assert avg[1] == pytest.approx(0.7)
+    assert avg[0] == 0
+    assert durations[1] == pytest.approx(0.1)
+
+
+# 环形缓冲区写满后覆盖最旧的值，只对最近 history_length 帧求平均
+def test_tracker_ring_buffer_wraps():
+    tracker = DetectionTracker(NUM_CLASSES, 3)
+    for i, conf in enumerate([0.1, 0.2, 0.3, 0.4, 0.5]):
+        present, avg, _ = tracker.update(i * 0.1, [2], [conf])
+    assert avg[2] == pytest.approx((0.3 + 0.4 + 0.5) / 3)
+    assert tracker.counts[2] == 3
+    assert tracker.heads[2] == 5 % 3
+
+
+# 每绕一圈重新求和，长时间运行后累加和与缓冲区内容一致
+def test_tracker_resums_on_wrap():
+    tracker = DetectionTracker(NUM_CLASSES, 10)
+    rng = np.random.default_rng(0)
+    for i in range(10000):
+        tracker.update(i * 0.1, [0], [rng.uniform(0.5, 1.0)])
+    # 写满整数圈后 heads 回到0，刚刚重新求和
+    assert tracker.heads[0] == 0
+    assert tracker.sums[0] == tracker.history[0].sum()
+
+    tracker.update(1000.0, [0], [0.9])
+    assert tracker.sums[0] == pytest.approx(tracker.history[0].sum(), abs=1e-12)
+
+
+# 未检测到的帧不写入置信度历史，但持续时间清零并重新计时
+def test_tracker_absent_class_restarts_duration():
+    tracker = DetectionTracker(NUM_CLASSES, 4)
+    tracker.update(0.0, [1], [0.9])
+    tracker.update(1.0, [1], [0.9])
+    present, avg, durations = tracker.update(1.1, [], [])
+    assert not present[1]
+    assert durations[1] == 0
+    assert avg[1] == pytest.approx(0.9)
+
+    _, _, durations = tracker.update(1.2, [1], [0.9])
+    assert durations[1] == 0
+    _, _, durations = tracker.update(1.5, [1], [0.9])
+    assert durations[1] == pytest.approx(0.3)
+
+
+# clear() 清除置信度历史和持续时间；clear_durations() 只清除持续时间
+def test_tracker_clear():
+    tracker = DetectionTracker(NUM_CLASSES, 3)
+    for i in range(4):
+        tracker.update(i * 0.5, [1, 2], [0.5, 0.9])
+
+    tracker.clear_durations()
+    _, avg, durations = tracker.update(2.0, [1], [0.5])
+    assert durations[1] == 0
+    assert avg[1] == pytest.approx(0.5)
+
+    tracker.clear()
+    assert not tracker.counts.any() and not tracker.sums.any() and not tracker.history.any()
+    _, avg, durations = tracker.update(3.0, [1], [0.8])
+    assert avg[1] == pytest.approx(0.8)
+    assert avg[2] == 0
+    assert durations[1] == 0
@@ -0,0 +1,156 @@
+import pytest
+
+from nebulizer_protocol import (crc8, encode_frame, encode_hello, encode_set, FrameParser, SET_ENTRY,
+                                FRAME_SYNC, FRAME_HELLO, FRAME_SET, FRAME_HELLO_REPLY, FRAME_STATUS,
+                                FRAME_AUTO_STOP, FRAME_MAX_PAYLOAD, MAX_SET_ENTRIES, PROTOCOL_VERSION,
+                                STATUS_OK, STATUS_BAD_ID)
+from serial_channel import (frame_to_event, parse_reply, SerialCommand, SerialEvent,
+                            STATUS, STARTED, AUTO_STOPPED, ERROR)
+
+# nebulizer_firmware.c 实际发送的帧（协商应答：版本1、5个雾化器；序号7的成功应答；雾化器2自动停止）
+FIRMWARE_HELLO_REPLY = bytes.fromhex('a5 81 02 01 05 ff')
+FIRMWARE_STATUS_OK = bytes.fromhex('a5 82 02 07 00 a0')
+
+
+def decode_set(payload):
+    entries = payload[1:]
+    return payload[0], [SET_ENTRY.unpack_from(entries, i) for i in range(0, len(entries), SET_ENTRY.size)]
+
+
+# CRC-8（多项式0x07，初值0）的标准校验值，与固件的实现一致
+def test_crc8_check_value():
+    assert crc8(b'123456789') == 0xF4
+    assert crc8(b'') == 0
+    assert crc8(b'6789', crc8(b'12345')) == 0xF4
+
+
+def test_encode_frame_layout():
+    frame = encode_frame(FRAME_STATUS, bytes([7, STATUS_OK]))
+    assert frame == FIRMWARE_STATUS_OK
+    assert frame[0] == FRAME_SYNC
+    assert frame[-1] == crc8(frame[1:-1])
+
+
+def test_encode_rejects_oversized_payloads():
+    with pytest.raises(ValueError):
+        encode_frame(FRAME_SET, bytes(FRAME_MAX_PAYLOAD + 1))
+    with pytest.raises(ValueError):
+        encode_set(1, [])
+    with pytest.raises(ValueError):
+        encode_set(1, [(1, True, None)] * (MAX_SET_ENTRIES + 1))
+    with pytest.raises(ValueError):
+        encode_set(1, [(1, True, 0x10000)])
+
+
+# 编码后再解析得到相同的内容；时长为 None 时编码为0（固件默认时长），序号只保留低8位
+def test_set_round_trip():
+    frames = FrameParser().feed(encode_set(256 + 7, [(2, True, 500), (3, False, None)]))
+    assert len(frames) == 1
+    frame_type, payload = frames[0]
+    assert frame_type == FRAME_SET
+    assert decode_set(payload) == (7, [(2, 1, 500), (3, 0, 0)])
+
+
+def test_hello_round_trip():
+    assert FrameParser().feed(encode_hello()) == [(FRAME_HELLO, bytes([PROTOCOL_VERSION]))]
+
+
+def test_parse_firmware_frames():
+    parser = FrameParser()
+    auto_stop = encode_frame(FRAME_AUTO_STOP, bytes([2]))
+    frames = parser.feed(FIRMWARE_HELLO_REPLY + FIRMWARE_STATUS_OK + auto_stop)
+    assert frames == [(FRAME_HELLO_REPLY, bytes([PROTOCOL_VERSION, 5])), (FRAME_STATUS, bytes([7, STATUS_OK])),
+                      (FRAME_AUTO_STOP, bytes([2]))]
+    assert parser.crc_errors == 0
+
+
+# 逐字节输入（串口每次只读到部分数据）
+def test_parse_byte_by_byte():
+    parser = FrameParser()
+    data = FIRMWARE_STATUS_OK + FIRMWARE_HELLO_REPLY
+    frames = []
+    for i in range(len(data)):
+        frames += parser.feed(data[i:i + 1])
+    assert [frame_type for frame_type, _ in frames] == [FRAME_STATUS, FRAME_HELLO_REPLY]
+
+
+# CRC错误的帧被丢弃并计数，之后的帧正常解析
+def test_crc_mismatch_is_dropped():
+    parser = FrameParser()
+    corrupt = bytearray(FIRMWARE_STATUS_OK)
+    corrupt[4] ^= 0x01
+    assert parser.feed(bytes(corrupt)) == []
+    assert parser.crc_errors == 1
+    assert parser.feed(FIRMWARE_HELLO_REPLY) == [(FRAME_HELLO_REPLY, bytes([PROTOCOL_VERSION, 5]))]
+
+
+# 不完整的帧等待后续字节，不输出也不丢弃
+def test_truncated_frame_waits_for_rest():
+    parser = FrameParser()
+    assert parser.feed(FIRMWARE_STATUS_OK[:4]) == []
+    assert parser.crc_errors == 0
+    assert parser.feed(FIRMWARE_STATUS_OK[4:]) == [(FRAME_STATUS, bytes([7, STATUS_OK]))]
+
+
+# 帧中途被截断（后半部分丢失）时，后面的完整帧仍能重新同步解析出来
+def test_resync_after_truncated_frame():
+    parser = FrameParser()
+    frames = parser.feed(FIRMWARE_HELLO_REPLY[:4] + FIRMWARE_STATUS_OK)
+    assert frames == [(FRAME_STATUS, bytes([7, STATUS_OK]))]
+
+
+# 跳过帧之外的字节：固件文本输出、长度无效的同步字节和随机数据
+def test_resync_after_garbage():
+    parser = FrameParser()
+    garbage = "雾化器 1 已启动\n".encode() + bytes([FRAME_SYNC, 0x82, 0xFF]) + b'\x13\x37'
+    frames = parser.feed(garbage + FIRMWARE_STATUS_OK + b'\r\n' + FIRMWARE_HELLO_REPLY)
+    assert frames == [(FRAME_STATUS, bytes([7, STATUS_OK])), (FRAME_HELLO_REPLY, bytes([PROTOCOL_VERSION, 5]))]
+
+
+# 长度看似合法的假同步字节会先等够字节数，CRC 校验失败后再重新同步，后面的帧不会丢
+def test_resync_after_false_sync():
+    parser = FrameParser()
+    assert parser.feed(bytes([FRAME_SYNC, 0x00, 0x08]) + FIRMWARE_STATUS_OK) == []
+    frames = parser.feed(FIRMWARE_HELLO_REPLY)
+    assert frames == [(FRAME_STATUS, bytes([7, STATUS_OK])), (FRAME_HELLO_REPLY, bytes([PROTOCOL_VERSION, 5]))]
+    assert parser.crc_errors == 1
+
+
+def test_frame_to_event():
+    event = frame_to_event(FRAME_STATUS, bytes([7, STATUS_BAD_ID]), 1.0)
+    assert (event.kind, event.seq, event.status, event.timestamp) == (STATUS, 7, STATUS_BAD_ID, 1.0)
+    event = frame_to_event(FRAME_AUTO_STOP, bytes([2]), 1.0)
+    assert (event.kind, event.nebulizer_id) == (AUTO_STOPPED, 2)
+    # 长度不足或未知类型的帧不产生事件
+    assert frame_to_event(FRAME_STATUS, bytes([7]), 1.0) is None
+    assert frame_to_event(FRAME_HELLO_REPLY, bytes([1, 5]), 1.0) is None
+
+
+# 二进制协议按序号匹配应答：状态码成功为确认，其他为错误，其他序号和自动停止事件无关
+def test_binary_command_matches_by_seq():
+    command = SerialCommand(encode_set(7, [(2, True, None)]), "雾化器 2 开", seq=7)
+    status = lambda seq, code: frame_to_event(FRAME_STATUS, bytes([seq, code]), 0.0)
+    assert command.match(status(7, STATUS_OK)) == 'ack'
+    assert command.match(status(7, STATUS_BAD_ID)) == 'error'
+    assert command.match(status(8, STATUS_OK)) is None
+    assert command.match(frame_to_event(FRAME_AUTO_STOP, bytes([2]), 0.0)) is None
+    # 二进制命令不匹配文本回复
+    assert command.match(SerialEvent(STARTED, 2, "雾化器 2 已启动", 0.0)) is None
+
+
+# 从固件实际输出解析出的应答能确认对应的命令
+def test_firmware_reply_acks_command():
+    parser = FrameParser()
+    (frame_type, payload), = parser.feed(FIRMWARE_STATUS_OK)
+    command = SerialCommand(encode_set(7, [(1, True, 500)]), "雾化器 1 开", seq=7)
+    assert command.match(frame_to_event(frame_type, payload, 0.0)) == 'ack'
+
+
+# 文本协议按雾化器ID和启动/停止回复匹配
+def test_text_command_matches_by_reply():
+    command = SerialCommand(b"2 1\n", "雾化器 2 开", nebulizer_id=2, state=True)
+    assert command.match(parse_reply("雾化器 2 已启动", 0.0)) == 'ack'
+    assert command.match(parse_reply("雾化器 3 已启动", 0.0)) is None
+    assert command.match(parse_reply("雾化器 2 已停止", 0.0)) is None
+    assert command.match(parse_reply("错误：雾化器ID必须在1-5之间", 0.0)) == 'error'
+    assert parse_reply("错误：命令格式不正确", 0.0).kind == ERROR
@@ -0,0 +1,179 @@
+import pytest
+
+from trigger_engine import TriggerEngine
+
+# 与 yolo_nebulizer.py 中的默认配置一致
+NUM_CLASSES = 5
+DURATION_THRESHOLD = 2.0
+CONFIDENCE_THRESHOLD = 0.85
+HISTORY_LENGTH = 10
+RESET_INTERVAL = 60
+PAUSE_DURATION = 10
+# 合成时间戳的帧间隔（秒）
+FRAME_INTERVAL = 0.1
+
+
+def make_engine(reset_interval=RESET_INTERVAL):
+    return TriggerEngine(NUM_CLASSES, DURATION_THRESHOLD, CONFIDENCE_THRESHOLD, HISTORY_LENGTH,
+                         reset_interval, PAUSE_DURATION, clock=lambda: pytest.fail("不应读取系统时钟"))
+
+
+# 从 start 到 end（不含）每 FRAME_INTERVAL 秒一帧的时间戳，用整数帧号计算避免浮点累积误差
+def timestamps(start, end):
+    return [round(start + i * FRAME_INTERVAL, 6) for i in range(round((end - start) / FRAME_INTERVAL))]
+
+
+# 逐帧输入同一组检测结果，返回 [(时间戳, 事件), ...]
+def feed(engine, start, end, class_ids, confidences):
+    fired = []
+    for t in timestamps(start, end):
+        fired.extend((t, event) for event in engine.update(t, class_ids, confidences))
+    return fired
+
+
+# 连续检测满2秒且平均置信度超过阈值时触发
+def test_triggers_after_continuous_threshold():
+    engine = make_engine()
+    fired = feed(engine, 0.0, 3.0, [1], [0.9])
+
+    t, event = fired[0]
+    assert t == pytest.approx(2.0)
+    assert event.class_id == 1
+    assert event.timestamp == t
+    assert event.duration == pytest.approx(2.0)
+    assert event.avg_confidence == pytest.approx(0.9)
+    # 未标记为已触发时，之后的每一帧仍然满足条件
+    assert all(event.class_id == 1 for _, event in fired)
+
+
+# 中途有一帧未检测到时重新计时
+def test_missed_frame_restarts_duration():
+    engine = make_engine()
+    assert feed(engine, 0.0, 1.5, [1], [0.9]) == []
+    assert engine.update(1.5, [], []) == []
+    assert engine.durations[1] == 0
+
+    fired = feed(engine, 1.6, 4.0, [1], [0.9])
+    assert fired[0][0] == pytest.approx(3.6)
+
+
+# 平均置信度不超过阈值时不触发
+def test_low_confidence_does_not_trigger():
+    engine = make_engine()
+    assert feed(engine, 0.0, 5.0, [2], [0.85]) == []
+    assert engine.durations[2] == pytest.approx(4.9)
+
+
+# 已触发的类别在周期重置前不再触发
+def test_mark_triggered_until_reset_interval():
+    engine = make_engine(reset_interval=5)
+    fired = feed(engine, 0.0, 2.1, [1], [0.9])
+    assert [t for t, _ in fired] == [pytest.approx(2.0)]
+    engine.mark_triggered(1)
+
+    assert feed(engine, 2.1, 5.1, [1], [0.9]) == []
+    # 距上次重置超过 reset_interval 后重新允许触发
+    fired = feed(engine, 5.1, 5.2, [1], [0.9])
+    assert [t for t, _ in fired] == [pytest.approx(5.1)]
+
+
+# 暂停窗口内的帧不参与判断，暂停结束后清除持续时间，需要重新连续检测2秒
+def test_pause_ignores_frames_and_clears_durations():
+    engine = make_engine()
+    fired = feed(engine, 0.0, 2.1, [1, 2], [0.9, 0.5])
+    t, event = fired[0]
+    engine.mark_triggered(event.class_id)
+    engine.start_pause(t)
+
+    assert engine.paused_since == pytest.approx(2.0)
+    assert engine.is_paused(2.0)
+    assert engine.is_paused(11.9)
+    assert not engine.is_paused(12.0)
+    assert engine.remaining(2.5) == 9
+
+    # 类别2在暂停期间一直被检测到且置信度很高，但这些帧都被忽略
+    assert feed(engine, 2.1, 12.0, [2], [0.95]) == []
+
+    # 暂停结束后置信度历史也被清除，此前的低置信度不再拉低平均值
+    fired = feed(engine, 12.0, 15.0, [2], [0.95])
+    assert fired[0][0] == pytest.approx(14.0)
+    assert fired[0][1].class_id == 2
+    assert fired[0][1].avg_confidence == pytest.approx(0.95)
+
+
+# 提前结束暂停：只能缩短，不能延长
+def test_end_pause():
+    engine = make_engine()
+    engine.start_pause(100.0)
+
+    assert not engine.end_pause(115.0)
+    assert engine.is_paused(109.0)
+    assert engine.end_pause(104.0)
+    assert engine.is_paused(103.9)
+    assert not engine.is_paused(104.0)
+    # 提前结束后同样需要重新连续检测2秒
+    assert feed(engine, 104.0, 106.0, [1], [0.9]) == []
+    assert len(feed(engine, 106.0, 106.1, [1], [0.9])) == 1
+
+
+# 摄像头在暂停开始1秒后关闭，暂停结束前1秒重新打开
+@pytest.mark.parametrize('t, running', [
+    (99.9, True),
+    (100.0, True),
+    (100.9, True),
+    (101.0, True),
+    (101.5, False),
+    (105.0, False),
+    (108.0, False),
+    (108.5, True),
+    (109.9, True),
+    (110.0, True),
+])
+def test_camera_off_and_on_during_pause(t, running):
+    engine = make_engine()
+    engine.start_pause(100.0)
+    assert engine.camera_should_run(t) == running
+
+
+# 回放：每次触发都视为成功并进入暂停
+def test_replay():
+    records = [(t, [1], [0.9]) for t in timestamps(0.0, 5.0)]
+    records += [(t, [3], [0.9]) for t in timestamps(5.0, 20.0)]
+    events = make_engine().replay(records)
+
+    # 类别1在2.0秒触发并暂停到12.0秒；类别3从12.0秒重新计时，14.0秒触发
+    assert [(event.class_id, event.timestamp) for event in events] == [
+        (1, pytest.approx(2.0)), (3, pytest.approx(14.0))]
+
+    events = make_engine().replay(records, pause=False)
+    assert [(event.class_id, event.timestamp) for event in events] == [
+        (1, pytest.approx(2.0)), (3, pytest.approx(7.0))]
+
+
+# reset() 清除已触发类别、暂停窗口和检测记录
+def test_reset():
+    engine = make_engine()
+    fired = feed(engine, 0.0, 2.1, [1], [0.9])
+    engine.mark_triggered(1)
+    engine.start_pause(fired[0][0])
+
+    engine.reset()
+    assert not engine.is_paused(2.5)
+    assert engine.paused_since is None
+    assert not engine.triggered.any()
+    assert feed(engine, 2.5, 4.5, [1], [0.9]) == []
+    assert len(feed(engine, 4.5, 4.6, [1], [0.9])) == 1
+
+
+# 未注入时间戳时使用注入的时钟
+def test_injected_clock():
+    now = [0.0]
+    engine = TriggerEngine(NUM_CLASSES, DURATION_THRESHOLD, CONFIDENCE_THRESHOLD, HISTORY_LENGTH,
+                           RESET_INTERVAL, PAUSE_DURATION, clock=lambda: now[0])
+    engine.start_pause()
+    now[0] = 9.5
+    assert engine.is_paused()
+    assert engine.remaining() == 0
+    now[0] = 10.0
+    assert not engine.is_paused()
+    assert engine.camera_should_run()
@@ -0,0 +1,233 @@
+import os
+import sys
+import json
+import time
+import logging
+import threading
+import collections
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# 环形缓冲区可保存的span数量
+TRACE_CAPACITY = 65536
+# 导出时默认只保留最近多少秒的span
+DUMP_SECONDS = 30
+# 采样分析器的默认采样间隔（秒）
+PROFILER_INTERVAL = 0.01
+# 采样时每个调用栈保留的最大深度
+PROFILER_MAX_DEPTH = 64
+
+
+# span记录器：在已有的耗时统计(StageStats)中作为观察者，把每次耗时记为一个在当前时刻结束的span
+class SpanObserver:
+    __slots__ = ('tracer', 'name_id')
+
+    def __init__(self, tracer, name_id):
+        self.tracer = tracer
+        self.name_id = name_id
+
+    def observe(self, seconds):
+        end = time.perf_counter_ns()
+        self.tracer.record(self.name_id, end - int(seconds * 1e9), end)
+
+
+# 一组子阶段span（如模型的预处理/推理/后处理）：阶段名在首次出现时登记为名称ID，之后只按阶段名查ID
+class PhaseSpans:
+    __slots__ = ('tracer', 'prefix', '_ids')
+
+    def __init__(self, tracer, prefix):
+        self.tracer = tracer
+        self.prefix = prefix
+        self._ids = {}
+
+    # 按各阶段耗时（毫秒）从 start_ns 起依次记录子span
+    def record(self, start_ns, phases_ms, frame_id=None):
+        if not self.tracer.enabled:
+            return
+        t = start_ns
+        for phase, ms in phases_ms.items():
+            name_id = self._ids.get(phase)
+            if name_id is None:
+                name_id = self._ids[phase] = self.tracer.name_id(f"{self.prefix}{phase}")
+            duration = int(ms * 1e6)
+            self.tracer.record(name_id, t, t + duration, frame_id)
+            t += duration
+
+
+# 逐帧span的环形缓冲区。存储在启用时一次性分配（定长numpy数组），span名称预先登记为整数ID，
+# 之后记录span只按ID写入数组、覆盖最旧的记录，不创建长期存在的对象，可以在生产环境中常开。
+# 每个span记录名称、线程、开始时间、时长和帧编号，dump() 导出为Chrome trace / Perfetto可读取的JSON
+class TraceBuffer:
+    def __init__(self, capacity=TRACE_CAPACITY):
+        self.capacity = capacity
+        self.enabled = False
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._names = []
+        self._name_ids = {}
+        self._next = 0
+        self._name = self._tid = self._start = self._duration = self._frame = None
+
+    # 分配存储并开始记录
+    def enable(self):
+        if self._start is None:
+            self._name = np.zeros(self.capacity, dtype=np.int32)
+            self._tid = np.zeros(self.capacity, dtype=np.int64)
+            self._start = np.zeros(self.capacity, dtype=np.int64)
+            self._duration = np.zeros(self.capacity, dtype=np.int64)
+            self._frame = np.full(self.capacity, -1, dtype=np.int64)
+        self.enabled = True
+        return self
+
+    # span名称登记为整数ID，缓冲区中只保存ID
+    def name_id(self, name):
+        name_id = self._name_ids.get(name)
+        if name_id is None:
+            with self._lock:
+                name_id = self._name_ids.get(name)
+                if name_id is None:
+                    name_id = len(self._names)
+                    self._names.append(name)
+                    self._name_ids[name] = name_id
+        return name_id
+
+    def observer(self, name):
+        return SpanObserver(self, self.name_id(name))
+
+    def phases(self, prefix):
+        return PhaseSpans(self, prefix)
+
+    # 设置当前线程正在处理的帧编号，之后记录的span都带上该编号
+    def set_frame(self, frame_id):
+        if self.enabled:
+            self._local.frame = frame_id
+
+    # 记录一个span（纳秒时间戳，基于 time.perf_counter_ns）
+    def record(self, name_id, start_ns, end_ns, frame_id=None):
+        if not self.enabled:
+            return
+        if frame_id is None:
+            frame_id = getattr(self._local, 'frame', -1)
+        with self._lock:
+            i = self._next % self.capacity
+            self._next += 1
+            self._name[i] = name_id
+            self._tid[i] = threading.get_ident()
+            self._start[i] = start_ns
+            self._duration[i] = end_ns - start_ns
+            self._frame[i] = frame_id
+
+    # 开始计时，未启用时返回 0
+    def begin(self):
+        return time.perf_counter_ns() if self.enabled else 0
+
+    # 记录从 begin() 到现在的span，name_id 由 name_id() 预先登记
+    def end(self, name_id, begin_ns, frame_id=None):
+        if self.enabled:
+            self.record(name_id, begin_ns, time.perf_counter_ns(), frame_id)
+
+    # 复制最近 seconds 秒（None 为全部）的span，按开始时间排序
+    def snapshot(self, seconds=None):
+        if self._start is None:
+            return []
+        with self._lock:
+            count = min(self._next, self.capacity)
+            names = self._name[:count].copy()
+            tids = self._tid[:count].copy()
+            starts = self._start[:count].copy()
+            durations = self._duration[:count].copy()
+            frames = self._frame[:count].copy()
+            labels = list(self._names)
+        order = np.argsort(starts, kind='stable')
+        if seconds is not None:
+            cutoff = time.perf_counter_ns() - int(seconds * 1e9)
+            order = order[starts[order] + durations[order] >= cutoff]
+        return [(labels[names[i]], int(tids[i]), int(starts[i]), int(durations[i]), int(frames[i])) for i in order]
+
+    # 导出为Chrome trace JSON（chrome://tracing 或 ui.perfetto.dev 打开），返回导出的span数量
+    def dump(self, path, seconds=DUMP_SECONDS):
+        spans = self.snapshot(seconds)
+        thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+        pid = os.getpid()
+        events = [{"name": "thread_name", "ph": "M", "pid": pid, "tid": tid,
+                   "args": {"name": thread_names.get(tid, str(tid))}}
+                  for tid in sorted({span[1] for span in spans})]
+        for name, tid, start, duration, frame in spans:
+            event = {"name": name, "ph": "X", "pid": pid, "tid": tid, "ts": start / 1000, "dur": duration / 1000}
+            if frame >= 0:
+                event["args"] = {"frame": frame}
+            events.append(event)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f, ensure_ascii=False)
+        return len(spans)
+
+
+# 低频采样分析器：后台线程定期抓取其他线程的Python调用栈并按调用栈计数，
+# 导出为折叠栈格式（flamegraph.pl / speedscope 可直接打开）
+class SamplingProfiler:
+    def __init__(self, interval=PROFILER_INTERVAL, max_depth=PROFILER_MAX_DEPTH):
+        self.interval = interval
+        self.max_depth = max_depth
+        self._counts = collections.Counter()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+        self.samples = 0
+
+    def start(self):
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout=1.0)
+            self._thread = None
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stopped.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            stacks = []
+            for tid, frame in sys._current_frames().items():
+                if tid == own:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < self.max_depth:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                stack.append(names.get(tid, str(tid)))
+                stacks.append(';'.join(reversed(stack)))
+            with self._lock:
+                self._counts.update(stacks)
+                self.samples += 1
+
+    # 导出上次导出以来的采样结果，返回不同调用栈的数量
+    def dump(self, path):
+        with self._lock:
+            counts, self._counts = self._counts, collections.Counter()
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in counts.most_common():
+                f.write(f"{stack} {count}\n")
+        return len(counts)
+
+
+# 把trace（和采样结果）写入 directory，文件名带时间戳，返回写入的文件路径列表
+def dump_diagnostics(tracer, profiler=None, directory='traces', seconds=DUMP_SECONDS):
+    os.makedirs(directory, exist_ok=True)
+    stamp = time.strftime('%Y%m%d-%H%M%S')
+    paths = []
+    trace_path = os.path.join(directory, f"trace-{stamp}.json")
+    count = tracer.dump(trace_path, seconds)
+    paths.append(trace_path)
+    logger.info(f"已导出最近 {seconds} 秒的 {count} 个span: {trace_path}")
+    if profiler is not None:
+        profile_path = os.path.join(directory, f"profile-{stamp}.folded")
+        stacks = profiler.dump(profile_path)
+        paths.append(profile_path)
+        logger.info(f"已导出采样结果（{stacks} 个调用栈）: {profile_path}")
+    return paths
@@ -0,0 +1,129 @@
+import time
+from collections import namedtuple
+
+import numpy as np
+
+from detection_postprocess import DetectionTracker
+
+# 触发事件：类别ID、触发时间、持续检测时间、平均置信度
+TriggerEvent = namedtuple('TriggerEvent', ['class_id', 'timestamp', 'duration', 'avg_confidence'])
+
+
+# 触发状态机：输入每帧的 (timestamp, class_ids, confidences)，输出满足条件的触发事件
+# 包含持续时间/置信度跟踪、已触发类别、RESET_INTERVAL 周期重置以及触发后的暂停窗口和摄像头开关时机。
+# 时钟可注入，便于以远高于实时的速度回放录制的检测结果
+class TriggerEngine:
+    def __init__(self, num_classes, duration_threshold, confidence_threshold, history_length,
+                 reset_interval, pause_duration=10, camera_off_after=1, camera_on_before=1,
+                 clock=time.time):
+        self.num_classes = num_classes
+        self.duration_threshold = duration_threshold
+        self.confidence_threshold = confidence_threshold
+        self.reset_interval = reset_interval
+        self.pause_duration = pause_duration
+        # 暂停开始后多少秒关闭摄像头、暂停结束前多少秒重新打开摄像头
+        self.camera_off_after = camera_off_after
+        self.camera_on_before = camera_on_before
+        self.clock = clock
+
+        self.tracker = DetectionTracker(num_classes, history_length)
+        self.triggered = np.zeros(num_classes, dtype=bool)
+        self.paused_until = 0
+        self.paused_since = None
+        self._last_reset_time = None
+        self._clear_after_pause = False
+
+        # 最近一帧的按类别ID索引的状态，供界面显示
+        self.present = np.zeros(num_classes, dtype=bool)
+        self.avg_confidence = np.zeros(num_classes)
+        self.durations = np.zeros(num_classes)
+
+    def _now(self, timestamp):
+        return self.clock() if timestamp is None else timestamp
+
+    # 该时间点是否处于暂停窗口内
+    def is_paused(self, timestamp=None):
+        return self._now(timestamp) < self.paused_until
+
+    # 剩余暂停时间（整秒，与界面显示一致）
+    def remaining(self, timestamp=None):
+        return max(0, int(self.paused_until - self._now(timestamp)))
+
+    # 摄像头此时是否应保持打开：暂停开始 camera_off_after 秒后关闭，结束前 camera_on_before 秒重新打开
+    def camera_should_run(self, timestamp=None):
+        now = self._now(timestamp)
+        if now >= self.paused_until:
+            return True
+        remaining = self.remaining(now)
+        return not (self.camera_on_before < remaining < self.pause_duration - self.camera_off_after)
+
+    # 用一帧检测结果更新状态，返回本帧满足触发条件的事件列表
+    # 调用方执行完触发动作后需调用 mark_triggered()，需要暂停时调用 start_pause()
+    def update(self, timestamp, class_ids, confidences):
+        now = self._now(timestamp)
+
+        # 暂停窗口内（包括触发前已在流水线中的帧）不参与判断
+        if now < self.paused_until:
+            return []
+
+        # 暂停结束，清除所有检测持续时间记录和置信度历史
+        if self._clear_after_pause:
+            self.tracker.clear()
+            self._clear_after_pause = False
+
+        # 每隔 reset_interval 秒重置触发记录
+        if self._last_reset_time is None:
+            self._last_reset_time = now
+        elif now - self._last_reset_time > self.reset_interval:
+            self.triggered[:] = False
+            self._last_reset_time = now
+
+        self.present, self.avg_confidence, self.durations = self.tracker.update(now, class_ids, confidences)
+
+        candidates = np.flatnonzero(self.present &
+                                    (self.durations >= self.duration_threshold) &
+                                    (self.avg_confidence > self.confidence_threshold) &
+                                    ~self.triggered)
+        return [TriggerEvent(int(class_id), now, float(self.durations[class_id]),
+                             float(self.avg_confidence[class_id]))
+                for class_id in candidates]
+
+    # 标记类别已触发，在下次周期重置前不再重复触发
+    def mark_triggered(self, class_id):
+        self.triggered[class_id] = True
+
+    # 开始暂停窗口，暂停结束后清除检测记录
+    def start_pause(self, timestamp=None, duration=None):
+        now = self._now(timestamp)
+        self.paused_since = now
+        self.paused_until = now + (self.pause_duration if duration is None else duration)
+        self._clear_after_pause = True
+
+    # 提前结束暂停窗口（如打印已完成），resume_at 晚于原定结束时间时不延长；返回暂停是否被缩短
+    def end_pause(self, resume_at=None):
+        resume_at = self._now(resume_at)
+        if resume_at >= self.paused_until:
+            return False
+        self.paused_until = resume_at
+        return True
+
+    # 清除所有状态
+    def reset(self):
+        self.tracker.clear()
+        self.triggered[:] = False
+        self.paused_until = 0
+        self.paused_since = None
+        self._last_reset_time = None
+        self._clear_after_pause = False
+
+    # 回放录制的检测结果 [(timestamp, class_ids, confidences), ...]，
+    # 每个事件都视为触发成功并进入暂停，返回全部触发事件
+    def replay(self, records, pause=True):
+        events = []
+        for timestamp, class_ids, confidences in records:
+            for event in self.update(timestamp, class_ids, confidences):
+                self.mark_triggered(event.class_id)
+                if pause:
+                    self.start_pause(timestamp)
+                events.append(event)
+        return events
@@ -2,14 +2,31 @@ import cv2
 import time
 import torch
 import serial
+from serial.tools import list_ports
 import logging
 import datetime
 import numpy as np
 import os
-from collections import deque
-from ultralytics import YOLO
-from PIL import Image, ImageOps
+import signal
+import threading
 from escpos.printer import Usb
+from camera import CameraManager
+from pipeline import Pipeline, DROP_OLDEST, BLOCK, STAGE_POLL_INTERVAL
+from inference_backend import load_backend
+from inference_governor import InferenceGovernor, ACTIVE
+from motion_gate import MotionGate
+from trigger_engine import TriggerEngine
+from logo_cache import LogoCache
+from preview_server import PreviewServer
+from metrics import MetricsRegistry, MetricsServer, read_cpu_temperature, read_cpu_frequency
+from tracing import TraceBuffer, SamplingProfiler, dump_diagnostics
+from async_logging import setup_logging, stop_logging, set_frame as set_log_frame
+from event_store import EventStore, TRIGGER, SERIAL, PRINT, PAUSE, DEVICE
+from receipt_compiler import ReceiptCompiler, TIMESTAMP_FORMAT, send_raw, estimate_print_seconds
+from receipt_templates import load_templates, run_ops
+from print_spooler import PrintSpooler
+from serial_channel import SerialChannel
+from device_supervisor import DeviceSupervisor
 
 # 启用调试日志
 logging.basicConfig(level=logging.INFO)
@@ -24,6 +41,27 @@ CLASS_NAMES = {
     4: "td"
 }
 
+# 模型设置
+MODEL_PATH = 'test_model.pt'
+# 推理后端: 'pytorch' / 'onnx' / 'openvino'，非pytorch后端首次启动时自动导出并缓存到 model_cache/
+INFERENCE_BACKEND = 'pytorch'
+# 推理输入尺寸
+INFERENCE_IMGSZ = 640
+# 自适应推理调度：画面中没有候选目标时降低分辨率和推理频率
+GOVERNOR_ENABLED = True
+# 空闲模式的推理输入尺寸（仅pytorch后端生效，导出的模型只跳帧）
+IDLE_IMGSZ = 320
+# 空闲模式每秒推理次数
+IDLE_INFERENCE_FPS = 3
+# 候选目标消失多少秒后回到空闲模式
+ACTIVE_COOLDOWN = 1.5
+# 视为候选目标的最低置信度
+CANDIDATE_CONFIDENCE = 0.25
+# 运动门控：画面静止时复用上一次的检测结果，跳过推理
+MOTION_GATE_ENABLED = True
+# 复用检测结果的最长时间（秒）
+MOTION_GATE_MAX_REUSE_AGE = 1.0
+
 # 打印机设置
 VENDOR_ID = 0x0fe6  # 热敏打印机的Vendor ID
 PRODUCT_ID = 0x811e  # 热敏打印机的Product ID
@@ -31,6 +69,36 @@ in_ep = 0x82  # 输入端点地址
 out_ep = 0x02  # 输出端点地址
 PRINTER_WIDTH_PIXELS = 384  # 58mm热敏打印纸的有效打印宽度（像素）
 LOGO_PATH = '/home/xuan/008/logo2.png'  # Logo图片路径
+LOGO_CACHE_DIR = 'logo_cache'  # Logo光栅数据的磁盘缓存目录，设为None则只缓存在内存中
+RECEIPT_TEMPLATE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'receipts.json')  # 小票模板文件
+PRINT_QUEUE_SIZE = 8  # 打印队列容量
+PRINT_DEDUP_WINDOW = 0  # 同一类别在该时间（秒）内只打印一次，0为不去重；不能超过 RESET_INTERVAL
+PRINT_JOURNAL_PATH = 'print_journal.jsonl'  # 打印任务日志，重启后继续打印未完成的任务，设为None则不保存
+# 小票打出的判断方式：
+# 'status' 数据发送完毕后发送非实时状态查询(GS r 1)，打印机处理完此前的全部数据（小票已打出）后才应答；
+#          打印机超过估算打印时间仍不应答时视为不支持，之后改用估算
+# 'estimate' 发送完毕后再等待按小票长度估算的打印时间
+# 'transfer' 只等待USB数据发送完毕（此时小票通常还在打印）
+PRINT_COMPLETION_MODE = 'status'
+PRINTER_STATUS_TIMEOUT = 0.2  # 单次读取状态应答的等待时间（秒）
+PRINTER_STATUS_GRACE = 2.0  # 超过估算打印时间多久仍无应答时视为不支持状态查询（秒）
+
+# 串口设置：优先按USB VID查找RP2040（重新插拔后设备名可能变化），找不到时使用 SERIAL_PORT
+SERIAL_PORT = '/dev/ttyACM0'
+SERIAL_BAUDRATE = 115200
+RP2040_USB_VID = 0x2E8A  # Raspberry Pi（Pico SDK USB串口）
+# 串口命令设置：命令由后台线程发送，等待固件回复确认，超时后重发
+SERIAL_ACK_TIMEOUT = 0.5  # 等待固件确认的时间（秒）
+SERIAL_MAX_RETRIES = 2  # 未收到确认时的重发次数
+# 串口协议：'auto' 启动时协商二进制协议，固件不支持时使用文本协议；'text' 只使用文本协议
+SERIAL_PROTOCOL = 'auto'
+# 雾化器开启时长（毫秒），None 使用固件默认时长(3秒)；只有二进制协议支持按命令设置时长
+NEBULIZER_ON_DURATION_MS = None
+
+# 设备断开后的重连：首次立即重连，之后等待时间从 DEVICE_RECONNECT_INITIAL 开始翻倍，不超过 DEVICE_RECONNECT_MAX（秒）
+DEVICE_RECONNECT_INITIAL = 1.0
+DEVICE_RECONNECT_MAX = 30.0
+DEVICE_CHECK_INTERVAL = 1.0  # 设备健康检查间隔（秒）
 
 # 重置检测记录的时间间隔（秒）
 RESET_INTERVAL = 10
@@ -40,30 +108,156 @@ DETECTION_DURATION_THRESHOLD = 2.0
 CONFIDENCE_THRESHOLD = 0.85
 # 置信度历史记录长度
 CONFIDENCE_HISTORY_LENGTH = 10
-# 检测持续时间字典 {class_id: (start_time, last_seen_time)}
-detection_durations = {}
-# 已触发的类别集合，避免重复触发
-triggered_classes = set()
-# 置信度历史记录 {class_id: deque([confidence1, confidence2, ...])}
-confidence_histories = {}
+# 触发后暂停检测的最长时间（秒），小票打出后会提前恢复
+PAUSE_DURATION = 10
+# 小票打出后再等待多久恢复检测（秒），留出取走小票的时间
+PRINT_RESUME_DELAY = 1.0
+# 采集统计日志输出间隔（秒）
+STATS_LOG_INTERVAL = 30
+# 流水线队列配置 (容量, 队列满时的丢弃策略)
+# 采集→推理：只保留最新帧；推理→触发：不丢弃检测结果，保证持续时间计算准确；触发→显示：只显示最新帧
+FRAME_QUEUE_CONFIG = (1, DROP_OLDEST)
+DETECTION_QUEUE_CONFIG = (4, BLOCK)
+DISPLAY_QUEUE_CONFIG = (1, DROP_OLDEST)
+# 摄像头挂起期间重复输出最后一帧的间隔（秒）
+PAUSED_FRAME_INTERVAL = 0.05
+# 显示方式：'window' 在本地窗口显示检测画面，'headless' 不创建窗口、不绘制检测框（只在预览有人观看时绘制）
+DISPLAY_MODE = 'window'
+# 本地HTTP预览（MJPEG流），设为None则不启动；可通过 ssh -L 8080:localhost:8080 远程查看
+PREVIEW_PORT = None
+PREVIEW_HOST = '127.0.0.1'
+PREVIEW_FPS = 5  # 预览最高帧率，只在有客户端连接时编码
+PREVIEW_JPEG_QUALITY = 70
+# Prometheus文本格式的指标服务（GET /metrics），设为None则不启动
+METRICS_PORT = None
+METRICS_HOST = '127.0.0.1'
+# 事件数据库（SQLite），记录触发、串口命令结果、打印任务、暂停时长和设备断开，设为None则不记录；
+# 用 python event_store.py events.db 查看汇总报告
+EVENT_DB_PATH = 'events.db'
+# 日志由后台线程输出，LOG_FORMAT 为 'json'（每行一个JSON，带帧编号）或 'text'
+LOG_LEVEL = logging.INFO
+LOG_FORMAT = 'json'
+LOG_RATE_LIMIT_INTERVAL = 10  # 相同的警告/错误日志在该时间（秒）内只输出一次，设为None则不限流
+# 逐帧trace：各阶段耗时记录到定长环形缓冲区，收到 SIGUSR1 时导出最近 TRACE_DUMP_SECONDS 秒为
+# Chrome trace JSON（kill -USR1 <pid>，用 ui.perfetto.dev 打开）
+TRACE_ENABLED = False
+TRACE_CAPACITY = 65536  # 缓冲区可保存的span数量，写满后覆盖最旧的记录
+TRACE_DUMP_SECONDS = 30
+TRACE_DIR = 'traces'
+# Python调用栈采样间隔（秒），导出trace时同时导出折叠栈文件；设为None则不采样
+PROFILER_INTERVAL = None
+# 摄像头设置，只在打开设备时设置一次（None 表示使用驱动默认值）
+# MJPEG在USB 2.0上能以更高分辨率和帧率传输，YUYV格式通常受带宽限制
+CAMERA_INDEX = 0
+CAMERA_WIDTH = 1280
+CAMERA_HEIGHT = 720
+CAMERA_FPS = 30
+CAMERA_FOURCC = 'MJPG'
+CAMERA_BUFFER_SIZE = None
+# MJPEG直接以DCT缩放解码到长边不小于该尺寸（与模型输入尺寸一致），设为None则按原分辨率解码
+CAMERA_DECODE_TARGET = INFERENCE_IMGSZ
+# 类别数量，检测状态数组按类别ID索引
+NUM_CLASSES = max(CLASS_NAMES) + 1
+# Logo光栅数据缓存，避免每次打印都解码和缩放图片
+logo_cache = LogoCache(PRINTER_WIDTH_PIXELS, LOGO_CACHE_DIR)
+# 启动时加载并校验小票模板，每个类别都必须有模板
+receipt_templates = load_templates(RECEIPT_TEMPLATE_PATH, CLASS_NAMES.values())
+# 运行指标：耗时直方图和触发计数在运行中记录，其余指标在采集时从各组件的统计信息读取
+metrics = MetricsRegistry()
+stage_seconds = metrics.histogram('nebulizer_stage_seconds', '每帧各阶段耗时（秒）', ['stage'])
+model_seconds = metrics.histogram('nebulizer_model_seconds', '模型预处理/推理/后处理耗时（秒）', ['phase'])
+serial_ack_seconds = metrics.histogram('nebulizer_serial_ack_seconds', '串口命令从发送到收到固件确认的时间（秒）')
+print_seconds = metrics.histogram('nebulizer_print_seconds', '打印任务排队等待和打印耗时（秒）', ['phase'])
+triggers_total = metrics.counter('nebulizer_triggers_total', '各类别触发次数', ['label'])
+# 逐帧trace缓冲区，TRACE_ENABLED 时在 main() 中启用（启用前不分配存储，记录调用直接返回）
+tracer = TraceBuffer(TRACE_CAPACITY)
+SPAN_PREDICT = tracer.name_id('predict')
+SPAN_IMSHOW = tracer.name_id('imshow')
+model_spans = tracer.phases('model_')
+# 事件记录，EVENT_DB_PATH 不为 None 时在 main() 中启动（启动前记录调用直接返回）
+event_store = EventStore(EVENT_DB_PATH)
+
+# 记录当前线程正在处理的帧编号，用于trace和日志
+def mark_frame(frame_id):
+    tracer.set_frame(frame_id)
+    set_log_frame(frame_id)
+
+# 按配置参数创建摄像头管理器
+def create_camera():
+    return CameraManager(CAMERA_INDEX, CAMERA_WIDTH, CAMERA_HEIGHT, CAMERA_FPS, CAMERA_FOURCC, CAMERA_BUFFER_SIZE,
+                         CAMERA_DECODE_TARGET)
+
+# 毫秒数的日志格式，尚未测得时显示为"-"
+def format_ms(value):
+    return "-" if value is None else f"{value:.0f} 毫秒"
+
+# 按配置参数创建触发状态机
+def create_trigger_engine(clock=time.time):
+    return TriggerEngine(NUM_CLASSES, DETECTION_DURATION_THRESHOLD, CONFIDENCE_THRESHOLD,
+                         CONFIDENCE_HISTORY_LENGTH, RESET_INTERVAL, PAUSE_DURATION, clock=clock)
+
+# 按USB VID查找RP2040的串口设备，找不到时返回 SERIAL_PORT
+def find_serial_port():
+    try:
+        for port in list_ports.comports():
+            if port.vid == RP2040_USB_VID:
+                return port.device
+    except Exception as e:
+        logger.debug(f"枚举串口失败: {e}")
+    return SERIAL_PORT
 
 # 初始化串口通信
 def init_serial():
     try:
-        # 根据实际情况修改串口设备名称和波特率
-        ser = serial.Serial('/dev/ttyACM0', 115200, timeout=1)
-        logger.info("串口连接成功")
+        port = find_serial_port()
+        ser = serial.Serial(port, SERIAL_BAUDRATE, timeout=1)
+        logger.info(f"串口连接成功: {port}")
         return ser
     except Exception as e:
         logger.error(f"串口连接失败: {e}")
         return None
 
-# 发送命令到RP2040
-def send_command(ser, nebulizer_id, state):
+# 记录串口命令的结果和确认延迟；触发命令（tag 为触发信息）同时记录触发事件，
+# 触发延迟为触发帧采集到固件确认雾化器启动的时间，未确认时为空
+def record_serial_result(command):
+    label = str(command.nebulizer_id) if command.nebulizer_id is not None else None
+    result = command.result or 'unacked'
+    event_store.record(SERIAL, label, command.latency, result=result,
+                       attempts=command.attempts, command=command.description)
+    if command.tag is not None:
+        trigger = dict(command.tag)
+        captured_at = trigger.pop('captured_at')
+        latency = time.time() - captured_at if command.result == 'ack' else None
+        event_store.record(TRIGGER, trigger.pop('label'), latency, result=result, **trigger)
+
+# 在已打开的串口上启动后台收发线程
+def create_serial_channel(ser):
+    channel = SerialChannel(ser, SERIAL_ACK_TIMEOUT, SERIAL_MAX_RETRIES, on_result=record_serial_result)
+    channel.ack_stats.observers.append(serial_ack_seconds)
+    if tracer.enabled:
+        channel.ack_stats.observers.append(tracer.observer('serial_ack'))
+    if SERIAL_PROTOCOL == 'auto':
+        channel.negotiate()
+    return channel.start()
+
+# 打开串口并启动收发线程，失败时返回 None
+def open_serial_channel():
+    ser = init_serial()
+    return create_serial_channel(ser) if ser is not None else None
+
+# 发送命令到RP2040；使用串口通道时只放入发送队列，不等待写入和确认
+# tag 随命令交给 record_serial_result，直接写串口时忽略
+def send_command(ser, nebulizer_id, state, duration_ms=None, tag=None):
     if ser is None:
         logger.error("串口未连接")
         return False
     
+    if isinstance(ser, SerialChannel):
+        if not ser.send(nebulizer_id, state, duration_ms, tag):
+            return False
+        logger.info(f"发送命令: {nebulizer_id} {1 if state else 0}")
+        return True
+    
     try:
         command = f"{nebulizer_id} {1 if state else 0}\n"
         ser.write(command.encode())
@@ -73,16 +267,6 @@ def send_command(ser, nebulizer_id, state):
         logger.error(f"发送命令失败: {e}")
         return False
 
-# 更新置信度历史记录并计算平均值
-def update_confidence_history(class_id, confidence):
-    if class_id not in confidence_histories:
-        confidence_histories[class_id] = deque(maxlen=CONFIDENCE_HISTORY_LENGTH)
-    
-    confidence_histories[class_id].append(confidence)
-    
-    # 计算平均置信度
-    return np.mean(confidence_histories[class_id])
-
 # 初始化打印机
 def init_printer():
     try:
@@ -101,6 +285,58 @@ def init_printer():
         logger.error(f"打印机初始化失败: {e}")
         return None
 
+# 打印机是否仍在USB总线上（没有安装pyusb时视为在线）
+def printer_present(printer=None):
+    try:
+        import usb.core
+    except ImportError:
+        return True
+    return usb.core.find(idVendor=VENDOR_ID, idProduct=PRODUCT_ID) is not None
+
+# 释放打印机的USB接口
+def close_printer(printer):
+    close = getattr(printer, 'close', None)
+    if close is not None:
+        close()
+
+# 按配置参数创建设备监护，设备断开后在后台按退避时间重连
+def create_supervisor(name, connect, close=None, check=None):
+    return DeviceSupervisor(name, connect, close, check, DEVICE_RECONNECT_INITIAL, DEVICE_RECONNECT_MAX,
+                            DEVICE_CHECK_INTERVAL,
+                            on_disconnect=lambda error: event_store.record(DEVICE, name, error=error))
+
+# 非实时状态查询(GS r 1，传送纸张传感器状态)：与打印数据按顺序处理，此前的数据全部打印完后才应答
+PAPER_STATUS_QUERY = b'\x1dr\x01'
+
+# 发送非实时状态查询并等待应答，到 deadline 仍未应答返回 False
+def wait_status_reply(printer, deadline, timeout=PRINTER_STATUS_TIMEOUT):
+    device = printer.device
+    printer._raw(PAPER_STATUS_QUERY)
+    while time.time() < deadline:
+        try:
+            if device.read(printer.in_ep, 16, int(timeout * 1000)):
+                return True
+        except Exception:
+            pass
+    return False
+
+# 等待小票打出：sent 为数据发送完毕的时间，estimated 为估算的打印时间（秒）。
+# 打印机在 deadline 前仍未应答状态查询时返回 False；虚拟打印机（如回放、预编译）不等待
+def wait_print_complete(printer, sent, estimated, deadline):
+    if PRINT_COMPLETION_MODE == 'transfer' or getattr(printer, 'device', None) is None:
+        return True
+    if PRINT_COMPLETION_MODE == 'status' and not getattr(printer, 'status_unsupported', False):
+        reply = wait_status_reply(printer, min(deadline, sent + estimated + PRINTER_STATUS_GRACE))
+        if reply:
+            return True
+        if time.time() >= deadline:
+            logger.warning("等待小票打出超时")
+            return False
+        logger.info("打印机不应答非实时状态查询，改为按估算打印时间等待")
+        printer.status_unsupported = True
+    time.sleep(max(0.0, min(sent + estimated, deadline) - time.time()))
+    return True
+
 # 打印Logo图片
 def print_logo(printer):
     if printer is None:
@@ -115,23 +351,15 @@ def print_logo(printer):
         
         # 打印标题
         printer.set(align='center')
-        printer.text("青岛老城区气味地图\n\n")
+        printer.text(receipt_templates.brand + "\n\n")
         
-        # 打印图像
-        logger.info(f"正在打印Logo: {LOGO_PATH}")
-        img = Image.open(LOGO_PATH)
-        
-        # 转换为灰度图像
-        img = ImageOps.grayscale(img)
-        
-        # 调整图片大小以适应打印机宽度，保持宽高比
-        width_percent = (PRINTER_WIDTH_PIXELS / float(img.size[0]))
-        new_height = int((float(img.size[1]) * float(width_percent)))
-        img = img.resize((PRINTER_WIDTH_PIXELS, new_height), Image.LANCZOS)
+        # 打印图像（使用预先生成的光栅数据）
+        logger.debug(f"正在打印Logo: {LOGO_PATH}")
+        raster = logo_cache.get(LOGO_PATH)
         
         # 居中打印图像
         printer.set(align='center')
-        printer.image(img)
+        printer._raw(raster)
         printer.text("\n")
         
         return True
@@ -139,468 +367,710 @@ def print_logo(printer):
         logger.error(f"打印Logo失败: {e}")
         return False
 
-# 打印检测信息和内容
-def print_detection_info(printer, class_id, confidence):
+# 打印检测信息和内容（按小票模板执行）
+def print_detection_info(printer, class_id, confidence, current_time=None):
     if printer is None:
         logger.error("打印机未连接")
         return False
     
     try:
         # 获取当前时间
-        current_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        if current_time is None:
+            current_time = datetime.datetime.now().strftime(TIMESTAMP_FORMAT)
         
         # 获取类别名称
         label = CLASS_NAMES.get(class_id, f"未知类别 {class_id}")
+        if label not in receipt_templates:
+            logger.warning(f"类别 {label} 没有小票模板，只打印时间和结尾")
         
-        # 打印时间和检测信息
-        printer.set(align='center')
-        printer.text("\n" + "-" * 32 + "\n")
-        printer.text(f"时间: {current_time}\n")
-        printer.text("-" * 32 + "\n\n")
-        
-        # 根据不同类别打印不同内容
-        if class_id == 0:  # pj
-            printer.set(align='center', bold=True)
-            printer.text("青岛啤酒博物馆\n\n")
-            printer.set(bold=False)
-            
-            printer.set(align='left')
-            printer.text("建筑：\n")
-            printer.text("1903年德建厂址\n")
-            printer.text("发酵罐工业长廊\n")
-            printer.text("回廊陈列原始设备\n")
-            printer.text("地下酒窖保存百年酵母\n\n")
-            
-            printer.text("工艺：\n")
-            printer.text("传承德国纯酿法\n")
-            printer.text("采用慕尼黑啤酒酵母\n")
-            printer.text("酿造周期长达72小时\n\n")
-            
-            printer.text("展品：\n")
-            printer.text("1906年慕尼黑金奖\n")
-            printer.text("1930年代德制生产线\n")
-            printer.text("历代包装设计展示\n\n")
-            
-            printer.text("体验：\n")
-            printer.text("醉酒小屋(15度倾斜)\n")
-            printer.text("生啤原浆品鉴区\n")
-            printer.text("互动酿酒体验台\n\n")
-            
-            printer.text("气味构成：\n")
-            printer.text("烘焙大麦(20%)\n")
-            printer.text("啤酒花(30%)\n")
-            printer.text("橡木桶陈香(50%)\n")
-            
-        elif class_id == 1:  # tz
-            printer.set(align='center', bold=True)
-            printer.text("圣弥厄尔天主教堂\n\n")
-            printer.set(bold=False)
-            
-            printer.set(align='left')
-            printer.text("建筑：\n")
-            printer.text("德国毕娄哈设计\n")
-            printer.text("哥特式双塔高56米\n")
-            printer.text("红砖砌筑德式传统\n\n")
-            
-            printer.text("历史：\n")
-            printer.text("1932-1934年建造\n")
-            printer.text("文革时期钟楼损毁\n")
-            printer.text("2008年恢复礼拜功能\n\n")
-            
-            printer.text("特色：\n")
-            printer.text("德国制彩色玻璃窗\n")
-            printer.text("崂山花岗岩外墙\n")
-            printer.text("亚洲最大管风琴之一\n")
-            printer.text("周日传统弥撒仪式\n\n")
-            
-            printer.text("地位：\n")
-            printer.text("中国唯一祝圣教堂\n")
-            printer.text("山东最大天主教堂\n")
-            printer.text("青岛宗教文化地标\n\n")
-            
-            printer.text("气味构成：\n")
-            printer.text("檀香(圣像祭坛)\n")
-            printer.text("石蜡(烛台照明)\n")
-            printer.text("老木香(管风琴木材)\n")
-            
-        elif class_id == 2:  # zq
-            printer.set(align='center', bold=True)
-            printer.text("栈桥海域\n\n")
-            printer.set(bold=False)
-            
-            printer.set(align='left')
-            printer.text("建筑：\n")
-            printer.text("440米探海长廊\n")
-            printer.text("回澜阁琉璃瓦\n")
-            printer.text("八角阁楼循环系统\n\n")
-            
-            printer.text("生态：\n")
-            printer.text("每年10万只海鸥\n")
-            printer.text("冬季迁徙停留点\n")
-            printer.text("黄渤海特色鱼类\n\n")
-            
-            printer.text("奇观：\n")
-            printer.text("四月平流雾\n")
-            printer.text("\"海上仙山\"景象\n")
-            printer.text("独特礁石景观\n\n")
-            
-            printer.text("文化：\n")
-            printer.text("毛泽东诗作取景地\n")
-            printer.text("端午龙舟赛举办地\n\n")
-            
-            printer.text("气味构成：\n")
-            printer.text("死海盐(潮汐矿物)\n")
-            printer.text("椰子油(渔民防晒)\n")
-            printer.text("海藻腥味(涨潮残留)\n")
-            
-        elif class_id == 3:  # yd
-            printer.set(align='center', bold=True)
-            printer.text("青岛邮电博物馆\n\n")
-            printer.set(bold=False)
-            
-            printer.set(align='left')
-            printer.text("建筑：\n")
-            printer.text("德式红砖钟楼\n")
-            printer.text("德国进口柚木楼梯\n")
-            printer.text("保留98%原始构件\n\n")
-            
-            printer.text("功能：\n")
-            printer.text("最早德式邮局\n")
-            printer.text("仍在日常营业\n")
-            printer.text("传统邮政服务体验\n\n")
-            
-            printer.text("展品：\n")
-            printer.text("1897年大龙邮票\n")
-            printer.text("德占时期邮筒\n")
-            printer.text("民国时期绿邮筒\n\n")
-            
-            printer.text("技术：\n")
-            printer.text("活字印刷体验\n")
-            printer.text("摩尔斯电码实物\n")
-            printer.text("通信设备演进展示\n\n")
-            
-            printer.text("气味构成：\n")
-            printer.text("铅印油墨(印刷车间)\n")
-            printer.text("广藿香(邮包陈香)\n")
-            printer.text("氧化铁(红砖气息)\n")
-            
-        elif class_id == 4:  # td
-            printer.set(align='center', bold=True)
-            printer.text("团岛农贸市场\n\n")
-            printer.set(bold=False)
-            
-            printer.set(align='left')
-            printer.text("历史：\n")
-            printer.text("1902年德建菜场\n")
-            printer.text("三次大规模改造\n")
-            printer.text("保留早期拱券结构\n\n")
-            
-            printer.text("分区：\n")
-            printer.text("海产码头直供区\n")
-            printer.text("王姐烧烤档25年\n")
-            printer.text("海鲜现场加工区\n\n")
-            
-            printer.text("时令：\n")
-            printer.text("春季鲅鱼汛(4-6月)\n")
-            printer.text("秋冬海蛎子丰收\n")
-            printer.text("夏季皮皮虾旺季\n\n")
-            
-            printer.text("特色：\n")
-            printer.text("塑料袋装鲜啤\n")
-            printer.text("现开海胆刺身\n")
-            printer.text("海鲜拼盘自助区\n\n")
-            
-            printer.text("气味构成：\n")
-            printer.text("海带液(淡盐水)\n")
-            printer.text("八角油(卤煮香气)\n")
-            printer.text("乙酸异戊酯(香蕉味)\n")
-        
-        # 打印结束
-        printer.text("\n\n")
-        printer.set(align='center')
-        printer.text("-" * 32 + "\n")
-        printer.text("青岛老城区气味地图\n")
-        printer.text("-" * 32 + "\n\n")
-        
-        # 切纸
-        printer.cut()
+        run_ops(printer, receipt_templates.ops(label), current_time)
         
-        logger.info(f"成功打印类别 {label} 的信息")
+        logger.debug(f"成功生成类别 {label} 的打印内容")
         return True
     except Exception as e:
         logger.error(f"打印检测信息失败: {e}")
         return False
 
+# 生成一张完整小票（Logo、标题、检测信息、结尾和切纸），供小票编译器在虚拟打印机上预先编译
+def render_receipt(printer, class_id, current_time):
+    print_logo(printer)
+    return print_detection_info(printer, class_id, None, current_time)
+
+# Logo图片的版本，图片被替换后重新编译小票
+def logo_version():
+    try:
+        stat = os.stat(LOGO_PATH)
+    except OSError:
+        return (LOGO_PATH, None)
+    return (LOGO_PATH, stat.st_mtime_ns, stat.st_size)
+
+# 预编译的小票字节，打印时只需填入当前时间
+receipt_compiler = ReceiptCompiler(render_receipt, logo_version)
+
+# 打印一张小票：发送预编译的ESC/POS数据，编译失败时退回逐条命令打印
+def print_receipt(printer, class_id, confidence):
+    if printer is None:
+        logger.error("打印机未连接")
+        return False
+    
+    try:
+        data = receipt_compiler.render(class_id, datetime.datetime.now().strftime(TIMESTAMP_FORMAT))
+    except Exception as e:
+        logger.warning(f"预编译小票不可用，逐条打印: {e}")
+        logo_ok = print_logo(printer)
+        return print_detection_info(printer, class_id, confidence) and logo_ok
+    
+    start = time.time()
+    send_raw(printer, data)
+    sent = time.time()
+    estimated = estimate_print_seconds(data)
+    done = wait_print_complete(printer, sent, estimated, start + PAUSE_DURATION)
+    logger.info(f"已打印类别 {CLASS_NAMES.get(class_id, class_id)} 的小票: {len(data)} 字节，"
+                f"发送 {sent - start:.2f} 秒，等待打出 {time.time() - sent:.2f} 秒（估算 {estimated:.2f} 秒）")
+    return done
+
+# 打印去重窗口：超过 RESET_INTERVAL 时周期重置后再次触发的同一类别会被去重（只出香味不出小票），按 RESET_INTERVAL 处理
+def print_dedup_window():
+    if PRINT_DEDUP_WINDOW > RESET_INTERVAL:
+        logger.warning(f"PRINT_DEDUP_WINDOW({PRINT_DEDUP_WINDOW}秒)超过 RESET_INTERVAL({RESET_INTERVAL}秒)，按 {RESET_INTERVAL} 秒去重")
+        return RESET_INTERVAL
+    return PRINT_DEDUP_WINDOW
+
+# 创建打印队列，由唯一的打印线程负责与打印机通信，检测流水线只提交任务
+# 打印机断开期间任务留在队列中；打印出错时通知设备监护重连
+def create_print_spooler(printer_supervisor, on_complete=None):
+    def print_job(class_id, confidence):
+        printer = printer_supervisor.get()
+        # 打印机在就绪检查之后断开，抛出异常让打印队列把任务重新排队
+        if printer is None:
+            raise ConnectionError("打印机未连接")
+        try:
+            return print_receipt(printer, class_id, confidence)
+        except Exception as e:
+            printer_supervisor.report_failure(e, printer)
+            raise
+    
+    # 记录打印结果和从提交到完成的时间
+    def job_complete(job):
+        event_store.record(PRINT, CLASS_NAMES.get(job.class_id, str(job.class_id)), job.finished_at - job.created,
+                           ok=job.ok, attempts=job.attempts)
+        if on_complete is not None:
+            on_complete(job)
+    
+    spooler = PrintSpooler(print_job, PRINT_QUEUE_SIZE, print_dedup_window(), PRINT_JOURNAL_PATH,
+                           on_complete=job_complete, ready=printer_supervisor.is_connected)
+    spooler.wait_stats.observers.append(print_seconds.labels('wait'))
+    spooler.print_stats.observers.append(print_seconds.labels('print'))
+    if tracer.enabled:
+        spooler.print_stats.observers.append(tracer.observer('print'))
+    return spooler
+
+# 小票打出后恢复检测，PAUSE_DURATION 只作为暂停时间的上限
+def resume_after_print(engine, finished_at):
+    if engine.end_pause(finished_at + PRINT_RESUME_DELAY):
+        logger.info(f"小票已打出，{PRINT_RESUME_DELAY}秒后恢复检测")
+
+# 流水线中在各阶段之间传递的单帧数据
+class FramePacket:
+    def __init__(self, frame_id, frame, timestamp):
+        self.frame_id = frame_id
+        self.frame = frame
+        self.timestamp = timestamp
+        # 暂停状态
+        self.paused = False
+        self.remaining_time = 0
+        self.camera_closed = False
+        # 摄像头已断开，正在重连（没有新画面，不推理）
+        self.camera_offline = False
+        # 是否被推理调度器跳过
+        self.skipped = False
+        # 是否复用了运动门控缓存的检测结果
+        self.reused = False
+        # 是否实际执行了模型推理
+        self.inferred = False
+        # 推理结果
+        self.boxes = np.zeros((0, 4), dtype=np.float32)
+        self.confidences = np.zeros(0, dtype=np.float32)
+        self.class_ids = np.zeros(0, dtype=int)
+        # 按类别ID索引的平均置信度和持续检测时间，由触发判断阶段填写
+        self.avg_confidence = None
+        self.durations = None
+        # 本帧是否触发了雾化器，以及触发成功的事件
+        self.triggered = False
+        self.events = []
+
+# 按配置参数创建推理调度器，未启用时返回 None
+def create_governor(backend):
+    if not GOVERNOR_ENABLED:
+        return None
+    return InferenceGovernor(INFERENCE_IMGSZ, IDLE_IMGSZ, IDLE_INFERENCE_FPS, ACTIVE_COOLDOWN,
+                             CANDIDATE_CONFIDENCE, CLASS_NAMES.keys(), backend.dynamic_imgsz)
+
+# 按配置参数创建运动门控，未启用时返回 None
+def create_motion_gate():
+    if not MOTION_GATE_ENABLED:
+        return None
+    return MotionGate(max_reuse_age=MOTION_GATE_MAX_REUSE_AGE)
+
+# 推理处理：暂停期间的帧直接透传，画面静止时复用上一次结果，否则按调度器决定的尺寸推理
+def run_inference(packet, backend, governor=None, motion_gate=None):
+    if packet.camera_offline:
+        return packet
+    
+    if packet.paused:
+        # 暂停期间摄像头会被关闭，恢复后必须重新推理
+        if motion_gate is not None:
+            motion_gate.reset()
+        return packet
+    
+    # 画面静止时复用上一次的检测结果
+    if motion_gate is not None:
+        cached = motion_gate.check(packet.frame, packet.timestamp)
+        if cached is not None:
+            packet.boxes, packet.confidences, packet.class_ids = cached
+            packet.reused = True
+            if governor is not None:
+                governor.observe(packet.class_ids, packet.confidences, packet.timestamp)
+            return packet
+    
+    imgsz = INFERENCE_IMGSZ
+    if governor is not None:
+        imgsz = governor.plan(packet.timestamp)
+        if imgsz is None:
+            packet.skipped = True
+            return packet
+    
+    # 将帧传递给模型进行预测
+    started = tracer.begin()
+    packet.boxes, packet.confidences, packet.class_ids = backend.predict(packet.frame, imgsz)
+    packet.inferred = True
+    tracer.end(SPAN_PREDICT, started)
+    model_spans.record(started, backend.last_speed)
+    for phase, ms in backend.last_speed.items():
+        model_seconds.labels(phase).observe(ms / 1000)
+    
+    if motion_gate is not None:
+        motion_gate.update((packet.boxes, packet.confidences, packet.class_ids), packet.timestamp)
+    
+    if governor is not None:
+        governor.observe(packet.class_ids, packet.confidences, packet.timestamp)
+    return packet
+
+# 触发判断：更新触发状态机，满足条件时提交打印任务并启动雾化器
+# print_job(class_id, confidence) 提交打印任务，任务被接受时返回 PrintJob；为 None 时只启动雾化器、不打印也不暂停。
+# 打印任务被去重或拒绝（队列已满）时本次触发整体跳过：不启动雾化器、不暂停，该类别在周期重置前不再触发
+def handle_detections(packet, engine, ser, print_job=None):
+    # 暂停期间的帧和被调度器跳过的帧没有检测结果，保持现有记录不变
+    if packet.paused or packet.skipped:
+        return packet
+    
+    events = engine.update(packet.timestamp, packet.class_ids, packet.confidences)
+    packet.avg_confidence = engine.avg_confidence
+    packet.durations = engine.durations
+    
+    for event in events:
+        label = CLASS_NAMES[event.class_id]
+        nebulizer_id = event.class_id + 1  # 雾化器ID从1开始
+        
+        # 标记该类别已触发
+        engine.mark_triggered(event.class_id)
+        
+        # 先提交打印任务，没有小票时不启动雾化器
+        job = None
+        if print_job is not None:
+            job = print_job(event.class_id, event.avg_confidence)
+            if job is None:
+                logger.info(f"检测到 {label}，但打印任务未被接受（去重或队列已满），本次不触发雾化器")
+                continue
+        
+        logger.info(f"检测到 {label} 持续 {event.duration:.2f} 秒，平均置信度: {event.avg_confidence:.2f}，触发雾化器 {nebulizer_id}")
+        
+        # 发送命令开启雾化器；串口断开时降级运行，只提交打印任务
+        # 触发事件在收到固件确认后记录（带触发延迟）；命令未能发出时立即记录
+        trigger = {"label": label, "captured_at": packet.timestamp, "duration": event.duration,
+                   "confidence": event.avg_confidence, "nebulizer": nebulizer_id}
+        sent = send_command(ser, nebulizer_id, True, NEBULIZER_ON_DURATION_MS, trigger)
+        if not sent:
+            logger.warning(f"雾化器 {nebulizer_id} 未能启动，继续打印小票")
+            event_store.record(TRIGGER, label, None, result='not_sent', duration=event.duration,
+                               confidence=event.avg_confidence, nebulizer=nebulizer_id)
+        
+        triggers_total.labels(label).inc()
+        packet.events.append(event)
+        
+        if job is not None:
+            # 设置暂停检测，小票打出后提前恢复
+            engine.start_pause(event.timestamp)
+            packet.triggered = True
+            logger.info(f"检测已暂停，小票打出后恢复（最长{PAUSE_DURATION}秒）")
+            
+            # 任务在暂停开始前小票已经打出
+            if job.finished_at is not None:
+                resume_after_print(engine, job.finished_at)
+    
+    return packet
+
+# 在帧上绘制检测框、标签和状态信息
+def draw_overlay(packet, fps, height):
+    frame = packet.frame
+    
+    if packet.paused:
+        # 在帧上显示暂停状态
+        cv2.putText(frame, f'检测已暂停，等待小票打出: {packet.remaining_time}秒', 
+                    (10, height - 30), cv2.FONT_HERSHEY_SIMPLEX, 
+                    1, (0, 0, 255), 2)
+        
+        if packet.camera_closed:
+            cv2.putText(frame, '摄像头已挂起', (10, height - 60), 
+                        cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2)
+    
+    if packet.camera_offline:
+        cv2.putText(frame, '摄像头已断开，正在重连', (10, height - 90), 
+                    cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2)
+    
+    for i in range(len(packet.boxes)):
+        x1, y1, x2, y2 = map(int, packet.boxes[i][:4])
+        confidence = packet.confidences[i]
+        class_id = packet.class_ids[i]
+        
+        # 获取类别名称
+        if class_id in CLASS_NAMES:
+            label = CLASS_NAMES[class_id]
+        else:
+            label = f"Class {class_id}"
+        
+        # 绘制边界框和标签
+        cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 255, 0), 2)
+        cv2.putText(frame, f'{label} {confidence:.2f}', (x1, y1 - 10), 
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.9, (36, 255, 12), 2)
+        
+        # 在帧上显示平均置信度和持续时间
+        if packet.avg_confidence is not None and class_id in CLASS_NAMES:
+            info_text = f"Avg: {packet.avg_confidence[class_id]:.2f}, Time: {packet.durations[class_id]:.1f}s"
+            cv2.putText(frame, info_text, (x1, y2 + 20), 
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 255), 2)
+    
+    if packet.triggered:
+        cv2.putText(frame, f"检测已暂停，等待小票打出: {PAUSE_DURATION}秒", 
+                    (10, height - 30), cv2.FONT_HERSHEY_SIMPLEX, 
+                    1, (0, 0, 255), 2)
+    
+    # 将FPS绘制在帧的左上角
+    cv2.putText(frame, f'FPS: {fps:.2f}', (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
+    return frame
+
+# 登记运行时指标：流水线各阶段耗时写入直方图，计数和队列深度等在采集时读取
+def register_runtime_metrics(pipeline, camera, spooler, engine, supervisors, governor=None, motion_gate=None):
+    for stage in pipeline.stages:
+        stage.stats.observers.append(stage_seconds.labels(stage.name))
+    for name, stats in pipeline.extra_stats.items():
+        stats.observers.append(stage_seconds.labels(name))
+    
+    def serial_stats():
+        channel = supervisors['serial'].get()
+        return channel.stats() if channel is not None else None
+    
+    def serial_commands():
+        stats = serial_stats()
+        if stats is None:
+            return None
+        return {key: stats.get(key, 0) for key in ('sent', 'acked', 'retries', 'unacked', 'rejected', 'dropped')}
+    
+    def queue_depths():
+        depths = {queue.name: queue.depth() for queue in pipeline.queues}
+        depths['print'] = spooler.depth()
+        stats = serial_stats()
+        if stats is not None:
+            depths['serial'] = stats['queued']
+        return depths
+    
+    def camera_frames():
+        stats = camera.stats()
+        return {key: stats[key] for key in ('captured', 'dropped', 'discarded', 'corrupt') if key in stats}
+    
+    metrics.counter('nebulizer_frames_total', '摄像头帧数（采集/未取走被覆盖/挂起期间丢弃/解码失败）', ['kind'], camera_frames)
+    metrics.counter('nebulizer_serial_commands_total', '串口命令数（按结果）', ['result'], serial_commands)
+    metrics.counter('nebulizer_stage_errors_total', '流水线各阶段出错次数（出错的帧被丢弃）', ['stage'],
+                    lambda: {stage.name: stage.stats.errors for stage in pipeline.stages})
+    metrics.counter('nebulizer_print_jobs_total', '打印任务数（按结果）', ['result'], lambda: dict(spooler.counts))
+    metrics.counter('nebulizer_device_disconnects_total', '设备断开次数', ['device'],
+                    lambda: {name: s.stats()['disconnects'] for name, s in supervisors.items()})
+    metrics.gauge('nebulizer_queue_depth', '队列深度', ['queue'], queue_depths)
+    metrics.gauge('nebulizer_device_up', '设备是否在线', ['device'],
+                  lambda: {name: int(s.is_connected()) for name, s in supervisors.items()})
+    metrics.gauge('nebulizer_detection_paused', '检测是否处于触发后的暂停中', fn=lambda: int(engine.is_paused(time.time())))
+    if governor is not None:
+        metrics.counter('nebulizer_governor_frames_total', '推理调度的帧数（推理/空闲限速跳过）', ['result'],
+                        lambda: {key: value for key, value in governor.stats().items() if key in ('inferred', 'skipped')})
+        metrics.counter('nebulizer_governor_escalations_total', '推理调度从空闲切换到全速模式的次数',
+                        fn=lambda: governor.stats()['escalations'])
+        metrics.gauge('nebulizer_governor_active', '推理调度当前是否处于全速模式', fn=lambda: int(governor.stats()['mode'] == ACTIVE))
+    if motion_gate is not None:
+        metrics.counter('nebulizer_motion_gate_frames_total', '运动门控检查的帧数（检查/画面静止复用上次结果）', ['result'],
+                        lambda: {key: value for key, value in motion_gate.stats().items() if key in ('checked', 'reused')})
+        metrics.gauge('nebulizer_motion_gate_skip_ratio', '运动门控启动以来复用结果、跳过推理的帧比例',
+                      fn=lambda: motion_gate.stats()['skip_ratio'])
+    metrics.gauge('nebulizer_cpu_temperature_celsius', 'CPU温度（各温区最高值）', fn=read_cpu_temperature)
+    metrics.gauge('nebulizer_cpu_frequency_hz', 'CPU0当前频率，低于标称值说明正在降频', fn=read_cpu_frequency)
+
+# 启用trace时把流水线各阶段的耗时同时记录为span
+def register_trace_spans(pipeline):
+    for stage in pipeline.stages:
+        stage.stats.observers.append(tracer.observer(stage.name))
+    for name, stats in pipeline.extra_stats.items():
+        if name != 'end_to_end':
+            stats.observers.append(tracer.observer(name))
+
 # 主函数
 def main():
-    global detection_durations, triggered_classes, confidence_histories
+    # 日志改为异步输出，ultralytics只输出警告
+    log_listener = setup_logging(LOG_LEVEL, LOG_FORMAT == 'json', LOG_RATE_LIMIT_INTERVAL)
+    logging.getLogger('ultralytics').setLevel(logging.WARNING)
     
     # 加载YOLOv8模型
     logger.info("正在加载YOLOv8模型...")
-    model = YOLO('test_model.pt')
+    backend = load_backend(INFERENCE_BACKEND, MODEL_PATH, INFERENCE_IMGSZ)
     logger.info("模型加载完成")
     
-    # 初始化串口
-    ser = init_serial()
-    if ser is None:
-        logger.error("无法继续，程序退出")
-        return
+    # 事件记录
+    if EVENT_DB_PATH:
+        event_store.path = EVENT_DB_PATH
+        try:
+            event_store.start()
+        except Exception as e:
+            logger.warning(f"打开事件数据库失败，将不记录事件: {e}")
+    
+    # 逐帧trace和调用栈采样（须在创建串口和打印队列之前启用）
+    profiler = None
+    if TRACE_ENABLED:
+        tracer.enable()
+        if PROFILER_INTERVAL:
+            profiler = SamplingProfiler(PROFILER_INTERVAL).start()
+        logger.info(f"逐帧trace已启用，发送 SIGUSR1 导出最近 {TRACE_DUMP_SECONDS} 秒到 {TRACE_DIR}/")
+    
+    # 推理调度器和运动门控
+    governor = create_governor(backend)
+    motion_gate = create_motion_gate()
+    
+    # 串口、打印机和摄像头由设备监护连接，断开后在后台重连，期间检测循环降级运行
+    serial_supervisor = create_supervisor('串口', open_serial_channel, lambda channel: channel.close(),
+                                          lambda channel: channel.is_alive()).start()
+    if not serial_supervisor.is_connected():
+        logger.warning("串口未连接，将在后台重连，期间不启动雾化器")
     
     # 初始化打印机
-    printer = init_printer()
-    if printer is None:
-        logger.warning("打印机初始化失败，将继续运行但不执行打印功能")
+    printer_supervisor = create_supervisor('打印机', init_printer, close_printer, printer_present).start()
+    if not printer_supervisor.is_connected():
+        logger.warning("打印机未连接，将在后台重连，期间的打印任务保留在队列中")
     
-    # 打开摄像头
-    cap = cv2.VideoCapture(0)
+    # 启动时预先生成Logo光栅数据并编译所有类别的小票
+    try:
+        logo_cache.get(LOGO_PATH)
+        receipt_compiler.compile_all(CLASS_NAMES)
+    except Exception as e:
+        logger.warning(f"预编译小票失败: {e}")
     
-    # 检查摄像头是否打开
-    if not cap.isOpened():
-        logger.error("无法打开摄像头")
-        return
+    # 打开摄像头并启动后台采集线程，检测循环只取最新一帧
+    camera = create_camera()
+    camera_supervisor = create_supervisor('摄像头', lambda: camera if camera.open() else None,
+                                          lambda cam: cam.release(), lambda cam: cam.is_alive()).start()
     
     # 获取视频帧的宽度和高度
-    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    if camera_supervisor.is_connected():
+        width, height = camera.frame_size
+    else:
+        logger.warning("摄像头未连接，将在后台重连")
+        width, height = CAMERA_WIDTH or 640, CAMERA_HEIGHT or 480
     
-    # 设置窗口大小
-    cv2.namedWindow('YOLOv8 实时目标检测与雾化器控制', cv2.WINDOW_NORMAL)
-    cv2.resizeWindow('YOLOv8 实时目标检测与雾化器控制', width*2, height*2)
+    # 设置窗口大小（无界面模式不创建窗口）
+    show_window = DISPLAY_MODE == 'window'
+    if show_window:
+        cv2.namedWindow('YOLOv8 实时目标检测与雾化器控制', cv2.WINDOW_NORMAL)
+        cv2.resizeWindow('YOLOv8 实时目标检测与雾化器控制', width*2, height*2)
+    
+    # HTTP预览
+    preview = None
+    if PREVIEW_PORT:
+        try:
+            preview = PreviewServer(PREVIEW_HOST, PREVIEW_PORT, PREVIEW_FPS, PREVIEW_JPEG_QUALITY).start()
+        except OSError as e:
+            logger.warning(f"预览服务启动失败，将继续运行: {e}")
     
     # 计时器和FPS初始化
     prev_time = 0
     fps = 0
-    last_reset_time = time.time()
     
-    # 添加暂停检测的标志和计时器
-    paused_until = 0
-    # 添加摄像头状态标志
-    camera_closed = False
+    # 触发状态机（持续时间、置信度历史、已触发类别和暂停窗口）
+    engine = create_trigger_engine()
+    
+    # 打印队列：任务完成且没有排队的任务时提前结束暂停
+    def on_print_complete(job):
+        if spooler.depth() == 0:
+            resume_after_print(engine, job.finished_at)
+    
+    spooler = create_print_spooler(printer_supervisor, on_print_complete).start()
+    
     # 添加最后一帧的缓存
     last_frame = None
+    # 帧编号
+    frame_counter = 0
+    # 已送入模型推理的帧数
+    frames_inferred = 0
+    # 采集阶段是否处于暂停中，暂停结束时记录暂停时长
+    in_pause = False
+    last_stats_time = time.time()
+    
+    # 构建流水线：采集 → 推理 → 触发判断 → 绘制/显示（主线程）
+    pipeline = Pipeline()
+    frame_queue = pipeline.add_queue('frames', *FRAME_QUEUE_CONFIG)
+    detection_queue = pipeline.add_queue('detections', *DETECTION_QUEUE_CONFIG)
+    display_queue = pipeline.add_queue('display', *DISPLAY_QUEUE_CONFIG)
+    display_stats = pipeline.add_stats('display')
+    overlay_stats = pipeline.add_stats('overlay')
+    latency_stats = pipeline.add_stats('end_to_end')
+    
+    # 读取最新帧，读取失败时通知设备监护重连摄像头
+    def read_frame():
+        ret, frame = camera.read()
+        if not ret and not camera.is_suspended():
+            camera_supervisor.report_failure("无法读取帧", camera)
+        return ret, frame
+    
+    # 摄像头断开期间重复输出最后一帧（没有时为黑色帧），不推理也不更新触发状态
+    def offline_packet(current_time):
+        if last_frame is not None:
+            frame = last_frame.copy()
+        else:
+            frame = np.zeros((height, width, 3), dtype=np.uint8)
+        time.sleep(PAUSED_FRAME_INTERVAL)
+        packet = FramePacket(frame_counter, frame, current_time)
+        packet.camera_offline = True
+        packet.skipped = True
+        return packet
+    
+    # 采集阶段：读取最新帧，暂停期间挂起采集（设备保持打开，不重新协商格式）
+    def capture_stage(_):
+        nonlocal last_frame, frame_counter, in_pause
+        
+        current_time = time.time()
+        frame_counter += 1
+        mark_frame(frame_counter)
+        
+        # 摄像头断开，等待设备监护重连
+        if not camera_supervisor.is_connected():
+            return offline_packet(current_time)
+        
+        # 检查是否处于暂停状态
+        if engine.is_paused(current_time):
+            in_pause = True
+            # 计算剩余暂停时间
+            remaining_time = engine.remaining(current_time)
+            camera_should_run = engine.camera_should_run(current_time)
+            
+            # 暂停开始后1秒挂起采集
+            if not camera.is_suspended() and not camera_should_run:
+                logger.info("暂停检测1秒后，挂起摄像头采集")
+                camera.suspend()
+            
+            # 暂停结束前1秒恢复采集
+            if camera.is_suspended() and camera_should_run:
+                logger.info("暂停即将结束，恢复摄像头采集")
+                camera.resume()
+            
+            # 如果采集已挂起，使用最后一帧
+            suspended = camera.is_suspended()
+            if suspended and last_frame is not None:
+                frame = last_frame.copy()
+                time.sleep(PAUSED_FRAME_INTERVAL)
+            else:
+                # 读取帧
+                ret, frame = read_frame()
+                if not ret:
+                    if not suspended:
+                        return offline_packet(current_time)
+                    # 如果采集已挂起且没有最后一帧，创建一个黑色帧
+                    frame = np.zeros((height, width, 3), dtype=np.uint8)
+                    time.sleep(PAUSED_FRAME_INTERVAL)
+            
+            packet = FramePacket(frame_counter, frame, current_time)
+            packet.paused = True
+            packet.remaining_time = remaining_time
+            packet.camera_closed = suspended
+            return packet
+        
+        if in_pause:
+            in_pause = False
+            if engine.paused_since is not None:
+                event_store.record(PAUSE, value=engine.paused_until - engine.paused_since)
+        
+        # 打印提前完成时暂停可能在采集挂起期间结束
+        if camera.is_suspended():
+            logger.info("暂停已结束，恢复摄像头采集")
+            camera.resume()
+        
+        # 读取最新帧
+        ret, frame = read_frame()
+        if not ret:
+            return offline_packet(current_time)
+        
+        # 保存最后一帧用于暂停期间显示
+        last_frame = frame.copy()
+        return FramePacket(frame_counter, frame, current_time)
+    
+    # 推理阶段
+    def infer_stage(packet):
+        nonlocal frames_inferred
+        mark_frame(packet.frame_id)
+        run_inference(packet, backend, governor, motion_gate)
+        if packet.inferred:
+            frames_inferred += 1
+        return packet
+    
+    # 触发判断阶段
+    def trigger_stage(packet):
+        mark_frame(packet.frame_id)
+        return handle_detections(packet, engine, serial_supervisor.get(), spooler.submit)
+    
+    pipeline.add_stage('capture', capture_stage, output_queue=frame_queue)
+    pipeline.add_stage('infer', infer_stage, frame_queue, detection_queue)
+    pipeline.add_stage('trigger', trigger_stage, detection_queue, display_queue)
+    
+    # 指标服务
+    register_runtime_metrics(pipeline, camera, spooler, engine, {
+        'camera': camera_supervisor, 'serial': serial_supervisor, 'printer': printer_supervisor}, governor, motion_gate)
+    if tracer.enabled:
+        register_trace_spans(pipeline)
+    metrics_server = None
+    if METRICS_PORT:
+        try:
+            metrics_server = MetricsServer(metrics, METRICS_HOST, METRICS_PORT).start()
+        except OSError as e:
+            logger.warning(f"指标服务启动失败，将继续运行: {e}")
+    
+    # 无界面运行时通过 SIGTERM（如 systemd 停止服务）退出，与 Ctrl+C 一样执行清理
+    if threading.current_thread() is threading.main_thread():
+        def handle_sigterm(signum, frame):
+            # 清理过程中不再响应重复的信号
+            signal.signal(signal.SIGTERM, signal.SIG_IGN)
+            raise KeyboardInterrupt
+        signal.signal(signal.SIGTERM, handle_sigterm)
+        
+        # 导出在后台线程中进行，不阻塞显示循环
+        if tracer.enabled and hasattr(signal, 'SIGUSR1'):
+            def handle_sigusr1(signum, frame):
+                threading.Thread(target=dump_diagnostics, args=(tracer, profiler, TRACE_DIR, TRACE_DUMP_SECONDS),
+                                 name='trace-dump', daemon=True).start()
+            signal.signal(signal.SIGUSR1, handle_sigusr1)
     
     logger.info("开始实时检测...")
+    pipeline.start()
     
     try:
-        while True:
-            current_time = time.time()
+        # 绘制/显示阶段：cv2.imshow 必须在主线程中调用
+        while pipeline.is_running():
+            packet = display_queue.get(timeout=STAGE_POLL_INTERVAL)
+            if packet is None:
+                if show_window and cv2.waitKey(1) & 0xFF == ord('q'):
+                    break
+                continue
             
-            # 检查是否处于暂停状态
-            if current_time < paused_until:
-                # 计算剩余暂停时间
-                remaining_time = int(paused_until - current_time)
-                
-                # 暂停开始后1秒关闭摄像头
-                if not camera_closed and remaining_time < 9:  # 10-1=9秒
-                    logger.info("暂停检测1秒后，关闭摄像头")
-                    cap.release()
-                    camera_closed = True
-                
-                # 暂停结束前1秒重新打开摄像头
-                if camera_closed and remaining_time <= 1:
-                    logger.info("暂停结束前1秒，重新打开摄像头")
-                    cap = cv2.VideoCapture(0)
-                    if not cap.isOpened():
-                        logger.error("无法重新打开摄像头")
-                        break
-                    camera_closed = False
-                    
-                    # 清除所有检测持续时间记录和置信度历史
-                    detection_durations.clear()
-                    confidence_histories.clear()
-                    logger.info("暂停结束，已清除所有检测记录")
-                
-                # 如果摄像头已关闭，使用最后一帧
-                if camera_closed and last_frame is not None:
-                    frame = last_frame.copy()
-                else:
-                    # 读取帧
-                    ret, frame = cap.read()
-                    if not ret:
-                        if camera_closed:
-                            # 如果摄像头已关闭且没有最后一帧，创建一个黑色帧
-                            if last_frame is None:
-                                frame = np.zeros((height, width, 3), dtype=np.uint8)
-                            else:
-                                frame = last_frame.copy()
-                        else:
-                            logger.error("无法读取帧")
-                            break
-                
-                # 在帧上显示暂停状态
-                cv2.putText(frame, f'检测已暂停，等待打印完成: {remaining_time}秒', 
-                            (10, height - 30), cv2.FONT_HERSHEY_SIMPLEX, 
-                            1, (0, 0, 255), 2)
-                
-                if camera_closed:
-                    cv2.putText(frame, '摄像头已关闭', (10, height - 60), 
-                                cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2)
-                
+            mark_frame(packet.frame_id)
+            with display_stats.measure():
                 # 计算FPS
                 curr_time = time.time()
                 fps = 1 / (curr_time - prev_time)
                 prev_time = curr_time
                 
-                # 将FPS绘制在帧的左上角
-                cv2.putText(frame, f'FPS: {fps:.2f}', (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
-                
-                # 显示帧
-                cv2.imshow('YOLOv8 实时目标检测与雾化器控制', frame)
-                
-                # 按下'Q'键退出循环
-                if cv2.waitKey(1) & 0xFF == ord('q'):
-                    break
-                
-                continue  # 跳过检测，直接进入下一帧
-            
-            # 读取帧
-            ret, frame = cap.read()
-            
-            if not ret:
-                logger.error("无法读取帧")
-                break
-            
-            # 保存最后一帧用于暂停期间显示
-            last_frame = frame.copy()
-            
-            # 每隔RESET_INTERVAL秒重置检测记录和触发记录
-            if current_time - last_reset_time > RESET_INTERVAL:
-                triggered_classes.clear()
-                last_reset_time = current_time
-            
-            # 将帧传递给模型进行预测
-            results = model(frame, device='cpu')
-            
-            # 创建当前帧检测到的类别集合
-            current_frame_classes = set()
-            
-            # 获取预测结果并绘制在帧上
-            for result in results:
-                boxes = result.boxes.xyxy.cpu().numpy()
-                confidences = result.boxes.conf.cpu().numpy()
-                class_ids = result.boxes.cls.cpu().numpy().astype(int)
-                
-                for i in range(len(boxes)):
-                    box = boxes[i]
-                    x1, y1, x2, y2 = map(int, box[:4])
-                    confidence = confidences[i]
-                    class_id = class_ids[i]
-                    
-                    # 获取类别名称
-                    if class_id in CLASS_NAMES:
-                        label = CLASS_NAMES[class_id]
-                    else:
-                        label = f"Class {class_id}"
-                    
-                    # 绘制边界框和标签
-                    cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 255, 0), 2)
-                    cv2.putText(frame, f'{label} {confidence:.2f}', (x1, y1 - 10), 
-                                cv2.FONT_HERSHEY_SIMPLEX, 0.9, (36, 255, 12), 2)
+                # 只有窗口显示或预览需要新帧时才绘制
+                if show_window or (preview is not None and preview.wants_frame()):
+                    with overlay_stats.measure():
+                        frame = draw_overlay(packet, fps, height)
+                    if preview is not None:
+                        preview.publish(frame)
                     
-                    # 记录当前帧检测到的类别
-                    current_frame_classes.add(class_id)
-                    
-                    # 如果检测到目标类别
-                    if class_id in CLASS_NAMES.keys():
-                        # 更新置信度历史记录并计算平均置信度
-                        avg_confidence = update_confidence_history(class_id, confidence)
-                        
-                        # 更新检测持续时间
-                        if class_id in detection_durations:
-                            start_time, _ = detection_durations[class_id]
-                            detection_durations[class_id] = (start_time, current_time)
-                        else:
-                            detection_durations[class_id] = (current_time, current_time)
-                        
-                        # 检查是否持续检测超过阈值时间
-                        start_time, last_seen_time = detection_durations[class_id]
-                        detection_duration = last_seen_time - start_time
+                    if show_window:
+                        # 显示帧
+                        shown = tracer.begin()
+                        cv2.imshow('YOLOv8 实时目标检测与雾化器控制', frame)
                         
-                        # 在帧上显示平均置信度和持续时间
-                        info_text = f"Avg: {avg_confidence:.2f}, Time: {detection_duration:.1f}s"
-                        cv2.putText(frame, info_text, (x1, y2 + 20), 
-                                    cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 255), 2)
-                        
-                        # 如果持续检测时间超过阈值且平均置信度大于阈值且该类别尚未触发
-                        if (detection_duration >= DETECTION_DURATION_THRESHOLD and 
-                            avg_confidence > CONFIDENCE_THRESHOLD and 
-                            class_id not in triggered_classes):
-                            
-                            nebulizer_id = class_id + 1  # 雾化器ID从1开始
-                            logger.info(f"检测到 {label} 持续 {detection_duration:.2f} 秒，平均置信度: {avg_confidence:.2f}，触发雾化器 {nebulizer_id}")
-                            
-                            # 发送命令开启雾化器
-                            if send_command(ser, nebulizer_id, True):
-                                # 标记该类别已触发
-                                triggered_classes.add(class_id)
-                                
-                                # 执行打印
-                                if printer is not None:
-                                    # 创建一个新线程来执行打印，避免阻塞主线程
-                                    import threading
-                                    def print_thread():
-                                        try:
-                                            # 打印Logo
-                                            print_logo(printer)
-                                            # 打印检测信息和内容
-                                            print_detection_info(printer, class_id, avg_confidence)
-                                            logger.info(f"类别 {label} 的打印任务已完成")
-                                        except Exception as e:
-                                            logger.error(f"打印线程出错: {e}")
-                                    
-                                    # 启动打印线程
-                                    threading.Thread(target=print_thread).start()
-                                    logger.info(f"已启动打印线程，打印类别 {label} 的信息")
-                                    
-                                    # 设置暂停检测10秒
-                                    paused_until = current_time + 10
-                                    logger.info(f"检测已暂停，将在10秒后恢复")
-                                    
-                                    # 在帧上显示暂停状态
-                                    cv2.putText(frame, "检测已暂停，等待打印完成: 10秒", 
-                                                (10, height - 30), cv2.FONT_HERSHEY_SIMPLEX, 
-                                                1, (0, 0, 255), 2)
-            
-            # 清理不再出现在当前帧中的类别的持续时间记录
-            classes_to_remove = []
-            for class_id in detection_durations:
-                if class_id not in current_frame_classes:
-                    classes_to_remove.append(class_id)
-            
-            for class_id in classes_to_remove:
-                del detection_durations[class_id]
-            
-            # 计算FPS
-            curr_time = time.time()
-            fps = 1 / (curr_time - prev_time)
-            prev_time = curr_time
-            
-            # 将FPS绘制在帧的左上角
-            cv2.putText(frame, f'FPS: {fps:.2f}', (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
+                        # 按下'Q'键退出循环
+                        key = cv2.waitKey(1) & 0xFF
+                        tracer.end(SPAN_IMSHOW, shown)
+                        if key == ord('q'):
+                            break
             
-            # 显示帧
-            cv2.imshow('YOLOv8 实时目标检测与雾化器控制', frame)
+            # 从采集到显示完成的端到端延迟
+            latency_stats.record(time.time() - packet.timestamp)
             
-            # 按下'Q'键退出循环
-            if cv2.waitKey(1) & 0xFF == ord('q'):
-                break
+            # 定期输出采集/丢弃/推理帧数统计和各阶段耗时
+            if curr_time - last_stats_time > STATS_LOG_INTERVAL:
+                stats = camera.stats()
+                logger.info(f"帧统计: 采集 {stats.get('captured', 0)}，丢弃 {stats.get('dropped', 0)}，挂起期间丢弃 {stats.get('discarded', 0)}，解码失败 {stats.get('corrupt', 0)}，推理 {frames_inferred}")
+                logger.info(f"摄像头: 打开 {stats['opens']} 次，打开用时 {format_ms(stats['open_ms'])}，"
+                            f"首帧延迟 {format_ms(stats['first_frame_ms'])}，恢复采集后首帧延迟 {format_ms(stats['resume_first_frame_ms'])}")
+                logger.info(f"流水线统计: {pipeline.report()}")
+                if governor is not None:
+                    gstats = governor.stats()
+                    logger.info(f"推理调度: 模式 {gstats['mode']}，推理 {gstats['inferred']}，跳过 {gstats['skipped']}，升级 {gstats['escalations']} 次")
+                if motion_gate is not None:
+                    mstats = motion_gate.stats()
+                    logger.info(f"运动门控: 检查 {mstats['checked']}，复用 {mstats['reused']}，跳过比例 {mstats['skip_ratio']:.1%}")
+                if preview is not None:
+                    vstats = preview.stats()
+                    logger.info(f"预览: 客户端 {vstats['clients']} 个，已编码 {vstats['encoded']} 帧")
+                ser = serial_supervisor.get()
+                if ser is not None:
+                    sstats = ser.stats()
+                    logger.info(f"串口({sstats['protocol']}): 发送 {sstats.get('sent', 0)}，确认 {sstats.get('acked', 0)}，重发 {sstats.get('retries', 0)}，"
+                                f"未确认 {sstats.get('unacked', 0)}，固件错误 {sstats.get('error', 0)}，"
+                                f"平均确认延迟 {sstats['ack']['avg_ms']:.0f} 毫秒(最大 {sstats['ack']['max_ms']:.0f})")
+                pstats = spooler.stats()
+                logger.info(f"打印队列: 深度 {pstats['depth']}(最大 {pstats['max_depth']})，完成 {pstats['completed']}，失败 {pstats['failed']}，去重 {pstats['deduplicated']}，"
+                            f"平均等待 {pstats['wait']['avg_ms']:.0f} 毫秒，平均打印 {pstats['print']['avg_ms']:.0f} 毫秒")
+                devices = []
+                for supervisor in (camera_supervisor, serial_supervisor, printer_supervisor):
+                    dstats = supervisor.stats()
+                    devices.append(f"{supervisor.name} {'在线' if dstats['connected'] else '离线'}"
+                                   f"(断开 {dstats['disconnects']} 次，累计离线 {dstats['downtime']:.0f} 秒)")
+                logger.info(f"设备: {'，'.join(devices)}")
+                if EVENT_DB_PATH:
+                    estats = event_store.stats()
+                    logger.info(f"事件记录: 已写入 {estats['written']}，丢弃 {estats['dropped']}，写入失败 {estats['write_errors']}")
+                last_stats_time = curr_time
     
     except KeyboardInterrupt:
         logger.info("用户中断程序")
     except Exception as e:
         logger.error(f"程序运行出错: {e}")
     finally:
-        # 关闭所有雾化器
+        # 停止流水线各阶段线程
+        pipeline.stop()
+        
+        # 等待正在打印的小票完成，未打印的任务保留在打印日志中
+        spooler.stop()
+        
+        # 关闭所有雾化器（二进制协议下合并为一帧），等待命令发送完毕后关闭串口
+        ser = serial_supervisor.get()
         if ser is not None:
-            for i in range(1, 6):
-                send_command(ser, i, False)
-            ser.close()
+            ser.send_many([(i, False, None) for i in range(1, 6)])
+            logger.info("发送命令: 关闭所有雾化器")
         
-        # 释放资源
-        cap.release()
-        cv2.destroyAllWindows()
+        # 停止设备监护并释放资源
+        serial_supervisor.stop()
+        printer_supervisor.stop()
+        camera_supervisor.stop()
+        event_store.stop()
+        if preview is not None:
+            preview.stop()
+        if metrics_server is not None:
+            metrics_server.stop()
+        if profiler is not None:
+            profiler.stop()
+        if show_window:
+            cv2.destroyAllWindows()
         
         logger.info("程序已退出")
+        stop_logging(log_listener)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()